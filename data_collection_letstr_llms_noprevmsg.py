@@ -6,28 +6,21 @@ Results for each run by each model are written to a seperate csv file.
 import sys
 import argparse
 import os
-import requests
-import csv
-import json
-import string
-import numpy as np
-import pandas as pd
-import itertools
-import time
 from datetime import datetime
-import random
-import openai
-import together
-from together import Together
-import anthropic
+from letstr_batch import submit_batch, collect_batch, BATCH_PROVIDERS
+from letstr_cache import open_cache, CACHE_MODES, DEFAULT_CACHE_PATH
+from letstr_alphabets import LATIN, GREEK, SYMBOL
+from letstr_clients import get_provider_calls
+from letstr_engine import CollectionEngine, parse_nr_list
+from letstr_items import read_items, read_testlet
+from letstr_journal import Journal, ResultsWriter, get_journal_path, parse_rowid_start, get_rowid_start
+from letstr_plan import PlanEngine, PlanResults, get_tokenizer, load_latencies
+from letstr_progress import ScoreCounters, PROGRESS_INTERVAL
+from letstr_scoring import clean_and_score
+from letstr_telemetry import Telemetry, get_metrics_path
 
 sys.path.append("..")
 
-# load API keys from environment variable
-openai.api_key = os.getenv("OPENAI_API_KEY")
-together.api_key = os.getenv("TOGETHER_API_KEY")
-anthropic.api_key = os.getenv("ANTHROPIC_API_KEY_LS")
-
 # list of models to try for each API
 #GPT_MODELS = ['gpt-3.5-turbo-0125', 'gpt-4-0613', 'gpt-4o-2024-08-06']#, 'o1-mini-2024-09-12' ,'o1-preview-2024-09-12']
 GPT_MODELS = ['gpt-4o-2024-08-06']#, 'o1-mini-2024-09-12' ,'o1-preview-2024-09-12']
@@ -51,9 +44,9 @@ TASK_INSTR = "We are going to solve puzzles with the letters or symbols "#'a b c
 #LATIN_INSTR = "The letter list is 'a b c d e f g h i j k l m n o p q r s t u v w x y z'.\n"
 #GREEK_INSTR = "The letter list is 'alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu xi omicron pi rho sigma tau upsilon phi chi psi omega'.\n"
 #SYMBOL_INSTR = "The symbol list is '* @ % ! ^ # ~ $ { = : )'.\n"
-LATIN_INSTR = " 'a b c d e f g h i j k l m n o p q r s t u v w x y z'.\n"
-GREEK_INSTR = " 'alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu xi omicron pi rho sigma tau upsilon phi chi psi omega'.\n"
-SYMBOL_INSTR = " '* @ % ! ^ # ~ $ { = : )'.\n"
+LATIN_INSTR = LATIN.render(" '{letters}'.\n")
+GREEK_INSTR = GREEK.render(" '{letters}'.\n")
+SYMBOL_INSTR = SYMBOL.render(" '{letters}'.\n")
 #ORDEREDSYMBOL_INSTR = "The symbol list is '! # $ % & ( ) * + - : ;'.\n"
 
 # return alphabet instruction given the required alphabet name
@@ -98,65 +91,192 @@ def get_item_prompt(template_nr, A, B, C):
     return item
 
 def get_items(path_to_file):
-    df = pd.read_csv(path_to_file)
+    df = read_items(path_to_file)
     return df
 
-# calls gpt model with prompt and previous messages
-def gpt_call(prompt, model):
-    '''
-    if ('o1' in model):
-        response = openai.chat.completions.create(
-            model = model,
-            max_completion_tokens = 10,
-            messages=[
-                {"role": "user", "content": SYSTEM_PROMPT + prompt}
-            ]
-        )
+def nr_ends_with_1(nr):
+    return nr % 10 == 1
+
+# items of a testlet, selected by testlet nr from the item store (letstr_item_store) when path_to_items is None
+def load_items(testlet_nr, path_to_items):
+    if (path_to_items is None):
+        return read_testlet(testlet_nr)
+    return get_items(path_to_items)
+
+# return list of models to try for the required API
+def get_models(models):
+    if (models == 'gpt'):
+        return GPT_MODELS
+    elif (models == 'together'):
+        return TOGETHER_MODELS
+    elif (models == 'anthropic'):
+        return ANTHROPIC_MODELS
     else:
-    '''
-    response = openai.chat.completions.create(
-        model = model,
-        temperature = 0.0,
-        max_tokens = 10,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": prompt}
-        ]
-    )
+        return []
 
-    return response.choices[0].message.content
+# call functions for each API, using the shared clients of letstr_clients
+PROVIDER_CALLS = get_provider_calls(SYSTEM_PROMPT)
 
-# calls together.ai hosted model with prompt and previous messages
-def together_call(prompt, model):
-    client = Together()
-    response = client.chat.completions.create(
-        model = model,
-        temperature = 0.0,
-        max_tokens = 10,
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": prompt},
-        ]
-    )
+# prompt and item prompt for the item in rowid, previous_exchange is only used if prev_exchange == 1
+def get_prompt(df, rowid, template_nr, prev_exchange, previous_exchange=''):
+    # get current item info
+    # columns are: "testletid", "itemid","alphabet","A","B","C","D"
+    itemid = df.loc[rowid, 'itemid']
+    alphabet = df.loc[rowid, 'alphabet']
+    A = df.loc[rowid, 'A']
+    B = df.loc[rowid, 'B']
+    C = df.loc[rowid, 'C']
+    
+    # start prompt with previous exchange(s)
+    if (prev_exchange == 1):
+        prompt = previous_exchange
+        # if itemid ends with 1 then new section of testlet so provide instructions
+        if (nr_ends_with_1(itemid)): 
+            if (itemid == 101): # 101 is first item, so include task instruction and example
+                instr = TASK_INSTR + get_example(template_nr)
+            else: # if not first item of test then first item of alphabet, provide new alphabet
+                instr = get_alphabet_instr(alphabet)
+        else:
+            instr = ''
+    else:
+        prompt = ''
+        instr = TASK_INSTR + get_alphabet_instr(alphabet)
+    
+    # add any required instr to prompt
+    prompt = prompt + instr
+    
+    # create item prompt
+    item_prompt = get_item_prompt(template_nr, A, B, C) 
+    
+    # add item prompt to the prompt to send to llm
+    prompt = prompt + item_prompt 
+    
+    return prompt, item_prompt
 
-    return response.choices[0].message.content
+# results row for the response of a model to the item in rowid
+def get_row(df, rowid, model, timestamp, template_nr, item_prompt, response, prompt):
+    # ['model', 'rowid', 'timestamp', 'testletid', 'itemid', 'alphabet', 'A', 'B', 'C', 'D', 'template_nr', 'item_prompt', 'response', 'prompt', 'cleaned_response', 'correct']
+    item = [df.loc[rowid, col] for col in ['testletid', 'itemid', 'alphabet', 'A', 'B', 'C', 'D']]
+    return [model, rowid, timestamp] + item + [template_nr, item_prompt, response, prompt] + list(clean_and_score(response, item[2], item[6]))
 
-# calls anthropic model with prompt and previous messages
-def anthropic_call(prompt, model):
-    client = anthropic.Anthropic(api_key = anthropic.api_key)
-    output = client.messages.create(
-        model = model, 
-        max_tokens = 10,
-        system = SYSTEM_PROMPT,
-        messages=[
-            {"role": "user", "content": prompt}
-        ]
-    )
+# collect responses of one model to the items in rowids of one testlet, items are sent in order
+async def run_chain(engine, models, model, df, rowids, template_nr, prev_exchange, results, rowid_start):
+    # set previous exchange to an empty string
+    previous_exchange = ''
+    
+    # items already collected in the run that is resumed
+    done = results.get_done(model)
+    
+    # for each item
+    for rowid in rowids:
+        # skip collected items, the previous exchange is not updated in a fresh run either (see the end of the loop)
+        if (rowid in done):
+            continue
+        # skip items before --rowid_start
+        if (rowid < get_rowid_start(rowid_start, model)):
+            continue
+        
+        # create prompt for current item
+        prompt, item_prompt = get_prompt(df, rowid, template_nr, prev_exchange, previous_exchange)
+        
+        # collect data with model
+        response = await engine.call(models, prompt = prompt, model = model, row_key = (results.results_path, rowid))
+        #print(response)
+            
+        # create row and write response to csv
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        row = get_row(df, rowid, model, timestamp, template_nr, item_prompt, response, prompt)
+        
+        # journal the item, then write and flush the csv row, and add its score to the running scores
+        results.write(model, rowid, prompt, response, row)
+        engine.scores.add(model, df.loc[rowid, 'alphabet'], template_nr, df.loc[rowid, 'itemid'], df.loc[rowid, 'D'], response, row[-2], row[-1])
+        
+        # create row and log exchange to csv
+        # log_header = ['model', 'rowid', 'timestamp', 'testletid', 'itemid', 'prompt', 'response']
+        #log_row = [model, rowid, timestamp, testletid, itemid, prompt, response]
+        #logger.writerow(log_row)
+        
+        # update previous exchange with prompt and response
+        #previous_exchange = prompt + ' ' + response + '\n'
 
-    return output.content[0].text
+# path of the results file of one job, one file per testlet and model group
+def get_results_path(job, timestamp):
+    return f"{job['output_dir']}/results_testlet{job['testlet_nr']}_template{job['template_nr']}_prevexchange{job['prev_exchange']}_{job['models']}_{timestamp}.csv"
 
-def nr_ends_with_1(nr):
-    return nr % 10 == 1
+# results file of one job, one file per testlet and model group
+def open_results(journal, job, timestamp):
+    # headers of csv files 
+    # cleaned_response and correct are scored as in data_llms/letstr_helper_dataprep.R, see letstr_scoring.py
+    header = ['model', 'rowid', 'timestamp', 'testletid', 'itemid', 'alphabet', 'A', 'B', 'C', 'D', 'template_nr', 'item_prompt', 'response', 'prompt', 'cleaned_response', 'correct']
+    return ResultsWriter(journal, get_results_path(job, timestamp), header)
+
+# chains of one job (models of a model group on the items of one testlet with one template and prev_exchange),
+# with their names and sort keys, job['model_names'] optionally replaces the model list of the group
+def build_chains(engine, results, df, job, rowid_start):
+    models = job['models']
+    template_nr = job['template_nr']
+    prev_exchange = job['prev_exchange']
+    chains = []
+    chain_names = []
+    chain_keys = []
+    for model in job.get('model_names') or get_models(models):
+        print(f"_____ Model: {model} Testlet {job['testlet_nr']} _____")
+        # with previous exchanges the items of a testlet form one chain that is sent in order,
+        # without previous exchanges every item is independent and is its own chain
+        if (prev_exchange == 1):
+            chain_rowids = [list(range(0, len(df)))]
+        else:
+            chain_rowids = [[rowid] for rowid in range(0, len(df))]
+        for rowids in chain_rowids:
+            chains.append(run_chain(engine, models, model, df, rowids, template_nr, prev_exchange, results, rowid_start))
+            chain_names.append(f"Model: {model} Testlet {job['testlet_nr']} rowids {rowids[0]}-{rowids[-1]}")
+            chain_keys.append((models, model, get_prompt(df, rowids[0], template_nr, prev_exchange)[0]))
+    return chains, chain_names, chain_keys
+
+# submit all items of the run as one batch per API, responses are written with --collect_batch
+def submit_batches(args, testlets, template_nr, timestamp):
+    settings = {'use_template': template_nr, 'prev_exchange': args.prev_exchange, 'output_dir': args.output_dir, 'run_id': timestamp}
+    for models in args.models.split(','):
+        requests = []
+        for testlet_nr, path_to_items in testlets.items():
+            df = load_items(testlet_nr, path_to_items)
+            for model in get_models(models):
+                for rowid in range(0, len(df)):
+                    prompt, item_prompt = get_prompt(df, rowid, template_nr, args.prev_exchange)
+                    requests.append({'custom_id': f'request-{len(requests)}', 'testlet_nr': testlet_nr, 'path_to_items': path_to_items,
+                                     'models': models, 'model': model, 'rowid': rowid, 'prompt': prompt, 'item_prompt': item_prompt})
+        submit_batch(models, requests, SYSTEM_PROMPT, f'{args.output_dir}/batch', f'{models}_{timestamp}', settings, args.batch_base_url)
+
+# wait for a submitted batch and write its responses to the results files of the run
+def write_batch_results(args):
+    manifest, responses = collect_batch(args.collect_batch, args.poll_interval, args.batch_base_url)
+    settings = manifest['settings']
+    template_nr = settings['use_template']
+    timestamp = settings['run_id']
+    # the journal of the run makes collecting a batch again write every row once
+    journal = Journal(get_journal_path(settings['output_dir'], timestamp))
+    items = {}
+    files = {}
+    for request in manifest['requests']:
+        if (request['custom_id'] not in responses):
+            continue
+        testlet_nr = request['testlet_nr']
+        if (testlet_nr not in items):
+            items[testlet_nr] = load_items(testlet_nr, request['path_to_items'])
+        if ((testlet_nr, request['models']) not in files):
+            job = {'models': request['models'], 'testlet_nr': testlet_nr, 'template_nr': template_nr,
+                   'prev_exchange': settings['prev_exchange'], 'output_dir': settings['output_dir']}
+            files[(testlet_nr, request['models'])] = open_results(journal, job, timestamp)
+        results = files[(testlet_nr, request['models'])]
+        if (request['rowid'] in results.get_done(request['model'])):
+            continue
+        response = responses[request['custom_id']]
+        row = get_row(items[testlet_nr], request['rowid'], request['model'], manifest['submitted'], template_nr,
+                      request['item_prompt'], response, request['prompt'])
+        results.write(request['model'], request['rowid'], request['prompt'], response, row)
+    for results in files.values():
+        results.close()
+    journal.close()
 
 def main():
     parser = argparse.ArgumentParser()
@@ -164,127 +284,124 @@ def main():
     parser.add_argument("--path_to_items", default='items/letterstring_base_items.csv', type=str, help="Path to data file")
     #parser.add_argument("--path_to_items", default='items/testlets/letterstring_testlet0.csv', type=str, help="Path to data file")
     parser.add_argument("--testlet_nr", default=0, type=int, help="Testlet nr, i.e. variation nr for item set")
+    # RUN SEVERAL TESTLETS CONCURRENTLY, SELECTED FROM THE ITEM STORE items/letstr_items.arrow (OR items/testlets/ IF NOT BUILT)
+    parser.add_argument("--testlets", default=None, type=str, help="Testlet nrs to run concurrently, e.g. '0-54' or '1,3,5'. Overrides --path_to_items and --testlet_nr")
     parser.add_argument("--use_template", default=5, type=int, help="Which template to use? Choices 1 - 5.")
     parser.add_argument("--prev_exchange", default=0, type=int, help="Include previous exchange in next prompt? 1=yes, 0=no.")
     # MODIFY TO CHANGE MODEL GROUP
     #parser.add_argument("--models", default='gpt', type=str, help="gpt, anthropic or together")
-    parser.add_argument("--models", default='together', type=str, help="gpt, anthropic or together")
+    parser.add_argument("--models", default='together', type=str, help="gpt, anthropic or together, or a comma separated list e.g. gpt,together")
     #parser.add_argument("--models", default='anthropic', type=str, help="gpt, anthropic or together")
+    # MAX REQUESTS IN FLIGHT PER API
+    parser.add_argument("--max_concurrency", default=None, type=int, help="Max requests in flight per API, concurrency adapts up to this cap, default per API in letstr_engine.MAX_CONCURRENCY")
     # DIRECTORY TO STORE OUTPUT IN 
     parser.add_argument("--output_dir", default='data_llms/test_letstr_noprevmsg/', type=str, help="Output directory for results")
+    # RESPONSE CACHE FOR RE-RUNS OF UNCHANGED PROMPTS
+    parser.add_argument("--cache", default='use', choices=CACHE_MODES, help="use: return stored responses, refresh: call API and overwrite stored responses, off: no cache")
+    parser.add_argument("--cache_path", default=DEFAULT_CACHE_PATH, type=str, help="Path to response cache database")
+    # RUNNING SCORES DURING THE RUN
+    parser.add_argument("--progress_interval", default=PROGRESS_INTERVAL, type=int, help="Seconds between reports of the running scores per model, alphabet and template")
+    parser.add_argument("--progress_path", default=None, type=str, help="Csv file the running scores per item are written to with every report")
+    # REQUEST TELEMETRY
+    parser.add_argument("--metrics_path", default=None, type=str, help="Csv file of the latency, token, finish reason and retry metrics of every request, default <output_dir>/metrics/metrics_<run id>.csv")
     # ITEM ROW TO START WITH IN CASE OF TIMEOUTS
-    parser.add_argument("--rowid_start", default=0, type=int, help="Rowid to start with if script times out, first row indexed at 0")
+    parser.add_argument("--rowid_start", default='0', type=str, help="Rowid to start with per model if script times out, first row indexed at 0. One rowid for all models or model=rowid pairs, e.g. gpt-4-0613=5,gpt-4o-2024-08-06=12")
+    # RESUME AN INTERRUPTED RUN FROM ITS JOURNAL
+    parser.add_argument("--resume", default=None, type=str, help="Run id (timestamp in the file names) of an interrupted run to resume, use the same arguments as that run")
+    # PLAN A RUN WITHOUT CALLING THE API
+    parser.add_argument("--dry_run", "--dry-run", action='store_true', help="Render all prompts and report requests, tokens, cost and predicted wall-clock time per model, without calling the API or writing files")
+    parser.add_argument("--tokenizer", default='estimate', type=str, help="Token counter of --dry_run: estimate, tiktoken[:encoding] or module:function")
+    parser.add_argument("--latency_samples", default=None, type=str, help="Comma separated json files of latency samples (python letstr_clients.py --output) for the --dry_run time prediction")
+    # OFFLINE BATCH COLLECTION, ONLY WITHOUT PREVIOUS EXCHANGES
+    parser.add_argument("--submit_batch", "--submit-batch", action='store_true', help=f"Submit all items as one batch per API ({', '.join(BATCH_PROVIDERS)}) instead of calling the API per item")
+    parser.add_argument("--collect_batch", "--collect-batch", default=None, type=str, help="Path to the manifest of a submitted batch, waits for the batch and writes its results")
+    parser.add_argument("--batch_base_url", default=None, type=str, help="Server root of the batch API, e.g. http://127.0.0.1:8000, default the SDK base url")
+    parser.add_argument("--poll_interval", default=60, type=float, help="Seconds between batch status checks")
     args = parser.parse_args()
     
-    # get timestamp of the current date and time
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    # write the results of a submitted batch
+    if (args.collect_batch is not None):
+        write_batch_results(args)
+        return
+    if (args.submit_batch and args.dry_run):
+        parser.error('--dry_run plans a run without batches, leave out --submit_batch')
+    if (args.submit_batch and any(models not in BATCH_PROVIDERS for models in args.models.split(','))):
+        parser.error(f'--submit_batch is only available for {", ".join(BATCH_PROVIDERS)}')
+    if (args.submit_batch and args.prev_exchange == 1):
+        parser.error('--submit_batch needs independent items, use --prev_exchange 0')
+    
+    # get timestamp of the current date and time, or the run id of the run to resume
+    if (args.resume is None):
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    else:
+        timestamp = args.resume
     
-    ## GET ITEMS 
-    df = get_items(args.path_to_items)
-    # for testing use only a few items
-    #df = df.head()
-    #print(df.head())
+    # journal of completed items, used to resume the run after a crash, a dry run writes nothing
+    journal = None if args.dry_run else Journal(get_journal_path(args.output_dir, timestamp))
+    rowid_start = parse_rowid_start(args.rowid_start)
     
-    ### OPEN CSV WRITER
-    # open csv files to write llm responses and conversation log to, create writer and logger
-    f = open(f'{args.output_dir}/results_testlet{args.testlet_nr}_template{args.use_template}_prevexchange{args.prev_exchange}_{args.models}_{timestamp}.csv', 'w')
-    #log = open(f'{args.output_dir}/log/log_testlet{args.testlet_nr}_template{args.use_template}_prevexchange{args.prev_exchange}_{args.models}_{timestamp}.csv', 'w')
-    writer = csv.writer(f)
-    #logger = csv.writer(log)
-    # write headers to csv files 
-    header = ['model', 'rowid', 'timestamp', 'testletid', 'itemid', 'alphabet', 'A', 'B', 'C', 'D', 'template_nr', 'item_prompt', 'response', 'prompt']
-    writer.writerow(header)
-    #log_header = ['model', 'rowid', 'timestamp', 'testletid', 'itemid', 'prompt', 'response']
-    #logger.writerow(header)
+    # testlets to collect data for with their item files, testlets of --testlets come from the item store
+    if (args.testlets is None):
+        testlets = {args.testlet_nr: args.path_to_items}
+    else:
+        testlets = {testlet_nr: None for testlet_nr in parse_nr_list(args.testlets)}
     
-    ### VARS FOR DATA COLLECTION
-    # get num items
-    num_items = len(df) 
     # template number
     template_nr = args.use_template
     
-    ### DATA COLLECTION PREP GET MODELS
-    if (args.models == 'gpt'):
-        models = GPT_MODELS
-    elif (args.models == 'together'):
-        models = TOGETHER_MODELS
-    elif (args.models == 'anthropic'):
-        models = ANTHROPIC_MODELS
-    else:
-        models = []
+    # submit all items as batches instead of collecting them now
+    if (args.submit_batch):
+        submit_batches(args, testlets, template_nr, timestamp)
+        journal.close()
+        return
     
-    ### DATA COLLECTION
-    # call models
-    for idx, model in enumerate(models):
-        print(f'_____ Model: {model} ({idx+1}/{len(models)}) Testlet {args.testlet_nr} _____')
-        
-        # set previous exchange to an empty string
-        previous_exchange = ''
+    ### DATA COLLECTION PREP
+    if (args.dry_run):
+        cache = None
+        engine = PlanEngine(PROVIDER_CALLS, args.max_concurrency, system_prompt = SYSTEM_PROMPT,
+                            tokenizer = get_tokenizer(args.tokenizer), latencies = load_latencies(args.latency_samples))
+    else:
+        cache = open_cache(args.cache, args.cache_path)
+        engine = CollectionEngine(PROVIDER_CALLS, args.max_concurrency, cache = cache, system_prompt = SYSTEM_PROMPT,
+                                  scores = ScoreCounters(args.progress_interval, args.progress_path),
+                                  telemetry = Telemetry(args.metrics_path or get_metrics_path(args.output_dir, timestamp)))
+    chains = []
+    chain_names = []
+    files = []
+    for testlet_nr, path_to_items in testlets.items():
+        ## GET ITEMS 
+        df = load_items(testlet_nr, path_to_items)
+        # for testing use only a few items
+        #df = df.head()
+        #print(df.head())
         
-        # for each item
-        for i in range(0, num_items):
-            # get current rowid
-            rowid = i 
-            
-            # get current item info
-            # columns are: "testletid", "itemid","alphabet","A","B","C","D"
-            testletid = df.loc[rowid, 'testletid']
-            itemid = df.loc[rowid, 'itemid']
-            alphabet = df.loc[rowid, 'alphabet']
-            A = df.loc[rowid, 'A']
-            B = df.loc[rowid, 'B']
-            C = df.loc[rowid, 'C']
-            D = df.loc[rowid, 'D']
-            
-            # start prompt with previous exchange(s)
-            if (args.prev_exchange == 1):
-                prompt = previous_exchange
-                # if itemid ends with 1 then new section of testlet so provide instructions
-                if (nr_ends_with_1(itemid)): 
-                    if (itemid == 101): # 101 is first item, so include task instruction and example
-                        instr = TASK_INSTR + get_example(template_nr)
-                    else: # if not first item of test then first item of alphabet, provide new alphabet
-                        instr = get_alphabet_instr(alphabet)
-                else:
-                    instr = ''
-            else:
-                prompt = ''
-                instr = TASK_INSTR + get_alphabet_instr(alphabet)
-            
-            # add any required instr to prompt
-            prompt = prompt + instr
-            
-            # create item prompt
-            item_prompt = get_item_prompt(template_nr, A, B, C) 
+        for models in args.models.split(','):
+            ### OPEN CSV WRITER
+            # open csv file to write llm responses to
+            #log = open(f'{args.output_dir}/log/log_testlet{testlet_nr}_template{args.use_template}_prevexchange{args.prev_exchange}_{models}_{timestamp}.csv', 'w')
+            #logger = csv.writer(log)
+            job = {'models': models, 'testlet_nr': testlet_nr, 'template_nr': template_nr,
+                   'prev_exchange': args.prev_exchange, 'output_dir': args.output_dir}
+            results = PlanResults() if args.dry_run else open_results(journal, job, timestamp)
+            files.append(results)
+            #log_header = ['model', 'rowid', 'timestamp', 'testletid', 'itemid', 'prompt', 'response']
+            #logger.writerow(header)
             
-            # add item prompt to the prompt to send to llm
-            prompt = prompt + item_prompt 
-            
-            # collect data with model
-            if (args.models == 'gpt'):
-                response = gpt_call( prompt = prompt, model = model)
-            elif (args.models == 'together'):
-                response = together_call( prompt = prompt, model = model)
-            else:
-                response = anthropic_call( prompt = prompt, model = model)
-            #print(response)
-                
-            # create row and write response to csv
-            # ['model', 'rowid', 'timestamp', 'testletid', 'itemid', 'alphabet', 'A', 'B', 'C', 'D', 'template_nr', 'item_prompt', 'response', 'prompt']
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            row = [model, rowid, timestamp, testletid, itemid, alphabet, A, B, C, D, template_nr, item_prompt, response, prompt]
-            writer.writerow(row)
-            
-            # create row and log exchange to csv
-            # log_header = ['model', 'rowid', 'timestamp', 'testletid', 'itemid', 'prompt', 'response']
-            #log_row = [model, rowid, timestamp, testletid, itemid, prompt, response]
-            #logger.writerow(log_row)
-            
-            # update previous exchange with prompt and response
-            #previous_exchange = prompt + ' ' + response + '\n'
+            job_chains, job_names, job_keys = build_chains(engine, results, df, job, rowid_start)
+            chains += job_chains
+            chain_names += job_names
+    
+    ### DATA COLLECTION
+    # call models, all chains run concurrently
+    engine.run(chains, chain_names)
     
     # close csv writers and files
-    f.close()
+    for results in files:
+        results.close()
+    if (journal is not None):
+        journal.close()
+    if (cache is not None):
+        cache.close()
     #log.close()
 
 if __name__ == "__main__":
@@ -1,10 +1,17 @@
-# This script creates num_testlets from the num_variations of items 
+# This script creates num_testlets from the num_variations of items
 # based on the items that were created for children
-# A random seed is set to the testletid number so that the same item
-# testlets will be created each time
+# Testlets 6-54 were drawn with a random seed set to the testletid number,
+# these draws are kept so that the same item testlets are created each time.
+# Variation ids of testlets after 54 are drawn for all testlets at once
+# from a NumPy Generator with a fixed seed. All testlets, including
+# testlets 0-5, are written to one columnar file sorted by testletid.
+#
+#     python create_letterstring_llm_testlets.py --num_testlets 1000
+#     python create_letterstring_llm_testlets.py --write_csv   # also write testlets/letterstring_testlet{n}.csv
 
+import argparse
+import numpy as np
 import pandas as pd
-import string
 import random
 
 # filenames containing item variations
@@ -15,77 +22,78 @@ filenames_item_variations = ['testlets/letterstring_testlet0.csv', # this is a c
         'testlets/letterstring_testlet4.csv', # copy of variation 4 items
         'testlets/letterstring_testlet5.csv'] # copy of variation 5 items
 
-# empty dictionary to hold item dfs
-dfs = {}
-
-# read each testlet into a df and store in the dictionary with keys df1, df2, etc.
-for i, variation_csv in enumerate(filenames_item_variations, 0):
-    dfs[f'df{i}'] = pd.read_csv(variation_csv)
-
 # define loop vars
 num_variations = 6 # we already have variations 0-5, these are also the first 5 testlets
-num_testlets = 54 # in preregistration we specified 54 testlets
+num_preregistered = 54 # in preregistration we specified 54 testlets, their draws are kept
 num_items = 5 # num items per alphabet per testlet
 alphabets = ["Latin", "Greek", "Symbol"]
 
 itemid_examples = [101, 102]
 
-def get_example_items():
-    # examples are first two items in each df
-    example1 = dfs['df0'].loc[0].copy()
-    example2 = dfs['df0'].loc[1].copy()
-    
-    return example1, example2
-
+# variation ids of a preregistered testlet, drawn with python's random seeded with the testletid
 def get_item_variations_list(seed):
     item_vars = []
-    
+
     # set seed to create reproducible item sets
     random.seed(seed)
-    
+
     # now choose a random variation id for each item
-    # note only 5 items so that the same item in different alphabets 
+    # note only 5 items so that the same item in different alphabets
     # are parallel (i.e., have same location in alphabet sequence)
-    for i in range(1, num_items + 1): 
+    for i in range(1, num_items + 1):
         item_vars.append(random.randint(0, num_variations - 1))
-    
+
     return item_vars
 
-# function to find the right index of the item to copy from a testlet
-def get_item_index(alphabet, index):
-    # index + 2 because we want to skip the two example items
-    new_index = index + 2 
-    
-    if (alphabet == 'Greek'):
-        new_index = new_index + 5 # to skip the Latin items
-    if (alphabet == 'Symbol'):
-        new_index = new_index + 10 # to skip the Latin and Greek items
-    
-    return new_index
-
-for testletid in range(num_variations, num_testlets + 1):
-    # create an empty df
-    new_df = pd.DataFrame(columns=dfs['df0'].columns.tolist())
-    
-    # add two example items to new df
-    example1, example2 = get_example_items()
-    new_df = new_df.append(example1, ignore_index=True)
-    new_df = new_df.append(example2, ignore_index=True)
-    
-    # generate list of item variations to use for this testlet
-    item_variations = get_item_variations_list(testletid)
-    
-    # iterate through alphabets
-    for alphabet in alphabets:
-        # iterate through item variations
-        for i, var in enumerate(item_variations, 0):
-            # copy item from testlet with variationnr var append to new df
-            copied_item = dfs[f'df{var}'].loc[get_item_index(alphabet, i)].copy()
-            new_df = new_df.append(copied_item, ignore_index=True)
-    
-    # set testletid for new testlet
-    new_df['testletid'] = testletid
+# variation ids of testlets num_variations to num_testlets, shape (testlets, num_items).
+# Testlets after the preregistered ones are drawn in one step, always starting at testlet
+# num_preregistered + 1, so a testlet gets the same items whatever num_testlets is
+def draw_item_variations(num_testlets, seed):
+    item_vars = [get_item_variations_list(testletid) for testletid in range(num_variations, min(num_testlets, num_preregistered) + 1)]
+    if (num_testlets > num_preregistered):
+        rng = np.random.default_rng(seed)
+        item_vars = np.concatenate([np.array(item_vars, dtype = np.int64).reshape(-1, num_items),
+                                    rng.integers(0, num_variations, size = (num_testlets - num_preregistered, num_items))])
+    return np.array(item_vars, dtype = np.int64).reshape(-1, num_items)
+
+# rows of the items of each testlet in the stacked variations, shape (testlets, items per testlet):
+# the two example items of variation 0, then for each alphabet the item i of variation item_vars[i].
+# Rows of a variation are the two example items, the Latin, then the Greek, then the Symbol items
+def get_item_rows(item_vars, num_rows):
+    alphabet_offsets = 2 + num_items * np.arange(0, len(alphabets))
+    item_rows = item_vars[:, None, :] * num_rows + alphabet_offsets[None, :, None] + np.arange(0, num_items)[None, None, :]
+    example_rows = np.broadcast_to(np.arange(0, len(itemid_examples)), (len(item_vars), len(itemid_examples)))
+    return np.concatenate([example_rows, item_rows.reshape(len(item_vars), -1)], axis = 1)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_testlets", default=num_preregistered, type=int, help="Last testletid to create")
+    parser.add_argument("--seed", default=54, type=int, help="Seed of the NumPy Generator for testlets after the preregistered 54")
+    parser.add_argument("--output", default='testlets/letterstring_testlets.parquet', type=str, help="Columnar file with all testlets, sorted by testletid")
+    parser.add_argument("--write_csv", action='store_true', help="Also write testlets/letterstring_testlet{n}.csv for every created testlet")
+    args = parser.parse_args()
+
+    # read each variation and stack them, the rows of variation v start at v * num_rows
+    dfs = [pd.read_csv(variation_csv) for variation_csv in filenames_item_variations]
+    num_rows = len(dfs[0])
+    variations = pd.concat(dfs, ignore_index=True)
+
+    # copy the items of all new testlets at once
+    item_vars = draw_item_variations(args.num_testlets, args.seed)
+    item_rows = get_item_rows(item_vars, num_rows)
+    new_df = variations.iloc[item_rows.reshape(-1)].reset_index(drop=True)
+    # set testletid for new testlets
+    new_df['testletid'] = np.repeat(np.arange(num_variations, num_variations + len(item_vars)), item_rows.shape[1])
+
+    # testlets 0-5 are the variations themselves
+    testlets = pd.concat([variations, new_df], ignore_index=True)
+    testlets.to_parquet(args.output, index=False)
+    print(f'{testlets["testletid"].nunique()} testlets written to {args.output}')
+
     # set output filename to 'letterstring_testletx.csv' where x=testletid
-    # write new df csv to file
-    new_df.to_csv(f'testlets/letterstring_testlet{testletid}.csv', index=False)
-    print(f'testlet{testletid} done')
+    if (args.write_csv):
+        for testletid, testlet in new_df.groupby('testletid'):
+            testlet.to_csv(f'testlets/letterstring_testlet{testletid}.csv', index=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+'''
+Vectorized item variations for the create_*_item_variations.py scripts.
+The letter strings A, B, C and D of all items are encoded once as integer
+index arrays, -1 padded to the longest string, with the letters of every
+alphabet numbered consecutively in one table. All shift distances are
+applied to all items in one NumPy broadcast and the shifted indices are
+checked against the range of each item's alphabet, so a shift that would
+move a letter past the start or end of its alphabet is rejected instead
+of wrapping around.
+'''
+import numpy as np
+
+STRING_COLUMNS = ['A', 'B', 'C', 'D']
+
+class AlphabetTable:
+    '''
+    Letters of several alphabets numbered consecutively, alphabets maps an
+    alphabet name to its ordered list of letters.
+    '''
+    def __init__(self, alphabets):
+        self.names = list(alphabets)
+        self.letters = np.array([letter for name in self.names for letter in alphabets[name]], dtype = object)
+        self.start = {}
+        self.index = {}
+        offset = 0
+        for name in self.names:
+            self.start[name] = offset
+            # letters are looked up per alphabet, the same letter may be in several alphabets
+            self.index[name] = {letter: offset + i for i, letter in enumerate(alphabets[name])}
+            offset += len(alphabets[name])
+        self.end = {name: self.start[name] + len(alphabets[name]) for name in self.names}
+
+    # index array of the letter strings of items, shape (n items, n columns, longest string), -1 padded
+    def encode(self, alphabet_names, columns):
+        n_letters = max(len(string.split()) for strings in columns for string in strings)
+        codes = np.full((len(alphabet_names), len(columns), n_letters), -1, dtype = np.int32)
+        for i, name in enumerate(alphabet_names):
+            index = self.index[name]
+            for j, strings in enumerate(columns):
+                letters = strings[i].split()
+                unknown = [letter for letter in letters if letter not in index]
+                if (unknown):
+                    raise ValueError(f'{unknown} not in the {name} alphabet: {strings[i]}')
+                codes[i, j, :len(letters)] = [index[letter] for letter in letters]
+        return codes
+
+    # letter strings of an index array, the inverse of encode, built one letter position at a time
+    def decode(self, codes):
+        codes = codes.reshape(-1, codes.shape[-1])
+        letters = self.letters[np.where(codes >= 0, codes, 0)]
+        strings = np.where(codes[:, 0] >= 0, letters[:, 0], '')
+        for k in range(1, codes.shape[1]):
+            strings = np.where(codes[:, k] >= 0, strings + ' ' + letters[:, k], strings)
+        return strings
+
+# shift every item by every shift distance, shifts of items where fixed is True are 0.
+# Returns the shifted index array of shape (n shifts, n items, n columns, longest string) and
+# an (n shifts, n items) mask of the variations that stay within the alphabet of their item
+def shift_codes(codes, shifts, start, end, fixed=None):
+    shifts = np.asarray(shifts, dtype = np.int32)[:, None]
+    if (fixed is not None):
+        shifts = np.where(np.asarray(fixed)[None, :], 0, shifts)
+    padding = codes < 0
+    shifted = np.where(padding, -1, codes + shifts[:, :, None, None])
+    inside = padding | ((shifted >= start[:, None, None]) & (shifted < end[:, None, None]))
+    return shifted, inside.all(axis = (2, 3))
+
+# variations of the items in df (columns alphabet and A-D), one per shift distance in shifts,
+# alphabets maps alphabet names to their letters, rows where fixed is True are copied unchanged.
+# Returns the A-D strings of all variations as a dict of lists, shift by shift in the order of
+# df, and raises a ValueError naming the items and shifts that leave their alphabet
+def make_variations(df, alphabets, shifts, fixed=None):
+    table = AlphabetTable(alphabets)
+    names = list(df['alphabet'])
+    codes = table.encode(names, [list(df[column]) for column in STRING_COLUMNS])
+    start = np.array([table.start[name] for name in names])
+    end = np.array([table.end[name] for name in names])
+    shifted, inside = shift_codes(codes, shifts, start, end, fixed)
+    if (not inside.all()):
+        outside = [f"itemid {df['itemid'].iloc[i]} ({names[i]}) shift {shifts[s]}" for s, i in zip(*np.nonzero(~inside))]
+        raise ValueError(f'Shifts leave the alphabet for {len(outside)} variations: ' + ', '.join(outside))
+    strings = table.decode(shifted).reshape(len(shifts), len(names), len(STRING_COLUMNS))
+    return {column: list(strings[:, :, j].reshape(-1)) for j, column in enumerate(STRING_COLUMNS)}
@@ -0,0 +1,89 @@
+'''
+Alphabets of the letter-string tasks in one place.
+Every alphabet holds its ordered letters with a letter -> index dict and
+precomputed successor, predecessor and shift tables, so lookups are O(1)
+instead of list.index. Instruction strings of the collection scripts are
+rendered from the letters, and the Greek <-> Latin maps match the ones
+used in data_llms/letstr_helper_dataprep.R to clean responses.
+
+The Symbol alphabet differs between tasks, TASK_ALPHABETS holds the one
+each task shows and its item files use:
+    SYMBOL            * @ % ! ^ # ~ $ { = : )   letterstring items and testlets, noprevmsg, nextprevlet
+    SYMBOL_EXTENDED   SYMBOL followed by | + ; \\ ( < - & > /   rulecheck
+    ORDERED_SYMBOL    ! # $ % & ( ) * + - : ;   ordered by unicode, letstr_orderedsymbols items and the
+                                                letstr script (Appendix B)
+'''
+
+class Alphabet:
+    '''
+    Ordered letters (or symbols) of an alphabet, name is the value of the
+    alphabet column of the item files.
+    '''
+    def __init__(self, name, letters):
+        self.name = name
+        self.letters = tuple(letters)
+        self.size = len(self.letters)
+        self.index = {letter: i for i, letter in enumerate(self.letters)}
+        self.shift_tables = {}
+        self.successor = self.get_shift_table(1)
+        self.predecessor = self.get_shift_table(-1)
+
+    # letter -> letter n places further, letters that would leave the alphabet are left out
+    def get_shift_table(self, n):
+        if (n not in self.shift_tables):
+            self.shift_tables[n] = {letter: self.letters[i + n] for i, letter in enumerate(self.letters) if 0 <= i + n < self.size}
+        return self.shift_tables[n]
+
+    # string of letters separated by spaces shifted n places, None if a letter leaves the alphabet
+    def shift(self, string, n):
+        table = self.get_shift_table(n)
+        letters = string.split()
+        if (any(letter not in table for letter in letters)):
+            return None
+        return ' '.join(table[letter] for letter in letters)
+
+    def encode(self, string):
+        return [self.index[letter] for letter in string.split()]
+
+    def decode(self, indices):
+        return ' '.join(self.letters[index] for index in indices)
+
+    # first n letters as an alphabet of their own
+    def head(self, n):
+        return Alphabet(self.name, self.letters[:n])
+
+    # template with the letters separated by spaces filled in for {letters}
+    def render(self, template):
+        return template.format(letters = ' '.join(self.letters))
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"Alphabet({self.name}: {' '.join(self.letters)})"
+
+LATIN = Alphabet('Latin', 'a b c d e f g h i j k l m n o p q r s t u v w x y z'.split())
+GREEK = Alphabet('Greek', ('alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu xi omicron pi rho sigma tau '
+                           'upsilon phi chi psi omega').split())
+SYMBOL = Alphabet('Symbol', '* @ % ! ^ # ~ $ { = : )'.split())
+SYMBOL_EXTENDED = Alphabet('Symbol', r'* @ % ! ^ # ~ $ { = : ) | + ; \ ( < - & > /'.split())
+ORDERED_SYMBOL = Alphabet('Symbol', '! # $ % & ( ) * + - : ;'.split())
+
+# alphabets of each task by the alphabet column of its item files
+TASK_ALPHABETS = {
+    'letstr': {'Latin': LATIN, 'Greek': GREEK, 'Symbol': ORDERED_SYMBOL},
+    'letstr_testlets': {'Latin': LATIN, 'Greek': GREEK, 'Symbol': SYMBOL},
+    'letstr_noprevmsg': {'Latin': LATIN, 'Greek': GREEK, 'Symbol': SYMBOL},
+    'rulecheck': {'Latin': LATIN, 'Greek': GREEK, 'Symbol': SYMBOL_EXTENDED},
+    'nextprevlet': {'Latin': LATIN, 'Greek': GREEK, 'Symbol': SYMBOL},
+}
+
+def get_alphabet(name, task='letstr'):
+    return TASK_ALPHABETS[task][name]
+
+# Greek letter names <-> Latin letters by position, alpha = a to omega = x
+GREEK_TO_LATIN = dict(zip(GREEK.letters, LATIN.letters))
+LATIN_TO_GREEK = {latin: greek for greek, latin in GREEK_TO_LATIN.items()}
+
+# Greek characters -> letter names, as written in responses
+GREEK_CHARACTERS = dict(zip('αβγδεζηθικλμνξοπρστυφχψω', GREEK.letters))
@@ -0,0 +1,140 @@
+'''
+Offline batch submission of independent prompts (prev_exchange = 0) with
+the OpenAI Batch API and the Anthropic Message Batches API.
+--submit_batch renders all prompts of a run into the provider batch json
+lines format, submits them and writes a manifest next to the batch file;
+--collect_batch <manifest> polls the batch until it has ended and the
+data collection script writes the responses to the usual results csv.
+
+Batches are sent to the SDK default server, or to the server root given
+with --batch_base_url, e.g. http://127.0.0.1:8000 for the local stand-in
+batch server of letstr_batch_server.py, whose --check runs a small batch
+per API end to end.
+TogetherAI has no batch endpoint in the SDK version used here.
+'''
+import json
+import os
+import time
+from datetime import datetime
+from letstr_clients import build_client, get_sampling_params
+from letstr_scheduler import is_retryable
+
+BATCH_PROVIDERS = ['gpt', 'anthropic']
+OPENAI_BATCH_ENDPOINT = '/v1/chat/completions'
+COMPLETION_WINDOW = '24h'
+
+# batch json lines of requests, each request is a dict with custom_id, model and prompt
+def render_requests(provider, requests, system_prompt):
+    lines = []
+    for request in requests:
+        params = get_sampling_params(provider)
+        if (provider == 'gpt'):
+            body = {'model': request['model'],
+                    'messages': [{"role": "system", "content": system_prompt},
+                                 {"role": "user", "content": request['prompt']}]}
+            body.update(params)
+            lines.append({'custom_id': request['custom_id'], 'method': 'POST', 'url': OPENAI_BATCH_ENDPOINT, 'body': body})
+        elif (provider == 'anthropic'):
+            body = {'model': request['model'], 'system': system_prompt,
+                    'messages': [{"role": "user", "content": request['prompt']}]}
+            body.update(params)
+            lines.append({'custom_id': request['custom_id'], 'params': body})
+        else:
+            raise ValueError(f'No batch API for {provider}, choose from {BATCH_PROVIDERS}')
+    return lines
+
+def write_jsonl(path, lines):
+    with open(path, 'w') as f:
+        for line in lines:
+            f.write(json.dumps(line) + '\n')
+
+# anthropic sdk versions expose message batches under messages or beta.messages
+def get_anthropic_batches(client):
+    if (hasattr(client.messages, 'batches')):
+        return client.messages.batches
+    return client.beta.messages.batches
+
+# client for the batch API, base_url is the server root, openai clients expect the /v1 prefix in it
+def build_batch_client(provider, base_url=None):
+    if (base_url is not None and provider == 'gpt'):
+        base_url = base_url.rstrip('/') + '/v1'
+    return build_client(provider, base_url)
+
+# submit the rendered batch file, returns the batch id
+def submit_jsonl(provider, jsonl_path, lines, base_url=None):
+    client = build_batch_client(provider, base_url)
+    if (provider == 'gpt'):
+        with open(jsonl_path, 'rb') as f:
+            input_file = client.files.create(file = f, purpose = 'batch')
+        batch = client.batches.create(input_file_id = input_file.id, endpoint = OPENAI_BATCH_ENDPOINT,
+                                      completion_window = COMPLETION_WINDOW)
+    else:
+        batch = get_anthropic_batches(client).create(requests = lines)
+    return batch.id
+
+# status of a batch as (ended, status)
+def get_batch_status(client, provider, batch_id):
+    if (provider == 'gpt'):
+        batch = client.batches.retrieve(batch_id)
+        return batch.status in ('completed', 'failed', 'expired', 'cancelled'), batch.status
+    batch = get_anthropic_batches(client).retrieve(batch_id)
+    return batch.processing_status == 'ended', batch.processing_status
+
+# responses of an ended batch as {custom_id: response text}, failed requests are left out
+def get_batch_responses(client, provider, batch_id):
+    responses = {}
+    if (provider == 'gpt'):
+        batch = client.batches.retrieve(batch_id)
+        if (batch.output_file_id is None):
+            return responses
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if (not line.strip()):
+                continue
+            result = json.loads(line)
+            response = result.get('response') or {}
+            if (result.get('error') is None and response.get('status_code') == 200):
+                responses[result['custom_id']] = response['body']['choices'][0]['message']['content']
+    else:
+        for result in get_anthropic_batches(client).results(batch_id):
+            if (result.result.type == 'succeeded'):
+                responses[result.custom_id] = result.result.message.content[0].text
+    return responses
+
+# render, write and submit requests of one provider, and write the manifest needed to collect them
+def submit_batch(provider, requests, system_prompt, batch_dir, name, settings, base_url=None):
+    os.makedirs(batch_dir, exist_ok = True)
+    jsonl_path = os.path.join(batch_dir, f'batch_{name}.jsonl')
+    manifest_path = os.path.join(batch_dir, f'batch_{name}_manifest.json')
+    lines = render_requests(provider, requests, system_prompt)
+    write_jsonl(jsonl_path, lines)
+    batch_id = submit_jsonl(provider, jsonl_path, lines, base_url)
+    manifest = {'provider': provider, 'batch_id': batch_id, 'batch_file': jsonl_path,
+                'submitted': datetime.now().strftime("%Y%m%d%H%M%S"),
+                'settings': settings, 'requests': requests}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent = 1)
+    print(f'_____ Submitted batch {batch_id} with {len(requests)} requests, collect with --collect_batch {manifest_path} _____')
+    return manifest_path
+
+# poll the batch of a manifest until it has ended, returns the manifest and {custom_id: response text}
+def collect_batch(manifest_path, poll_interval=60, base_url=None):
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    provider = manifest['provider']
+    client = build_batch_client(provider, base_url)
+    while True:
+        try:
+            ended, status = get_batch_status(client, provider, manifest['batch_id'])
+        except Exception as err:
+            if (not is_retryable(err)):
+                raise
+            ended, status = False, f'{type(err).__name__}, retrying'
+        print(f'_____ Batch {manifest["batch_id"]}: {status} _____')
+        if (ended):
+            break
+        time.sleep(poll_interval)
+    responses = get_batch_responses(client, provider, manifest['batch_id'])
+    missing = [request['custom_id'] for request in manifest['requests'] if request['custom_id'] not in responses]
+    if (len(missing) > 0):
+        print(f'!!!!! {len(missing)} of {len(manifest["requests"])} requests have no response: {missing[:10]}')
+    return manifest, responses
@@ -0,0 +1,253 @@
+'''
+Local stand-in batch server for testing --submit_batch and --collect_batch
+without an API account. It serves the endpoints letstr_batch uses: the
+OpenAI files and batches endpoints (upload of the batch file, create,
+retrieve, output file content) and the Anthropic message batches endpoints
+(create, retrieve, results). A batch is in progress at its first status
+check and ended from the second, so the polling of collect_batch is run.
+Every request is answered with the text of get_answer, every fail_every-th
+request of a batch fails (0: none).
+
+    python letstr_batch_server.py --port 8000
+    python data_collection_letstr_rulecheck_llms.py --models gpt --submit_batch --batch_base_url http://127.0.0.1:8000
+
+--check runs a small rulecheck batch per API end to end through the data
+collection script against a server on a free port and checks the rows of
+the results files against the answers of the server:
+
+    python letstr_batch_server.py --check
+'''
+import argparse
+import csv
+import glob
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from email.parser import BytesParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# response text of a request of a batch
+def get_answer(custom_id, model):
+    return f'{model} {custom_id}'
+
+class BatchState:
+    '''
+    Uploaded files and batches of a server, batches are answered when they
+    are created and their status moves on with every retrieve.
+    '''
+    def __init__(self, fail_every=0):
+        self.fail_every = fail_every
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.files = {}
+        self.batches = {}
+
+    def new_id(self, prefix):
+        return f'{prefix}_{next(self.ids)}'
+
+    def is_failed(self, nr):
+        return self.fail_every > 0 and (nr + 1) % self.fail_every == 0
+
+    # output lines of an openai batch file
+    def answer_openai(self, lines):
+        output = []
+        for nr, line in enumerate(lines):
+            if (self.is_failed(nr)):
+                output.append({'id': self.new_id('batch_req'), 'custom_id': line['custom_id'], 'response': None,
+                               'error': {'code': 'server_error', 'message': 'Failed by the stand-in server'}})
+                continue
+            body = {'id': self.new_id('chatcmpl'), 'object': 'chat.completion', 'created': int(time.time()), 'model': line['body']['model'],
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': get_answer(line['custom_id'], line['body']['model'])},
+                                 'finish_reason': 'stop'}],
+                    'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}}
+            output.append({'id': self.new_id('batch_req'), 'custom_id': line['custom_id'],
+                           'response': {'status_code': 200, 'request_id': self.new_id('req'), 'body': body}, 'error': None})
+        return output
+
+    # result lines of an anthropic message batch
+    def answer_anthropic(self, requests):
+        output = []
+        for nr, request in enumerate(requests):
+            if (self.is_failed(nr)):
+                output.append({'custom_id': request['custom_id'], 'result': {'type': 'errored', 'error': {
+                    'type': 'error', 'error': {'type': 'api_error', 'message': 'Failed by the stand-in server'}}}})
+                continue
+            model = request['params']['model']
+            message = {'id': self.new_id('msg'), 'type': 'message', 'role': 'assistant', 'model': model,
+                       'content': [{'type': 'text', 'text': get_answer(request['custom_id'], model)}],
+                       'stop_reason': 'end_turn', 'stop_sequence': None, 'usage': {'input_tokens': 0, 'output_tokens': 0}}
+            output.append({'custom_id': request['custom_id'], 'result': {'type': 'succeeded', 'message': message}})
+        return output
+
+class BatchHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, content_type='application/json', status=200):
+        if (not isinstance(body, bytes)):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('content-type', content_type)
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_not_found(self):
+        self.send_body({'error': {'type': 'not_found_error', 'message': f'No {self.path}'}}, status = 404)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('content-length', 0)))
+
+    # name -> (filename, content) of the parts of a multipart form
+    def read_form(self):
+        message = BytesParser().parsebytes(b'content-type: ' + self.headers['content-type'].encode() + b'\r\n\r\n' + self.read_body())
+        return {part.get_param('name', header = 'content-disposition'): (part.get_filename(), part.get_payload(decode = True))
+                for part in message.get_payload()}
+
+    # openai batch object, the status moves from in_progress to completed with every retrieve
+    def get_openai_batch(self, batch):
+        status = 'completed' if batch['retrieved'] > 1 else 'in_progress'
+        return {'id': batch['id'], 'object': 'batch', 'endpoint': batch['endpoint'], 'input_file_id': batch['input_file_id'],
+                'completion_window': batch['completion_window'], 'status': status, 'created_at': batch['created_at'],
+                'output_file_id': batch['output_file_id'] if status == 'completed' else None, 'error_file_id': None,
+                'request_counts': {'total': batch['n_requests'], 'completed': batch['n_requests'] - batch['n_failed'], 'failed': batch['n_failed']}}
+
+    # anthropic message batch object, the status moves from in_progress to ended with every retrieve
+    def get_anthropic_batch(self, batch):
+        ended = batch['retrieved'] > 1
+        root = f'http://{self.headers["host"]}'
+        return {'id': batch['id'], 'type': 'message_batch', 'processing_status': 'ended' if ended else 'in_progress',
+                'request_counts': {'processing': 0 if ended else batch['n_requests'], 'succeeded': batch['n_requests'] - batch['n_failed'] if ended else 0,
+                                   'errored': batch['n_failed'] if ended else 0, 'canceled': 0, 'expired': 0},
+                'created_at': batch['created_at_iso'], 'expires_at': batch['created_at_iso'], 'ended_at': batch['created_at_iso'] if ended else None,
+                'archived_at': None, 'cancel_initiated_at': None,
+                'results_url': f'{root}/v1/messages/batches/{batch["id"]}/results' if ended else None}
+
+    def do_POST(self):
+        state = self.server.state
+        path = self.path.split('?')[0]
+        with state.lock:
+            if (path == '/v1/files'):
+                form = self.read_form()
+                file_id = state.new_id('file')
+                filename, content = form['file']
+                state.files[file_id] = content
+                return self.send_body({'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                                       'filename': filename, 'purpose': form['purpose'][1].decode(), 'status': 'processed'})
+            if (path == '/v1/batches'):
+                body = json.loads(self.read_body())
+                lines = [json.loads(line) for line in state.files[body['input_file_id']].decode().splitlines() if line.strip()]
+                output = state.answer_openai(lines)
+                output_file_id = state.new_id('file')
+                state.files[output_file_id] = ''.join(json.dumps(line) + '\n' for line in output).encode()
+                batch = {'id': state.new_id('batch'), 'endpoint': body['endpoint'], 'input_file_id': body['input_file_id'],
+                         'completion_window': body['completion_window'], 'created_at': int(time.time()), 'retrieved': 0,
+                         'output_file_id': output_file_id, 'n_requests': len(lines), 'n_failed': sum(line['error'] is not None for line in output)}
+                state.batches[batch['id']] = batch
+                return self.send_body(self.get_openai_batch(batch))
+            if (path == '/v1/messages/batches'):
+                body = json.loads(self.read_body())
+                output = state.answer_anthropic(body['requests'])
+                batch = {'id': state.new_id('msgbatch'), 'created_at_iso': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'retrieved': 0,
+                         'output': output, 'n_requests': len(output), 'n_failed': sum(line['result']['type'] != 'succeeded' for line in output)}
+                state.batches[batch['id']] = batch
+                return self.send_body(self.get_anthropic_batch(batch))
+        self.send_not_found()
+
+    def do_GET(self):
+        state = self.server.state
+        parts = self.path.split('?')[0].strip('/').split('/')
+        with state.lock:
+            if (parts[:2] == ['v1', 'batches'] and len(parts) == 3 and parts[2] in state.batches):
+                batch = state.batches[parts[2]]
+                batch['retrieved'] += 1
+                return self.send_body(self.get_openai_batch(batch))
+            if (parts[:2] == ['v1', 'files'] and len(parts) == 4 and parts[3] == 'content' and parts[2] in state.files):
+                return self.send_body(state.files[parts[2]], 'application/jsonl')
+            if (parts[:3] == ['v1', 'messages', 'batches'] and len(parts) >= 4 and parts[3] in state.batches):
+                batch = state.batches[parts[3]]
+                if (len(parts) == 5 and parts[4] == 'results'):
+                    return self.send_body(''.join(json.dumps(line) + '\n' for line in batch['output']).encode(), 'application/binary')
+                batch['retrieved'] += 1
+                return self.send_body(self.get_anthropic_batch(batch))
+        self.send_not_found()
+
+# server on 127.0.0.1, port 0 picks a free port
+def start_server(port=0, fail_every=0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), BatchHandler)
+    server.state = BatchState(fail_every)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+# rulecheck batches of n_items items per API submitted and collected through the data collection script,
+# returns the number of mismatches between the results rows and the requests of the manifests
+def run_check(n_items=3, fail_every=4):
+    server = start_server(0, fail_every)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_collection_letstr_rulecheck_llms.py')
+    items_path = os.path.join(os.path.dirname(script), 'items', 'rulecheck_item_variations.csv')
+    # the clients need api keys, the stand-in server does not check them
+    env = dict(os.environ, OPENAI_API_KEY = 'stand-in', ANTHROPIC_API_KEY_LS = 'stand-in')
+    errors = 0
+    with tempfile.TemporaryDirectory() as output_dir:
+        os.makedirs(os.path.join(output_dir, 'log'))
+        path_to_items = os.path.join(output_dir, 'items.csv')
+        with open(items_path, newline = '') as f_in, open(path_to_items, 'w', newline = '') as f_out:
+            f_out.writelines(itertools.islice(f_in, n_items + 1))
+        subprocess.run([sys.executable, script, '--models', 'gpt,anthropic', '--submit_batch', '--batch_base_url', base_url,
+                        '--path_to_items', path_to_items, '--output_dir', output_dir], check = True, env = env)
+        for manifest_path in sorted(glob.glob(os.path.join(output_dir, 'batch', '*_manifest.json'))):
+            subprocess.run([sys.executable, script, '--collect_batch', manifest_path, '--batch_base_url', base_url,
+                            '--poll_interval', '0.1'], check = True, env = env)
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            results_path = os.path.join(output_dir, f"results_rulecheck_{manifest['provider']}_{manifest['settings']['run_id']}.csv")
+            with open(results_path, newline = '') as f:
+                rows = {(row['model'], int(row['rowid'])): row for row in csv.DictReader(f)}
+            with open(path_to_items, newline = '') as f:
+                items = list(csv.DictReader(f))
+            # every answered request has its row with the answer of the server, failed requests have none
+            for nr, request in enumerate(manifest['requests']):
+                row = rows.pop((request['model'], request['rowid']), None)
+                if (server.state.is_failed(nr)):
+                    expected = None
+                else:
+                    expected = (get_answer(request['custom_id'], request['model']), items[request['rowid']]['itemid'])
+                found = None if row is None else (row['response'], row['itemid'])
+                if (found != expected):
+                    print(f"!!!!! {manifest['provider']} {request['custom_id']}: expected {expected}, found {found}")
+                    errors += 1
+            errors += len(rows)
+            print(f"_____ {manifest['provider']}: {len(manifest['requests'])} requests, results rows checked, {len(rows)} unexpected rows _____")
+    server.shutdown()
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", default=8000, type=int, help="Port of the server on 127.0.0.1")
+    parser.add_argument("--fail_every", default=0, type=int, help="Every n-th request of a batch fails, 0 for none")
+    parser.add_argument("--check", action='store_true', help="Run a small rulecheck batch per API end to end against a server on a free port and check the results rows")
+    parser.add_argument("--n_items", default=3, type=int, help="Items per batch of --check")
+    args = parser.parse_args()
+
+    if (args.check):
+        errors = run_check(args.n_items, args.fail_every or 4)
+        print(f'_____ Batch check {"passed" if errors == 0 else f"failed with {errors} mismatches"} _____')
+        sys.exit(1 if errors > 0 else 0)
+    server = start_server(args.port, args.fail_every)
+    print(f'_____ Stand-in batch server on http://127.0.0.1:{args.port} _____')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+'''
+Persistent on-disk cache of LLM responses.
+Responses are stored in SQLite under a hash of everything that determines
+the response: provider, model, system prompt, the full message list and
+the sampling parameters. Re-running unchanged prompts (after a crash, an
+R-side change or when adding a model) then returns the stored response
+instantly and without cost.
+
+Cache modes, set with --cache on the data collection scripts:
+    use      read from and write to the cache (default)
+    refresh  ignore stored responses, call the API and overwrite them
+    off      do not use the cache
+Only deterministic calls (temperature 0) are cached. Anthropic calls use
+the API default temperature, so they are sampled and always sent to the
+API, a stored response would hide the variation between runs.
+'''
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+CACHE_MODES = ['use', 'refresh', 'off']
+DEFAULT_CACHE_PATH = '.letstr_cache/responses.sqlite'
+
+# eviction defaults: entries unused for longer than max_age_days are removed and the least
+# recently used entries are removed once the cache holds more than max_size_mb of responses
+MAX_AGE_DAYS = 365
+MAX_SIZE_MB = 512
+
+# only calls with temperature 0 return the same response for the same request
+def is_deterministic(params):
+    return params.get('temperature') == 0
+
+# hash of the request that determines the response
+def make_key(provider, model, system_prompt, messages, params):
+    request = {'provider': provider, 'model': model, 'system': system_prompt,
+               'messages': messages, 'params': params}
+    encoded = json.dumps(request, sort_keys = True, ensure_ascii = False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, mode='use', max_age_days=MAX_AGE_DAYS, max_size_mb=MAX_SIZE_MB):
+        if (mode not in CACHE_MODES):
+            raise ValueError(f'Unknown cache mode: {mode}, choose from {CACHE_MODES}')
+        self.path = path
+        self.mode = mode
+        self.max_age_days = max_age_days
+        self.max_size_mb = max_size_mb
+        self.hits = 0
+        self.misses = 0
+        # sampled calls, not looked up or stored
+        self.skipped = 0
+        if (os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                key TEXT PRIMARY KEY,
+                                provider TEXT,
+                                model TEXT,
+                                response TEXT,
+                                size INTEGER,
+                                created REAL,
+                                last_used REAL)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+        self.conn.commit()
+        self.evict()
+
+    # stored response for key or None, only looks up in mode 'use'
+    def get(self, key):
+        if (self.mode != 'use'):
+            return None
+        row = self.conn.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+        if (row is None):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute('UPDATE responses SET last_used = ? WHERE key = ?', (time.time(), key))
+        self.conn.commit()
+        return row[0]
+
+    def put(self, key, provider, model, response):
+        if (self.mode == 'off' or response is None):
+            return
+        now = time.time()
+        self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                          (key, provider, model, response, len(response.encode('utf-8')), now, now))
+        self.conn.commit()
+
+    # remove entries that are too old, then least recently used entries above the size limit
+    def evict(self):
+        cutoff = time.time() - self.max_age_days * 24 * 60 * 60
+        self.conn.execute('DELETE FROM responses WHERE last_used < ?', (cutoff,))
+        max_size = self.max_size_mb * 1024 * 1024
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if (total > max_size):
+            to_remove = total - max_size
+            removed = 0
+            keys = []
+            for key, size in self.conn.execute('SELECT key, size FROM responses ORDER BY last_used'):
+                keys.append((key,))
+                removed += size
+                if (removed >= to_remove):
+                    break
+            self.conn.executemany('DELETE FROM responses WHERE key = ?', keys)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+# cache for the --cache and --cache_path arguments of a data collection script, None if off
+def open_cache(mode, path=DEFAULT_CACHE_PATH):
+    if (mode == 'off'):
+        return None
+    return ResponseCache(path, mode)
@@ -0,0 +1,275 @@
+'''
+Registry of long-lived API clients for OpenAI, TogetherAI and Anthropic,
+shared by all data collection scripts.
+One sync and one async client is built per provider on first use and is
+reused for every model and item, so requests reuse keep-alive connections
+instead of paying client construction and a TLS handshake per call.
+
+Provider SDKs are imported when the first client of that provider is
+built, so a run with --models gpt never imports together or anthropic.
+The http clients of all providers mark the arrival of response headers
+for the request telemetry (letstr_telemetry).
+
+Run as a script to compare per-call latency of a new client per request
+(the old behaviour) with the pooled client:
+    python letstr_clients.py --models together --n_calls 20
+'''
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+from functools import partial
+from letstr_prompt_cache import get_anthropic_messages
+from letstr_telemetry import mark_first_byte, mark_first_byte_async
+
+# environment variables holding the API key of each provider
+API_KEY_ENV = {'gpt': 'OPENAI_API_KEY', 'together': 'TOGETHER_API_KEY', 'anthropic': 'ANTHROPIC_API_KEY_LS'}
+
+# connection pool of the http clients, idle connections are kept alive for reuse
+MAX_CONNECTIONS = 64
+MAX_KEEPALIVE_CONNECTIONS = 32
+KEEPALIVE_EXPIRY = 120
+
+# retries are left to letstr_scheduler, which adapts concurrency to rate limit errors
+MAX_RETRIES = 0
+
+# sampling parameters used for every call
+TEMPERATURE = 0.0
+MAX_TOKENS = 10
+
+_clients = {}
+_async_clients = {}
+
+def get_api_key(provider):
+    return os.getenv(API_KEY_ENV[provider])
+
+# response hooks of the http clients, time to first byte of the request in flight
+def get_event_hooks(use_async=False):
+    return {'response': [mark_first_byte_async if use_async else mark_first_byte]}
+
+def get_http_limits():
+    import httpx
+    return httpx.Limits(max_connections = MAX_CONNECTIONS,
+                        max_keepalive_connections = MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry = KEEPALIVE_EXPIRY)
+
+# build a new sync client for a provider, base_url points the client at another server
+# (e.g. a local stand-in), by default the SDK base url or its *_BASE_URL environment variable
+def build_client(provider, base_url=None):
+    if (provider == 'gpt'):
+        import openai
+        return openai.OpenAI(api_key = get_api_key(provider), max_retries = MAX_RETRIES, base_url = base_url,
+                             http_client = openai.DefaultHttpxClient(limits = get_http_limits(), event_hooks = get_event_hooks()))
+    elif (provider == 'together'):
+        import together
+        return together.Together(api_key = get_api_key(provider), max_retries = MAX_RETRIES, base_url = base_url,
+                                 http_client = together.DefaultHttpxClient(limits = get_http_limits(), event_hooks = get_event_hooks()))
+    elif (provider == 'anthropic'):
+        import anthropic
+        return anthropic.Anthropic(api_key = get_api_key(provider), max_retries = MAX_RETRIES, base_url = base_url,
+                                   http_client = anthropic.DefaultHttpxClient(limits = get_http_limits(), event_hooks = get_event_hooks()))
+    raise ValueError(f'Unknown provider: {provider}')
+
+# build a new async client for a provider, base_url as for build_client
+def build_async_client(provider, base_url=None):
+    if (provider == 'gpt'):
+        import openai
+        return openai.AsyncOpenAI(api_key = get_api_key(provider), max_retries = MAX_RETRIES, base_url = base_url,
+                                  http_client = openai.DefaultAsyncHttpxClient(limits = get_http_limits(), event_hooks = get_event_hooks(True)))
+    elif (provider == 'together'):
+        import together
+        return together.AsyncTogether(api_key = get_api_key(provider), max_retries = MAX_RETRIES, base_url = base_url,
+                                      http_client = together.DefaultAsyncHttpxClient(limits = get_http_limits(), event_hooks = get_event_hooks(True)))
+    elif (provider == 'anthropic'):
+        import anthropic
+        return anthropic.AsyncAnthropic(api_key = get_api_key(provider), max_retries = MAX_RETRIES, base_url = base_url,
+                                        http_client = anthropic.DefaultAsyncHttpxClient(limits = get_http_limits(), event_hooks = get_event_hooks(True)))
+    raise ValueError(f'Unknown provider: {provider}')
+
+# shared sync client of a provider
+def get_client(provider):
+    if (provider not in _clients):
+        _clients[provider] = build_client(provider)
+    return _clients[provider]
+
+# shared async client of a provider, async clients are bound to the running event loop
+def get_async_client(provider):
+    loop = asyncio.get_running_loop()
+    if (provider not in _async_clients or _async_clients[provider][0] is not loop):
+        _async_clients[provider] = (loop, build_async_client(provider))
+    return _async_clients[provider][1]
+
+def close_clients():
+    for client in _clients.values():
+        if (hasattr(client, 'close')):
+            client.close()
+    _clients.clear()
+
+# close the async clients of the running event loop, call before the loop ends
+async def close_async_clients():
+    loop = asyncio.get_running_loop()
+    for provider, (client_loop, client) in list(_async_clients.items()):
+        if (client_loop is loop):
+            if (hasattr(client, 'close')):
+                await client.close()
+            del _async_clients[provider]
+
+# sampling parameters sent with each call of a provider, anthropic uses its default temperature
+def get_sampling_params(provider):
+    if (provider == 'anthropic'):
+        return {'max_tokens': MAX_TOKENS}
+    return {'temperature': TEMPERATURE, 'max_tokens': MAX_TOKENS}
+
+# messages sent to openai and together chat models, history holds the user and assistant
+# messages of previous exchanges
+def get_chat_messages(prompt, system_prompt, history=None):
+    return [
+        {"role": "system", "content": system_prompt}
+    ] + (history or []) + [
+        {"role": "user", "content": prompt}
+    ]
+
+# calls gpt model with prompt and previous messages, prefix_parts are the previous exchanges
+# a flat prompt starts with, history the previous exchanges as messages (see letstr_conversation),
+# usage is an optional letstr_prompt_cache.TokenUsage or letstr_telemetry.RequestMetrics
+def gpt_call(prompt, model, system_prompt, client=None, prefix_parts=None, history=None, usage=None):
+    client = client or get_client('gpt')
+    response = client.chat.completions.create(
+        model = model,
+        temperature = TEMPERATURE,
+        max_tokens = MAX_TOKENS,
+        messages = get_chat_messages(prompt, system_prompt, history)
+    )
+    if (usage is not None):
+        usage.add('gpt', model, response)
+    return response.choices[0].message.content
+
+# calls together.ai hosted model with prompt and previous messages
+def together_call(prompt, model, system_prompt, client=None, prefix_parts=None, history=None, usage=None):
+    client = client or get_client('together')
+    response = client.chat.completions.create(
+        model = model,
+        temperature = TEMPERATURE,
+        max_tokens = MAX_TOKENS,
+        messages = get_chat_messages(prompt, system_prompt, history)
+    )
+    if (usage is not None):
+        usage.add('together', model, response)
+    return response.choices[0].message.content
+
+# calls anthropic model with prompt and previous messages, previous exchanges are marked for prompt caching
+def anthropic_call(prompt, model, system_prompt, client=None, prefix_parts=None, history=None, usage=None):
+    client = client or get_client('anthropic')
+    output = client.messages.create(
+        model = model,
+        max_tokens = MAX_TOKENS,
+        system = system_prompt,
+        messages = get_anthropic_messages(prompt, model, system_prompt, prefix_parts, history)
+    )
+    if (usage is not None):
+        usage.add('anthropic', model, output)
+    return output.content[0].text
+
+async def gpt_call_async(prompt, model, system_prompt, prefix_parts=None, history=None, usage=None):
+    response = await get_async_client('gpt').chat.completions.create(
+        model = model,
+        temperature = TEMPERATURE,
+        max_tokens = MAX_TOKENS,
+        messages = get_chat_messages(prompt, system_prompt, history)
+    )
+    if (usage is not None):
+        usage.add('gpt', model, response)
+    return response.choices[0].message.content
+
+async def together_call_async(prompt, model, system_prompt, prefix_parts=None, history=None, usage=None):
+    response = await get_async_client('together').chat.completions.create(
+        model = model,
+        temperature = TEMPERATURE,
+        max_tokens = MAX_TOKENS,
+        messages = get_chat_messages(prompt, system_prompt, history)
+    )
+    if (usage is not None):
+        usage.add('together', model, response)
+    return response.choices[0].message.content
+
+async def anthropic_call_async(prompt, model, system_prompt, prefix_parts=None, history=None, usage=None):
+    output = await get_async_client('anthropic').messages.create(
+        model = model,
+        max_tokens = MAX_TOKENS,
+        system = system_prompt,
+        messages = get_anthropic_messages(prompt, model, system_prompt, prefix_parts, history)
+    )
+    if (usage is not None):
+        usage.add('anthropic', model, output)
+    return output.content[0].text
+
+SYNC_CALLS = {'gpt': gpt_call, 'together': together_call, 'anthropic': anthropic_call}
+ASYNC_CALLS = {'gpt': gpt_call_async, 'together': together_call_async, 'anthropic': anthropic_call_async}
+
+# call functions for each provider with the system prompt of a task bound,
+# called as call(prompt = prompt, model = model) like the old *_call functions,
+# optionally with prefix_parts, history and usage
+def get_provider_calls(system_prompt, use_async=True):
+    calls = ASYNC_CALLS if use_async else SYNC_CALLS
+    return {provider: partial(call, system_prompt = system_prompt) for provider, call in calls.items()}
+
+### LATENCY REPORT
+# percentile of a sorted list of samples, nearest rank
+def percentile(sorted_samples, q):
+    if (len(sorted_samples) == 0):
+        return float('nan')
+    rank = max(1, math.ceil(q / 100 * len(sorted_samples)))
+    return sorted_samples[rank - 1]
+
+def latency_summary(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    return {'n': n,
+            'mean': sum(samples) / n if n else float('nan'),
+            'p50': percentile(samples, 50),
+            'p95': percentile(samples, 95),
+            'p99': percentile(samples, 99)}
+
+# time n_calls calls, either with a new client per call or with the shared client
+def time_calls(provider, model, n_calls, pooled, prompt, system_prompt):
+    samples = []
+    for i in range(0, n_calls):
+        start = time.perf_counter()
+        client = get_client(provider) if pooled else build_client(provider)
+        SYNC_CALLS[provider](prompt, model, system_prompt, client = client)
+        samples.append(time.perf_counter() - start)
+        if (not pooled and hasattr(client, 'close')):
+            client.close()
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", default='together', type=str, help="gpt, anthropic or together")
+    parser.add_argument("--model", default=None, type=str, help="Model to call, default first model of the group")
+    parser.add_argument("--n_calls", default=20, type=int, help="Number of calls per condition")
+    parser.add_argument("--output", default=None, type=str, help="Optional json file to write latency samples to")
+    args = parser.parse_args()
+
+    default_models = {'gpt': 'gpt-4o-2024-08-06', 'together': 'meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo',
+                      'anthropic': 'claude-3-5-sonnet-20241022'}
+    model = args.model or default_models[args.models]
+    system_prompt = "You are a helpful assistant that solves letter-string analogies. Only give the answer, no other words or text.\n"
+    prompt = "If a b changes to a c, what does g h change to ?"
+
+    report = {'provider': args.models, 'model': model, 'samples': {}}
+    for condition, pooled in [('client_per_call', False), ('pooled_client', True)]:
+        samples = time_calls(args.models, model, args.n_calls, pooled, prompt, system_prompt)
+        report['samples'][condition] = samples
+        summary = latency_summary(samples)
+        print(f"{condition:>16}: n={summary['n']} mean={summary['mean']:.3f}s p50={summary['p50']:.3f}s "
+              f"p95={summary['p95']:.3f}s p99={summary['p99']:.3f}s")
+    close_clients()
+
+    if (args.output is not None):
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+'''
+Conversation of a chain of items with previous exchanges.
+Completed exchanges are kept both as user/assistant messages and in the
+flat form of the collected results (all previous prompts and responses in
+one user message). Flat is the default, so new runs send the same prompts
+as data_llms/results_letstr/; messages sends the history as chat messages,
+so the work per item grows with the length of the new turn instead of
+with the whole history, but the model sees a different prompt.
+Log files hold the flat rendering of the history in both formats.
+
+Conversation formats, set with --conversation_format:
+    flat      previous exchanges and the new turn are one user message (default)
+    messages  previous exchanges are user and assistant messages
+'''
+
+CONVERSATION_FORMATS = ['flat', 'messages']
+
+class Conversation:
+    def __init__(self):
+        # completed exchanges as chat messages and in the flat form 'turn response\n'
+        self.messages = []
+        self.exchanges = []
+
+    def add_exchange(self, turn, response):
+        self.messages.append({"role": "user", "content": turn})
+        self.messages.append({"role": "assistant", "content": response})
+        self.exchanges.append(turn + ' ' + response + '\n')
+
+    # flat prompt of the next turn, all previous exchanges followed by the turn
+    def render(self, turn):
+        return ''.join(self.exchanges) + turn
@@ -0,0 +1,159 @@
+'''
+Asyncio engine for LLM data collection.
+Every model x testlet chain of items is an independent task. Items within
+a chain are sent in order, so previous exchanges can be included in the
+next prompt, while chains run concurrently with a cap on the number of
+requests in flight per provider. Requests go through letstr_scheduler,
+which enforces rate budgets, adapts concurrency up to the cap and retries
+rate limit and transient errors. With a letstr_cache.ResponseCache,
+stored responses of deterministic calls (temperature 0) are returned
+without calling the API. Previous exchanges,
+passed as history messages or as prefix_parts of a flat prompt, are marked
+for provider-side prompt caching (see letstr_prompt_cache) and input tokens served from the provider cache are
+reported at the end of a run. Scripts add the scored responses to the
+running scores of the engine (letstr_progress), which are reported while
+the run goes on and at its end. Every request is timed and its tokens,
+finish reason and retries are recorded by the telemetry of the engine
+(letstr_telemetry), keyed to the results row given by the chain.
+'''
+import asyncio
+import copy
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from letstr_cache import make_key, is_deterministic
+from letstr_clients import close_async_clients, get_sampling_params, MAX_TOKENS
+from letstr_progress import ScoreCounters
+from letstr_prompt_cache import TokenUsage
+from letstr_scheduler import Scheduler, estimate_tokens
+from letstr_telemetry import Telemetry, current_request
+
+# default maximum number of requests in flight per provider
+MAX_CONCURRENCY = {'gpt': 8, 'together': 8, 'anthropic': 4}
+
+# parse a list of numbers such as '0-54' or '1,3,10-12' into a list of ints
+def parse_nr_list(nrs):
+    nr_list = []
+    for part in nrs.split(','):
+        if ('-' in part):
+            start, end = part.split('-')
+            nr_list.extend(range(int(start), int(end) + 1))
+        else:
+            nr_list.append(int(part))
+    return nr_list
+
+class CollectionEngine:
+    '''
+    Runs data collection chains concurrently.
+    call_fns maps a provider name ('gpt', 'together', 'anthropic') to a
+    call function taking prompt, model, prefix_parts, history and usage
+    keyword arguments, either a coroutine function (see
+    letstr_clients.get_provider_calls) or a blocking function which is run
+    in a thread.
+    max_concurrency is either an int used for every provider or a dict
+    with a cap per provider, None uses MAX_CONCURRENCY.
+    rate_limits overrides letstr_scheduler.RATE_LIMITS.
+    cache is an optional letstr_cache.ResponseCache, system_prompt is the
+    system prompt bound to the call functions and is part of the cache key.
+    scores is the letstr_progress.ScoreCounters of the run, None reports
+    every letstr_progress.PROGRESS_INTERVAL seconds without a csv file.
+    telemetry is the letstr_telemetry.Telemetry of the run, None reports
+    latencies at the end without a metrics file.
+    '''
+    def __init__(self, call_fns, max_concurrency=None, rate_limits=None, cache=None, system_prompt=None, scores=None, telemetry=None):
+        self.call_fns = call_fns
+        if (max_concurrency is None):
+            self.max_concurrency = dict(MAX_CONCURRENCY)
+        elif (isinstance(max_concurrency, int)):
+            self.max_concurrency = {provider: max_concurrency for provider in call_fns}
+        else:
+            self.max_concurrency = dict(max_concurrency)
+        self.rate_limits = rate_limits
+        self.cache = cache
+        self.system_prompt = system_prompt
+        self.scheduler = None
+        self.usage = TokenUsage()
+        self.scores = ScoreCounters() if scores is None else scores
+        self.telemetry = Telemetry() if telemetry is None else telemetry
+        self.root = self
+
+    # engine for another task with its own call functions and system prompt, sharing scheduler,
+    # cache, token usage, scores and telemetry with this engine so the chains of several tasks run together
+    def for_task(self, call_fns, system_prompt):
+        engine = copy.copy(self)
+        engine.call_fns = call_fns
+        engine.system_prompt = system_prompt
+        return engine
+
+    # send one prompt to a model, waiting for budget and a free slot for the provider,
+    # prefix_parts are the previous exchanges of a chain a flat prompt starts with,
+    # history the previous exchanges as user and assistant messages (see letstr_conversation),
+    # row_key is (results file, rowid) of the results row of the response for the telemetry
+    async def call(self, provider, prompt, model, prefix_parts=None, history=None, row_key=None):
+        call_fn = self.call_fns[provider]
+        metrics = self.telemetry.start(provider, model, row_key, self.usage)
+        
+        # return stored response for an unchanged deterministic request, sampled calls always go to the API
+        params = get_sampling_params(provider)
+        use_cache = self.cache is not None and is_deterministic(params)
+        if (self.cache is not None and not use_cache):
+            self.cache.skipped += 1
+        if (use_cache):
+            messages = (history or []) + [{"role": "user", "content": prompt}]
+            key = make_key(provider, model, self.system_prompt, messages, params)
+            response = self.cache.get(key)
+            if (response is not None):
+                metrics.source = 'cache'
+                self.telemetry.finish(metrics)
+                return response
+
+        # the metrics of the request take the place of the token usage, and are the current request
+        # of the http hooks (blocking calls get a copy of the context in their thread)
+        async def request():
+            kwargs = {'prompt': prompt, 'model': model, 'prefix_parts': prefix_parts, 'history': history, 'usage': metrics}
+            metrics.begin_attempt()
+            context_token = current_request.set(metrics)
+            try:
+                if (inspect.iscoroutinefunction(call_fn)):
+                    return await call_fn(**kwargs)
+                return await asyncio.to_thread(call_fn, **kwargs)
+            finally:
+                current_request.reset(context_token)
+
+        tokens = estimate_tokens(prompt) + sum(estimate_tokens(message["content"]) for message in history or []) + MAX_TOKENS
+        try:
+            response = await self.root.scheduler.call(provider, model, request, tokens)
+        except Exception as err:
+            metrics.fail(err)
+            raise
+        finally:
+            self.telemetry.finish(metrics)
+        if (use_cache):
+            self.cache.put(key, provider, model, response)
+        return response
+
+    async def run_chains(self, chains):
+        # blocking calls run in threads, make sure there is a thread for every slot
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers = sum(self.max_concurrency.values())))
+        # the scheduler holds asyncio primitives so it is created for the running event loop
+        self.scheduler = Scheduler(self.max_concurrency, self.rate_limits)
+        try:
+            return await asyncio.gather(*chains, return_exceptions = True)
+        finally:
+            await close_async_clients()
+
+    # run all chains (coroutines) until done, a failing chain does not stop the others
+    def run(self, chains, names=None):
+        results = asyncio.run(self.run_chains(chains))
+        failed = [(i, res) for i, res in enumerate(results) if isinstance(res, BaseException)]
+        for i, err in failed:
+            name = names[i] if names is not None else f'chain {i}'
+            print(f'!!!!! {name} failed: {type(err).__name__}: {err}')
+        if (self.cache is not None and self.cache.mode == 'use'):
+            print(f'_____ Cache: {self.cache.hits} hits, {self.cache.misses} misses, {self.cache.skipped} sampled calls not cached _____')
+        self.usage.report()
+        self.telemetry.report()
+        self.telemetry.close()
+        self.scores.report()
+        self.scores.export()
+        return results
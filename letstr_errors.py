@@ -0,0 +1,228 @@
+'''
+Rule-based error coding of responses, the categories of
+analysis/letstr_errors_analyze.R plus finer categories for wrong rules.
+For every distinct item (itemid, alphabet, A, B, C, D) a bank of candidate
+answers is computed once: the transformations of
+analysis/letstr_transformations.R (literal rule, one of two rules,
+repetition, successor and predecessor of C, copies of A, B and C) and,
+from the rules of the item (ITEM_RULES, applied by letstr_rules),
+the answer with a rule moved to another position, with another distance
+or in the other direction, and the answer written in Latin letters. A
+response is then coded with one hash lookup of (item, cleaned response) in
+the banks instead of transforming C for every row, so a whole data set is
+coded in one pass, and single responses can be coded during collection
+(classify_response, banks are memoized).
+
+Categories, the first that applies:
+    correct, empty             scored correct, no response
+    literal_rule, one_rule,    as in letstr_errors_analyze.R
+    copy_rule, incorrect_rule
+    wrong_position             a rule of the item applied to other letters
+    wrong_distance             successor or predecessor by another distance
+    wrong_direction            successor instead of predecessor or the other way round
+    latin_leakage              Greek or Symbol item answered in Latin letters
+    other
+error_detail names the candidate that matched, e.g. copy_C or
+incorrect_rule_successor_1 (the response columns of letstr_data_errorcoded.csv).
+
+Check against letstr_data_errorcoded.csv and time the coding of a data set:
+    python letstr_errors.py
+'''
+import argparse
+import time
+from functools import lru_cache
+from letstr_alphabets import LATIN, get_alphabet
+from letstr_rules import apply_rule, parse_rule, SCOPES
+
+# rules that map C to D for each item, applied in order
+ITEM_RULES = {
+    101: ['successor(all,1)'],
+    102: ['repetition(second,2)'],
+    1001: ['successor(second,1)'],
+    1002: ['successor(second,1)', 'repetition(all,2)'],
+    1003: ['successor(second,2)'],
+    1004: ['successor(second,1)', 'repetition(second,2)'],
+    1005: ['predecessor(first,1)', 'predecessor(second,1)'],
+}
+
+CATEGORIES = ['correct', 'empty', 'literal_rule', 'one_rule', 'copy_rule', 'incorrect_rule',
+              'wrong_position', 'wrong_distance', 'wrong_direction', 'latin_leakage', 'other']
+
+# letters of an item string separated by single spaces. Greek letter names are separated by any
+# whitespace, Latin letters and symbols may also be written without spaces (human item files)
+def normalize(string, alphabet):
+    if (alphabet == 'Greek'):
+        return ' '.join(string.split())
+    return ' '.join(char for char in string if not char.isspace())
+
+# letters of a string with the first or last letter moved n places, wrapping around the alphabet as
+# successor and predecessor of letstr_transformations.R, '' if the letter is not in the alphabet
+def shift_letter(alphabet, string, which, n):
+    letters = string.split(' ')
+    position = 0 if which == 'first' else len(letters) - 1
+    if (letters[position] not in alphabet.index):
+        return ''
+    letters[position] = alphabet.letters[(alphabet.index[letters[position]] + n) % alphabet.size]
+    return ' '.join(letters)
+
+# repetition of letstr_transformations.R
+def repeat_letters(string, which, n):
+    letters = string.split(' ')
+    if (which == 'first'):
+        return ' '.join([letters[0]] * n + letters[1:])
+    if (which == 'last'):
+        return ' '.join(letters[:-1] + [letters[-1]] * n)
+    return ' '.join(letter for letter in letters for copy in range(0, n))
+
+# literal_rule of letstr_transformations.R: parts of B and C put together
+def get_literal_rule(itemid, B, C):
+    B = B.split(' ')
+    C = C.split(' ')
+    if (itemid == 101):
+        return B[-1]
+    if (itemid in (102, 1004)):
+        return ' '.join(C[:1] + B[-2:])
+    if (itemid in (1001, 1003)):
+        return ' '.join(C[:1] + B[-1:])
+    if (itemid == 1002):
+        return ' '.join(C[:1] * 2 + B[-2:])
+    if (itemid == 1005):
+        return ' '.join(B[:1] * 2 + C[-2:])
+    return ''
+
+# one_rule_repetition and one_rule_predsuc of letstr_transformations.R: only one of the two rules applied
+def get_one_rules(itemid, C, alphabet):
+    one_rules = {}
+    if (itemid == 1002):
+        one_rules['one_rule_rep'] = repeat_letters(C, 'all', 2)
+    elif (itemid == 1004):
+        one_rules['one_rule_rep'] = repeat_letters(C, 'last', 2)
+    if (itemid in (1002, 1003, 1004)):
+        one_rules['one_rule_predsuc'] = shift_letter(alphabet, C, 'last', 1)
+    elif (itemid == 1005):
+        letters = C.split(' ')
+        parts = shift_letter(alphabet, letters[0], 'first', -1) + ' ' + shift_letter(alphabet, letters[-1], 'first', -1)
+        one_rules['one_rule_predsuc'] = repeat_letters(parts, 'all', 2)
+    return one_rules
+
+# rules applied to a string, None if a rule does not apply or a letter is not in the alphabet
+def apply_rules(rules, string, alphabet):
+    for rule in rules:
+        try:
+            string = apply_rule(rule, string, alphabet)
+        except KeyError:
+            return None
+        if (string is None):
+            return None
+    return string
+
+# the rules of an item with one rule changed: (category, detail, rules) for every other scope,
+# distance (one more or less) and direction of its successor and predecessor rules
+def get_rule_variants(rules, length):
+    variants = []
+    scopes = ['all'] + list(SCOPES) + [str(position) for position in range(1, length + 1)]
+    for k, rule in enumerate(rules):
+        name, scope, n = parse_rule(rule)
+        if (name == 'repetition'):
+            continue
+        changed = [('wrong_position', f'wrong_position_{other}', f'{name}({other},{n})') for other in scopes if other != scope]
+        changed += [('wrong_distance', f'wrong_distance_{other}', f'{name}({scope},{other})') for other in (n - 1, n + 1) if other > 0]
+        other_name = 'predecessor' if name == 'successor' else 'successor'
+        changed += [('wrong_direction', 'wrong_direction', f'{other_name}({scope},{n})')]
+        variants += [(category, detail, rules[:k] + [new_rule] + rules[k + 1:]) for category, detail, new_rule in changed]
+    return variants
+
+# candidate answers of an item as {answer: (category, detail)}, the first category of an answer in
+# CATEGORIES order is kept. task selects the Symbol alphabet (letstr_alphabets.TASK_ALPHABETS)
+@lru_cache(maxsize = None)
+def get_candidate_bank(itemid, alphabet_name, A, B, C, D, task='letstr_testlets'):
+    alphabet = get_alphabet(alphabet_name, task)
+    A, B, C, D = [normalize(string, alphabet_name) for string in (A, B, C, D)]
+    candidates = [('literal_rule', 'literal_rule', get_literal_rule(itemid, B, C))]
+    candidates += [('one_rule', detail, answer) for detail, answer in get_one_rules(itemid, C, alphabet).items()]
+    candidates += [('copy_rule', 'copy_A', A), ('copy_rule', 'copy_B', B), ('copy_rule', 'copy_C', C)]
+    candidates += [('incorrect_rule', f'incorrect_rule_repetition_{k}', repeat_letters(C, which, 2)) for k, which in ((1, 'last'), (2, 'all'))]
+    candidates += [('incorrect_rule', f'incorrect_rule_successor_{n}', shift_letter(alphabet, C, 'last', n)) for n in (1, 2)]
+    candidates += [('incorrect_rule', f'incorrect_rule_predecessor_{n}', shift_letter(alphabet, C, 'first', -n)) for n in (1, 2)]
+    for category, detail, rules in get_rule_variants(ITEM_RULES.get(itemid, []), len(C.split(' '))):
+        candidates.append((category, detail, apply_rules(rules, C, alphabet)))
+    # the answer and C written with the Latin letters at the same places in the alphabet
+    if (alphabet_name != 'Latin'):
+        for detail, string in (('latin_leakage_D', D), ('latin_leakage_C', C)):
+            letters = string.split(' ')
+            if (all(letter in alphabet.index and alphabet.index[letter] < LATIN.size for letter in letters)):
+                candidates.append(('latin_leakage', detail, ' '.join(LATIN.letters[alphabet.index[letter]] for letter in letters)))
+    bank = {}
+    for category, detail, answer in sorted(candidates, key = lambda candidate: CATEGORIES.index(candidate[0])):
+        if (answer and answer != D):
+            bank.setdefault(answer, (category, detail))
+    return bank
+
+# category and detail of one response, cleaned and scored by letstr_scoring
+def classify_response(itemid, alphabet, A, B, C, D, response, cleaned_response, correct, task='letstr_testlets'):
+    if (response is None or response == ''):
+        return 'empty', 'empty'
+    if (correct == 1):
+        return 'correct', 'correct'
+    if (cleaned_response is None):
+        return 'other', 'other'
+    # letters of the answer are compared as written, '$$' is not '$ $'
+    answer = ' '.join(cleaned_response.split())
+    match = get_candidate_bank(itemid, alphabet, A, B, C, D, task).get(answer)
+    if (match is not None):
+        return match
+    # any other answer of a Greek or Symbol item in Latin letters only
+    letters = answer.split(' ')
+    if (alphabet != 'Latin' and answer and all(letter in LATIN.index for letter in letters)
+            and not all(letter in get_alphabet(alphabet, task).index for letter in letters)):
+        return 'latin_leakage', 'latin_letters'
+    return 'other', 'other'
+
+# error_category and error_detail columns for a data frame with the columns of letstr_llm_all_data.csv,
+# distinct (item, response) pairs are coded once
+def classify_responses(df, task='letstr_testlets'):
+    import pandas as pd
+    columns = ['itemid', 'alphabet', 'A', 'B', 'C', 'D', 'response', 'cleaned_response', 'correct']
+    values = df[columns].astype(object).where(df[columns].notna(), None)
+    codes = {}
+    categories = []
+    details = []
+    for row in values.itertuples(index = False, name = None):
+        if (row not in codes):
+            codes[row] = classify_response(*row, task = task)
+        category, detail = codes[row]
+        categories.append(category)
+        details.append(detail)
+    return pd.DataFrame({'error_category': categories, 'error_detail': details}, index = df.index)
+
+# category of a row of letstr_data_errorcoded.csv, new categories are other in R
+R_CATEGORIES = ['correct', 'empty', 'literal_rule', 'one_rule', 'copy_rule', 'incorrect_rule', 'other_rule']
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default='analysis/letstr_data_errorcoded.csv', type=str, help="Csv file with the error coding of letstr_errors_analyze.R")
+    parser.add_argument("--repeats", default=5, type=int, help="Number of timed runs")
+    args = parser.parse_args()
+
+    import pandas as pd
+    dat = pd.read_csv(args.path, keep_default_na = False, na_values = ['NA'])
+    coded = classify_responses(dat)
+    r_categories = [next((category.replace('other_rule', 'other') for category in R_CATEGORIES if row[category] == 1), 'other')
+                    for row in dat[R_CATEGORIES].to_dict('records')]
+    python_categories = [category if category in R_CATEGORIES else 'other' for category in coded['error_category']]
+    humans = dat['participant_group'].isin(['Adults', 'Children']).to_numpy()
+    differ = [a != b for a, b in zip(python_categories, r_categories)]
+    print(f'_____ {len(dat)} responses, categories differ from R for {sum(d for d, h in zip(differ, humans) if not h)} LLM responses '
+          f'and {sum(d for d, h in zip(differ, humans) if h)} human responses (human item strings are normalized here) _____')
+    print(pd.crosstab(dat['participant_group'], coded['error_category']).to_string())
+
+    # timings, every run starts with empty banks
+    start = time.perf_counter()
+    for i in range(0, args.repeats):
+        get_candidate_bank.cache_clear()
+        classify_responses(dat)
+    print(f'_____ {len(dat)} responses coded in {(time.perf_counter() - start) / args.repeats * 1000:.1f} ms, '
+          f'{get_candidate_bank.cache_info().currsize} item banks _____')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+'''
+Runs a whole experiment matrix from one YAML or TOML spec in one process.
+Every experiment in the spec is expanded into jobs, one per combination of
+testlet, template, prev_exchange and model group, and the chains of all
+jobs run together on one engine: API clients, rate budgets, the response
+cache and item files are shared, instead of one launch per job.
+Results are written with the file naming of the data collection scripts,
+so data_llms/letstr_llm_dat_combine.R reads them unchanged.
+
+    python letstr_experiment.py experiments/letstr_testlets.yml
+    python letstr_experiment.py experiments/letstr_testlets.yml --resume <run-id>
+    python letstr_experiment.py experiments/letstr_testlets.yml --dry_run
+
+Spec, every matrix entry takes a number, a list or a range such as '0-54':
+    max_concurrency: 8              # optional, max requests in flight per API
+    cache: use                      # optional, use, refresh or off
+    models:                         # optional, model lists replacing those of the scripts
+      gpt: [gpt-4o-2024-08-06]
+    experiments:
+      - task: letstr                # letstr, letstr_noprevmsg, rulecheck or nextprevlet
+        testlets: 0-54              # letstr tasks, testlets of the item store (letstr_item_store)
+        templates: 1-5
+        prev_exchange: [0, 1]       # letstr tasks
+        conversation_format: flat       # optional, letstr task, flat (default) or messages
+        models: [gpt, together, anthropic]
+        output_dir: data_llms/results_letstr/
+Instead of testlets, path_to_items with an optional testlet_nr (default 0)
+runs a single item file; rulecheck and nextprevlet use path_to_items or
+the default item file of their script.
+'''
+import argparse
+import importlib
+import itertools
+import os
+from datetime import datetime
+from letstr_cache import open_cache, CACHE_MODES, DEFAULT_CACHE_PATH
+from letstr_engine import CollectionEngine, parse_nr_list
+from letstr_journal import Journal, get_journal_path, parse_rowid_start
+from letstr_plan import PlanEngine, PlanResults, get_tokenizer, load_latencies
+from letstr_progress import ScoreCounters, PROGRESS_INTERVAL
+from letstr_prompt_cache import order_chains
+from letstr_telemetry import Telemetry, get_metrics_path
+
+# data collection script of each task and its matrix dimensions
+TASKS = {
+    'letstr': {'module': 'data_collection_letstr_llms', 'testlets': True},
+    'letstr_noprevmsg': {'module': 'data_collection_letstr_llms_noprevmsg', 'testlets': True},
+    'rulecheck': {'module': 'data_collection_letstr_rulecheck_llms', 'testlets': False,
+                  'path_to_items': 'items/rulecheck_item_variations.csv'},
+    'nextprevlet': {'module': 'data_collection_nextprevlet_llms', 'testlets': False,
+                    'path_to_items': 'items/nextprevletter_items_llms.csv'},
+}
+
+def read_spec(path):
+    if (path.endswith('.toml')):
+        import tomllib
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    import yaml
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+# values of one matrix dimension, from a number, a list or a range string such as '0-54'
+def get_values(value):
+    if (isinstance(value, list)):
+        return value
+    if (isinstance(value, str) and value[0].isdigit()):
+        return parse_nr_list(value)
+    if (isinstance(value, str)):
+        return value.split(',')
+    return [value]
+
+# jobs of one experiment of the spec, each job is (task, path to items, job dict of the task script),
+# path to items is None for testlets selected from the item store
+def expand_experiment(experiment, model_lists):
+    task = experiment['task']
+    if (task not in TASKS):
+        raise ValueError(f'Unknown task: {task}, choose from {list(TASKS)}')
+    if (TASKS[task]['testlets']):
+        if ('testlets' in experiment):
+            testlets = [(testlet_nr, None) for testlet_nr in get_values(experiment['testlets'])]
+        else:
+            testlets = [(experiment.get('testlet_nr', 0), experiment['path_to_items'])]
+        prev_exchanges = get_values(experiment.get('prev_exchange', 0))
+    else:
+        testlets = [(None, experiment.get('path_to_items', TASKS[task]['path_to_items']))]
+        prev_exchanges = [None]
+    jobs = []
+    for (testlet_nr, path_to_items), template_nr, prev_exchange, models in itertools.product(
+            testlets, get_values(experiment['templates']), prev_exchanges, get_values(experiment['models'])):
+        job = {'models': models, 'template_nr': template_nr, 'output_dir': experiment['output_dir']}
+        if (testlet_nr is not None):
+            job['testlet_nr'] = testlet_nr
+        if (prev_exchange is not None):
+            job['prev_exchange'] = prev_exchange
+        if ('conversation_format' in experiment):
+            job['conversation_format'] = experiment['conversation_format']
+        if (models in model_lists):
+            job['model_names'] = model_lists[models]
+        jobs.append((task, path_to_items, job))
+    return jobs
+
+# name of a job in messages
+def get_job_name(task, job):
+    return ' '.join([task] + [f'{key} {value}' for key, value in job.items() if key not in ('output_dir', 'model_names')])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("spec", type=str, help="YAML or TOML experiment spec")
+    parser.add_argument("--max_concurrency", default=None, type=int, help="Max requests in flight per API, overrides the spec, default per API in letstr_engine.MAX_CONCURRENCY")
+    parser.add_argument("--cache", default=None, choices=CACHE_MODES, help="Response cache mode, overrides the spec, default use")
+    parser.add_argument("--cache_path", default=None, type=str, help="Path to response cache database")
+    parser.add_argument("--progress_interval", default=PROGRESS_INTERVAL, type=int, help="Seconds between reports of the running scores per model, alphabet and template")
+    parser.add_argument("--progress_path", default=None, type=str, help="Csv file the running scores per item are written to with every report")
+    parser.add_argument("--metrics_path", default=None, type=str, help="Csv file of the latency, token, finish reason and retry metrics of every request, default <output_dir of the first job>/metrics/metrics_<run id>.csv")
+    parser.add_argument("--resume", default=None, type=str, help="Run id (timestamp in the file names) of an interrupted run of the same spec to resume")
+    parser.add_argument("--dry_run", "--dry-run", action='store_true', help="Render all prompts and report requests, tokens, cost and predicted wall-clock time per model, without calling the API or writing files")
+    parser.add_argument("--tokenizer", default='estimate', type=str, help="Token counter of --dry_run: estimate, tiktoken[:encoding] or module:function")
+    parser.add_argument("--latency_samples", default=None, type=str, help="Comma separated json files of latency samples (python letstr_clients.py --output) for the --dry_run time prediction")
+    args = parser.parse_args()
+
+    spec = read_spec(args.spec)
+    jobs = []
+    for experiment in spec['experiments']:
+        jobs.extend(expand_experiment(experiment, spec.get('models', {})))
+
+    # one run id for all files of the run
+    if (args.resume is None):
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    else:
+        timestamp = args.resume
+
+    ### DATA COLLECTION PREP
+    max_concurrency = args.max_concurrency or spec.get('max_concurrency')
+    if (args.dry_run):
+        cache = None
+    else:
+        cache = open_cache(args.cache or spec.get('cache', 'use'), args.cache_path or spec.get('cache_path', DEFAULT_CACHE_PATH))
+    engine = None
+    task_engines = {}
+    modules = {}
+    journals = {}
+    items = {}
+    files = []
+    chains = []
+    chain_names = []
+    chain_keys = []
+    rowid_start = parse_rowid_start('0')
+
+    # results files are opened for writing, so two jobs writing to the same file are refused before any is opened
+    results_paths = {}
+    for task, path_to_items, job in jobs:
+        # task scripts, and their SDKs, are only imported when the spec uses them
+        if (task not in modules):
+            modules[task] = importlib.import_module(TASKS[task]['module'])
+        results_path = os.path.normpath(modules[task].get_results_path(job, timestamp))
+        if (results_path in results_paths):
+            raise ValueError(f'Jobs {results_paths[results_path]} and {get_job_name(task, job)} write to {results_path}, give them different output_dir')
+        results_paths[results_path] = get_job_name(task, job)
+
+    for task, path_to_items, job in jobs:
+        if (task not in task_engines):
+            if (engine is None and args.dry_run):
+                engine = PlanEngine(modules[task].PROVIDER_CALLS, max_concurrency, system_prompt = modules[task].SYSTEM_PROMPT,
+                                    tokenizer = get_tokenizer(args.tokenizer), latencies = load_latencies(args.latency_samples))
+            elif (engine is None):
+                engine = CollectionEngine(modules[task].PROVIDER_CALLS, max_concurrency, cache = cache, system_prompt = modules[task].SYSTEM_PROMPT,
+                                          scores = ScoreCounters(args.progress_interval, args.progress_path),
+                                          telemetry = Telemetry(args.metrics_path or get_metrics_path(job['output_dir'], timestamp)))
+            task_engines[task] = engine.for_task(modules[task].PROVIDER_CALLS, modules[task].SYSTEM_PROMPT)
+        module = modules[task]
+        # one journal per output directory and one read per item file, a dry run writes nothing
+        if (job['output_dir'] not in journals and not args.dry_run):
+            os.makedirs(os.path.join(job['output_dir'], 'log'), exist_ok = True)
+            journals[job['output_dir']] = Journal(get_journal_path(job['output_dir'], timestamp))
+        items_key = path_to_items or f"testlet{job['testlet_nr']}"
+        if (items_key not in items):
+            items[items_key] = module.load_items(job['testlet_nr'], path_to_items) if TASKS[task]['testlets'] else module.get_items(path_to_items)
+
+        if (args.dry_run):
+            results = PlanResults()
+        else:
+            results = module.open_results(journals[job['output_dir']], job, timestamp)
+            files.append(results)
+
+        job_chains, job_names, job_keys = module.build_chains(task_engines[task], results, items[items_key], job, rowid_start)
+        chains += job_chains
+        chain_names += job_names
+        chain_keys += [(task,) + key for key in job_keys]
+    print(f'_____ Run {timestamp}: {len(jobs)} jobs, {len(chains)} chains _____')
+
+    # start chains that share a prompt prefix next to each other for provider-side prompt caching
+    chains, chain_names = order_chains(chains, chain_names, chain_keys)
+
+    ### DATA COLLECTION
+    # call models, all chains of all jobs run concurrently
+    if (engine is not None):
+        engine.run(chains, chain_names)
+
+    # close csv writers and files
+    for results in files:
+        results.close()
+    for journal in journals.values():
+        journal.close()
+    if (cache is not None):
+        cache.close()
+
+if __name__ == "__main__":
+    main()
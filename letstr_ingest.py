@@ -0,0 +1,220 @@
+'''
+Incremental ingestion of the results files of the letter-string runs into
+one SQLite store with the scored columns of letstr_llm_all_data.csv
+(cleaned_response, correct_response, correct and stringdist, computed by
+letstr_scoring and letstr_stringdist as in data_llms/letstr_llm_dat_combine.R).
+A manifest table holds the absolute path, size, modification time and sha256 hash
+of every ingested file. Files with the size and modification time of the
+manifest are skipped without reading them, files whose hash did not change
+only get their modification time updated, and new or changed files are
+read, scored and their rows replaced, so a refresh after a run costs the
+rows of its new files. Rows of files that were removed are deleted.
+
+    python letstr_ingest.py                                          # ingest new and changed files
+    python letstr_ingest.py --export data_llms/letstr_llm_all_data.csv   # and write the combined dataset
+
+The export has the columns and row order of letstr_llm_all_data.csv
+(results_*.csv files then gpt3_*.csv files, each in the order of R's
+list.files); a
+.parquet export keeps the column types.
+'''
+import argparse
+import glob
+import hashlib
+import os
+import sqlite3
+import time
+from letstr_scoring import score_responses
+from letstr_stringdist import osa_distances
+
+DEFAULT_RESULTS_DIR = 'data_llms/results_letstr/'
+DEFAULT_STORE_PATH = 'data_llms/letstr_llm_all_data.sqlite'
+
+# file patterns of the results directory in export order, with the model of files without a model column
+FILE_PATTERNS = {'results_*.csv': None, 'gpt3_*.csv': 'gpt-3_text-davinci-003'}
+
+# columns of letstr_llm_all_data.csv with their SQLite types
+COLUMNS = {'model': 'TEXT', 'rowid': 'INTEGER', 'timestamp': 'INTEGER', 'testletid': 'INTEGER', 'itemid': 'INTEGER',
+           'alphabet': 'TEXT', 'A': 'TEXT', 'B': 'TEXT', 'C': 'TEXT', 'D': 'TEXT', 'template_nr': 'INTEGER',
+           'item_prompt': 'TEXT', 'response': 'TEXT', 'logprob': 'REAL', 'finish_reason': 'TEXT',
+           'cleaned_response': 'TEXT', 'correct_response': 'TEXT', 'correct': 'INTEGER', 'stringdist': 'INTEGER'}
+NUMERIC_COLUMNS = ['rowid', 'timestamp', 'testletid', 'itemid', 'template_nr', 'logprob']
+
+# sha256 of a file, read in blocks
+def get_file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# sort key of a file name in the order of R's list.files in a UTF-8 locale: punctuation before digits
+# before letters, letters compared without case first
+def get_r_sort_key(name):
+    primary = [(0 if not char.isalnum() else 1 if char.isdigit() else 2, char.lower()) for char in name]
+    return primary, name.swapcase()
+
+# manifest key of a file, its absolute path, so the store does not depend on the working directory
+def get_file_key(path):
+    return os.path.realpath(path)
+
+# results files of a directory as (path, pattern number, model of files without a model column), in export order
+def find_results_files(results_dir):
+    files = []
+    for pattern_nr, (pattern, model) in enumerate(FILE_PATTERNS.items()):
+        for path in sorted(glob.glob(os.path.join(results_dir, pattern)), key = lambda path: get_r_sort_key(os.path.basename(path))):
+            files.append((path, pattern_nr, model))
+    return files
+
+# rows of a results file with the scored columns, read as R's read.csv does: 'NA' is missing, empty strings are kept
+def read_results_file(path, model=None):
+    import pandas as pd
+    df = pd.read_csv(path, dtype = str, keep_default_na = False, na_values = ['NA'])
+    if ('model' not in df.columns):
+        df.insert(0, 'model', model)
+    # floats are converted by python, pandas' fast parser can be off in the last digit
+    for column in NUMERIC_COLUMNS:
+        if (column in df.columns):
+            df[column] = df[column].astype(float) if COLUMNS[column] == 'REAL' else pd.to_numeric(df[column])
+    df = score_responses(df)
+    df['stringdist'] = osa_distances(df['D'], df['cleaned_response'])
+    return df.reindex(columns = list(COLUMNS))
+
+class ResultsStore:
+    '''
+    SQLite store of scored results rows and the manifest of the files they were read from.
+    '''
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        if (os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS files (
+                                path TEXT PRIMARY KEY,
+                                size INTEGER,
+                                mtime REAL,
+                                hash TEXT,
+                                pattern_nr INTEGER,
+                                file_nr INTEGER,
+                                n_rows INTEGER,
+                                ingested REAL)''')
+        columns = ', '.join(f'"{column}" {sql_type}' for column, sql_type in COLUMNS.items())
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS responses (file TEXT, file_row INTEGER, {columns})')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_file ON responses (file, file_row)')
+        self.conn.commit()
+
+    # manifest as {path: (size, mtime, hash)}
+    def get_manifest(self):
+        return {path: (size, mtime, file_hash) for path, size, mtime, file_hash in self.conn.execute('SELECT path, size, mtime, hash FROM files')}
+
+    # replace the rows of a file, manifest and rows are changed in one transaction
+    def replace_file(self, path, size, mtime, file_hash, pattern_nr, file_nr, df):
+        rows = df.astype(object).where(df.notna(), None).itertuples(index = False, name = None)
+        placeholders = ', '.join(['?'] * (len(COLUMNS) + 2))
+        with self.conn:
+            self.conn.execute('DELETE FROM responses WHERE file = ?', (path,))
+            self.conn.executemany(f'INSERT INTO responses VALUES ({placeholders})',
+                                  ((path, file_row) + row for file_row, row in enumerate(rows)))
+            self.conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                              (path, size, mtime, file_hash, pattern_nr, file_nr, len(df), time.time()))
+
+    def remove_file(self, path):
+        with self.conn:
+            self.conn.execute('DELETE FROM responses WHERE file = ?', (path,))
+            self.conn.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    # ingest new and changed results files of a directory and remove files that are gone,
+    # returns the number of new, changed, unchanged and removed files and of ingested rows
+    def ingest(self, results_dir=DEFAULT_RESULTS_DIR, rehash=False):
+        manifest = self.get_manifest()
+        counts = {'new': 0, 'changed': 0, 'unchanged': 0, 'removed': 0, 'rows': 0}
+        found = set()
+        files = find_results_files(results_dir)
+        for file_nr, (path, pattern_nr, model) in enumerate(files):
+            path = get_file_key(path)
+            found.add(path)
+            stat = os.stat(path)
+            entry = manifest.get(path)
+            if (entry is not None and not rehash and entry[0] == stat.st_size and entry[1] == stat.st_mtime):
+                counts['unchanged'] += 1
+                continue
+            file_hash = get_file_hash(path)
+            if (entry is not None and entry[2] == file_hash):
+                with self.conn:
+                    self.conn.execute('UPDATE files SET size = ?, mtime = ? WHERE path = ?', (stat.st_size, stat.st_mtime, path))
+                counts['unchanged'] += 1
+                continue
+            df = read_results_file(path, model)
+            self.replace_file(path, stat.st_size, stat.st_mtime, file_hash, pattern_nr, file_nr, df)
+            counts['new' if entry is None else 'changed'] += 1
+            counts['rows'] += len(df)
+        results_dir = os.path.realpath(results_dir)
+        for path in manifest:
+            if (path not in found and os.path.dirname(os.path.realpath(path)) == results_dir):
+                self.remove_file(path)
+                counts['removed'] += 1
+        # new files can sort between ingested ones, the order of unchanged files is only updated
+        with self.conn:
+            self.conn.executemany('UPDATE files SET file_nr = ? WHERE path = ?',
+                                  [(file_nr, get_file_key(path)) for file_nr, (path, pattern_nr, model) in enumerate(files)])
+        return counts
+
+    # combined dataset as a data frame, in the row order of letstr_llm_all_data.csv
+    def read(self):
+        import pandas as pd
+        columns = ', '.join(f'r."{column}"' for column in COLUMNS)
+        query = f'SELECT {columns} FROM responses r JOIN files f ON r.file = f.path ORDER BY f.file_nr, r.file_row'
+        df = pd.read_sql_query(query, self.conn)
+        for column, sql_type in COLUMNS.items():
+            if (sql_type == 'INTEGER'):
+                df[column] = df[column].astype('Int64')
+        return df
+
+    # write the combined dataset to a .csv file as R's write.csv does, or to a .parquet file
+    def export(self, path):
+        df = self.read()
+        if (path.endswith('.parquet')):
+            df.to_parquet(path, index = False)
+            return df
+        text_columns = [sql_type == 'TEXT' for sql_type in COLUMNS.values()]
+        with open(path, 'w', newline = '') as f:
+            f.write(','.join(f'"{column}"' for column in df.columns) + '\n')
+            for row in df.astype(object).where(df.notna(), None).itertuples(index = False, name = None):
+                f.write(','.join(format_r_value(value, text) for value, text in zip(row, text_columns)) + '\n')
+        return df
+
+    def close(self):
+        self.conn.close()
+
+# value as written by R's write.csv: strings quoted with doubled quotes, missing values as NA,
+# numbers with up to 15 significant digits
+def format_r_value(value, text):
+    if (value is None):
+        return 'NA'
+    if (text):
+        return '"' + str(value).replace('"', '""') + '"'
+    if (isinstance(value, float)):
+        return f'{value:.15g}'
+    return str(value)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--results_dir", default=DEFAULT_RESULTS_DIR, type=str, help="Directory with the results_*.csv and gpt3_*.csv files")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH, type=str, help="Path of the SQLite store")
+    parser.add_argument("--export", default=None, type=str, help="Also write the combined dataset to this .csv or .parquet file")
+    parser.add_argument("--rehash", action='store_true', help="Hash every file instead of skipping files with unchanged size and modification time")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = ResultsStore(args.store)
+    counts = store.ingest(args.results_dir, args.rehash)
+    print(f"_____ {counts['new']} new, {counts['changed']} changed, {counts['unchanged']} unchanged and {counts['removed']} removed files, "
+          f"{counts['rows']} rows ingested in {time.perf_counter() - start:.2f} s _____")
+    if (args.export is not None):
+        df = store.export(args.export)
+        print(f'_____ {len(df)} rows written to {args.export} _____')
+    store.close()
+
+if __name__ == "__main__":
+    main()
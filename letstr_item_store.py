@@ -0,0 +1,157 @@
+'''
+Item store: all items of the study in one Arrow IPC (Feather v2) file,
+items/letstr_items.arrow, with the rows of every (item set, testletid)
+next to each other in the order of their item file. The file is written
+uncompressed, so any number of worker processes memory-map it and read a
+testlet as a zero-copy slice instead of parsing a csv file per run.
+Items for the collection scripts are sliced from python lists of the
+columns, converted once per process on first use.
+Lookups by (item set, testletid) and (item set, testletid, itemid) go
+through dicts built once when the store is opened. Itemids are not unique
+within a testlet (1001 to 1005 repeat for every alphabet), so an itemid
+lookup returns all its rows.
+
+Build or rebuild the store after changing an item file:
+    python letstr_item_store.py
+Testlets come from items/testlets/letterstring_testlets.parquet (see
+items/create_letterstring_llm_testlets.py), so generated testlets beyond
+54 are in the store as well.
+'''
+import argparse
+import json
+from letstr_items import Items, read_items, DEFAULT_ITEM_STORE
+
+# item sets of the store and their item files
+ITEM_SETS = {
+    'letterstring_base': 'items/letterstring_base_items.csv',
+    'letterstring_item_variations': 'items/letterstring_item_variations.csv',
+    'letterstring_humans': 'items/letterstring_items_humans.csv',
+    'letterstring_orderedsymbols_base': 'items/letterstring_orderedsymbols_base_items.csv',
+    'testlets': 'items/testlets/letterstring_testlets.parquet',
+    'rulecheck_base': 'items/rulecheck_base_items.csv',
+    'rulecheck_item_variations': 'items/rulecheck_item_variations.csv',
+    'nextprevletter': 'items/nextprevletter_items_llms.csv',
+}
+
+# columns of an item file as a dict of lists
+def read_item_file(path):
+    if (path.endswith('.parquet')):
+        import pyarrow.parquet as pq
+        return pq.read_table(path).to_pydict()
+    return read_items(path).columns
+
+# arrow array of a column, int64 when all values are whole numbers, else string
+def to_array(values):
+    import pyarrow as pa
+    present = [value for value in values if value is not None]
+    if (all(isinstance(value, int) for value in present)):
+        return pa.array(values, type = pa.int64())
+    return pa.array([None if value is None else str(value) for value in values], type = pa.string())
+
+def build_store(path=DEFAULT_ITEM_STORE, item_sets=None):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    item_sets = item_sets or ITEM_SETS
+    columns = {'item_set': [], 'testletid': [], 'row': []}
+    set_columns = {}
+    n_rows = 0
+    for item_set, item_file in item_sets.items():
+        file_columns = read_item_file(item_file)
+        set_columns[item_set] = list(file_columns)
+        n = len(next(iter(file_columns.values())))
+        # rows of a testlet must be contiguous, item files list their testlets one after the other
+        testletids = file_columns.get('testletid', [None] * n)
+        order = sorted(range(0, n), key = lambda i: -1 if testletids[i] is None else testletids[i])
+        for column, values in file_columns.items():
+            if (column not in columns):
+                columns[column] = [None] * n_rows
+            columns[column].extend(values[i] for i in order)
+        columns['item_set'].extend([item_set] * n)
+        columns['row'].extend(order)
+        if ('testletid' not in file_columns):
+            columns['testletid'].extend([None] * n)
+        n_rows += n
+        # columns of other item sets are empty for this one
+        for column, values in columns.items():
+            values.extend([None] * (n_rows - len(values)))
+    table = pa.table({column: to_array(values) for column, values in columns.items()})
+    table = table.replace_schema_metadata({'item_sets': json.dumps(set_columns)})
+    feather.write_feather(table, path, compression = 'uncompressed')
+    return table
+
+class ItemStore:
+    '''
+    Memory-mapped item store, see build_store.
+    '''
+    def __init__(self, path=DEFAULT_ITEM_STORE):
+        import pyarrow as pa
+        self.path = path
+        self.source = pa.memory_map(path, 'r')
+        self.table = pa.ipc.open_file(self.source).read_all()
+        self.set_columns = json.loads(self.table.schema.metadata[b'item_sets'])
+        item_sets = self.table.column('item_set').to_pylist()
+        testletids = self.table.column('testletid').to_pylist()
+        itemids = self.table.column('itemid').to_pylist()
+        # (item set, testletid) and item set -> (first row, end row), (item set, testletid, itemid) -> rows
+        self.ranges = {}
+        self.rows = {}
+        self.column_lists = {}
+        for i, key in enumerate(zip(item_sets, testletids)):
+            start, end = self.ranges.get(key, (i, i))
+            self.ranges[key] = (start, i + 1)
+            start, end = self.ranges.get(key[0], (i, i))
+            self.ranges[key[0]] = (start, i + 1)
+            self.rows.setdefault(key + (itemids[i],), []).append(i)
+
+    def get_testletids(self, item_set):
+        return sorted(key[1] for key in self.ranges if isinstance(key, tuple) and key[0] == item_set and key[1] is not None)
+
+    # zero-copy arrow table of an item set, or of one testlet of it
+    def get_table(self, item_set, testletid=None):
+        key = item_set if testletid is None else (item_set, testletid)
+        if (key not in self.ranges):
+            raise KeyError(f'No items for item set {item_set}' + ('' if testletid is None else f' testlet {testletid}'))
+        start, end = self.ranges[key]
+        return self.table.slice(start, end - start).select(self.set_columns[item_set])
+
+    # column as a python list, converted once on first use
+    def get_column(self, column):
+        if (column not in self.column_lists):
+            self.column_lists[column] = self.table.column(column).to_pylist()
+        return self.column_lists[column]
+
+    # items of an item set, or of one testlet of it, as read from its item file by letstr_items.read_items
+    def get_items(self, item_set, testletid=None):
+        key = item_set if testletid is None else (item_set, testletid)
+        if (key not in self.ranges):
+            raise KeyError(f'No items for item set {item_set}' + ('' if testletid is None else f' testlet {testletid}'))
+        start, end = self.ranges[key]
+        return Items({column: self.get_column(column)[start:end] for column in self.set_columns[item_set]})
+
+    # rows of an item in a testlet as dicts, one per alphabet
+    def get_item(self, item_set, testletid, itemid):
+        columns = self.set_columns[item_set]
+        return [{column: self.get_column(column)[i] for column in columns}
+                for i in self.rows.get((item_set, testletid, itemid), [])]
+
+# stores opened by this process, one memory map per file
+_stores = {}
+
+def open_store(path=DEFAULT_ITEM_STORE):
+    if (path not in _stores):
+        _stores[path] = ItemStore(path)
+    return _stores[path]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default=DEFAULT_ITEM_STORE, type=str, help="Path of the item store")
+    args = parser.parse_args()
+
+    table = build_store(args.output)
+    store = ItemStore(args.output)
+    for item_set in ITEM_SETS:
+        print(f'_____ {item_set}: {len(store.get_items(item_set))} items, {len(store.get_testletids(item_set))} testlets _____')
+    print(f'_____ {table.num_rows} items written to {args.output} _____')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+'''
+Lightweight reader for the item csv files of the data collection scripts.
+Item files have at most a few hundred rows, so they are read with the csv
+module instead of pandas, which takes longer to import than reading all
+item files. Columns holding only whole numbers are converted to int, like
+pandas does for these files, and rows are accessed the same way as the
+DataFrame the scripts used before: items.loc[rowid, column] and len(items).
+Testlets are selected from the memory-mapped item store (letstr_item_store)
+once it has been built, else read from their csv file.
+'''
+import csv
+import os
+
+DEFAULT_ITEM_STORE = 'items/letstr_items.arrow'
+
+def to_int_column(values):
+    try:
+        return [int(value) for value in values]
+    except ValueError:
+        return values
+
+class Items:
+    '''
+    Columns of an item file, rows are indexed from 0.
+    '''
+    def __init__(self, columns):
+        self.columns = columns
+        self.n_rows = len(next(iter(columns.values()))) if columns else 0
+
+    def __len__(self):
+        return self.n_rows
+
+    # pandas style access, items.loc[rowid, column]
+    @property
+    def loc(self):
+        return self
+
+    def __getitem__(self, key):
+        rowid, column = key
+        return self.columns[column][rowid]
+
+    def head(self, n=5):
+        return Items({column: values[:n] for column, values in self.columns.items()})
+
+    def __repr__(self):
+        lines = [','.join(self.columns)]
+        for rowid in range(0, len(self)):
+            lines.append(','.join(str(values[rowid]) for values in self.columns.values()))
+        return '\n'.join(lines)
+
+def read_items(path_to_file):
+    with open(path_to_file, newline = '') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+    return Items({column: to_int_column([row[i] for row in rows]) for i, column in enumerate(header)})
+
+# path to the item file of a testlet
+def get_testlet_path(testlet_nr):
+    return f'items/testlets/letterstring_testlet{testlet_nr}.csv'
+
+# items of a testlet, from the item store when it exists (python letstr_item_store.py), else from its csv file
+def read_testlet(testlet_nr, store_path=DEFAULT_ITEM_STORE):
+    if (os.path.exists(store_path)):
+        from letstr_item_store import open_store
+        return open_store(store_path).get_items('testlets', testlet_nr)
+    return read_items(get_testlet_path(testlet_nr))
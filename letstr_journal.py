@@ -0,0 +1,134 @@
+'''
+Append-only checkpoint journal for crash-safe, resumable data collection.
+Every completed item (model, results file, which names testlet and
+template, and rowid) is appended to a json lines journal and fsync'd
+before it is written to the results and log csv files, which are flushed
+after every row. Resuming a run (--resume <run-id>, the timestamp in the
+file names of the run) rewrites the csv files from the journal and skips
+completed items; chains with previous exchanges replay the journaled
+prompts and responses to rebuild the conversation and continue at the
+exact next item.
+'''
+import csv
+import json
+import os
+
+# path of the journal of a run
+def get_journal_path(output_dir, run_id):
+    return os.path.join(output_dir, 'journal', f'journal_{run_id}.jsonl')
+
+# parse --rowid_start, either one rowid for every model or model=rowid pairs separated by commas
+def parse_rowid_start(value):
+    value = str(value)
+    if ('=' not in value):
+        return {None: int(value)}
+    rowid_start = {}
+    for part in value.split(','):
+        model, rowid = part.rsplit('=', 1)
+        rowid_start[model.strip()] = int(rowid)
+    return rowid_start
+
+# first rowid to collect for a model given the parsed --rowid_start
+def get_rowid_start(rowid_start, model):
+    return rowid_start.get(model, rowid_start.get(None, 0))
+
+# numpy and pandas scalars in csv rows are written as plain python values
+def to_builtin(value):
+    if (hasattr(value, 'item')):
+        return value.item()
+    return str(value)
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        if (os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        good_size = 0
+        if (os.path.exists(path)):
+            with open(path, 'rb') as f:
+                for line in f:
+                    # a crash while writing leaves at most one incomplete last line
+                    try:
+                        self.entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break
+                    good_size += len(line)
+            # cut off an incomplete last line so new entries start on a fresh line
+            os.truncate(path, good_size)
+        self.f = open(path, 'a')
+        self.done = {}
+        for entry in self.entries:
+            self.done.setdefault((entry['results_file'], entry['model']), {})[entry['rowid']] = entry
+
+    def sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    # completed items of a model in a results file as {rowid: entry}
+    def get_done(self, results_file, model):
+        return self.done.get((os.path.basename(results_file), model), {})
+
+    # journal entries of a results file in the order they were completed
+    def get_entries(self, results_file):
+        results_file = os.path.basename(results_file)
+        return [entry for entry in self.entries if entry['results_file'] == results_file]
+
+    def record(self, results_file, model, rowid, prompt, response, row, log_row=None):
+        entry = {'results_file': os.path.basename(results_file), 'model': model, 'rowid': rowid,
+                 'prompt': prompt, 'response': response, 'row': row, 'log_row': log_row}
+        entry = json.loads(json.dumps(entry, default = to_builtin))
+        self.f.write(json.dumps(entry) + '\n')
+        self.sync()
+        self.entries.append(entry)
+        self.done.setdefault((entry['results_file'], model), {})[rowid] = entry
+
+    def close(self):
+        self.f.close()
+
+class ResultsWriter:
+    '''
+    Results csv file, and optionally log csv file, of one run backed by the journal.
+    Files are (re)written with their header followed by the rows already in the
+    journal, new rows are journaled first and then written and flushed.
+    '''
+    def __init__(self, journal, results_path, header, log_path=None, log_header=None):
+        self.journal = journal
+        self.results_path = results_path
+        self.f = open(results_path, 'w')
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(header)
+        self.log = None
+        if (log_path is not None):
+            self.log = open(log_path, 'w')
+            self.logger = csv.writer(self.log)
+            self.logger.writerow(log_header)
+        self.n_restored = 0
+        for entry in journal.get_entries(results_path):
+            self.write_rows(entry['row'], entry['log_row'])
+            self.n_restored += 1
+        self.flush()
+
+    # completed items of a model as {rowid: journal entry}
+    def get_done(self, model):
+        return self.journal.get_done(self.results_path, model)
+
+    def write_rows(self, row, log_row):
+        self.writer.writerow(row)
+        if (self.log is not None and log_row is not None):
+            self.logger.writerow(log_row)
+
+    def flush(self):
+        self.f.flush()
+        if (self.log is not None):
+            self.log.flush()
+
+    def write(self, model, rowid, prompt, response, row, log_row=None):
+        self.journal.record(self.results_path, model, rowid, prompt, response, row, log_row)
+        self.write_rows(row, log_row)
+        self.flush()
+
+    def close(self):
+        self.f.close()
+        if (self.log is not None):
+            self.log.close()
@@ -0,0 +1,130 @@
+'''
+Typed loader of the results_*.csv and log_*.csv files of the collection
+scripts. Files are parsed by pyarrow's multi-threaded csv reader, many
+files at once on a thread pool, with the fixed types of SCHEMA instead of
+type inference: ids and timestamps are integers, and the columns that
+repeat a few values over all rows (model, alphabet, A, B, C, D,
+finish_reason, the file a row was read from) are dictionary encoded,
+categoricals in pandas. Tables of all files are concatenated without a
+copy and returned as one Arrow table or pandas data frame, and columns
+restricts parsing to the columns a step needs (leave out the prompts of
+log files), so memory and load time stay small for thousands of files.
+
+As R's read.csv does for these files, 'NA' and empty fields are missing
+values in numeric columns, strings are read as written. Files without a
+model column (gpt3_*.csv) get the model of letstr_ingest.FILE_PATTERNS.
+Log files are written with the header of the results file (a quirk of the
+collection scripts), their rows are read with LOG_COLUMNS instead.
+
+    python letstr_loader.py --directory data_llms/results_letstr
+'''
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from letstr_ingest import find_results_files, get_r_sort_key
+
+# types of all columns of the results and log files, other columns are read as strings
+SCHEMA = {'model': 'category', 'rowid': 'int64', 'timestamp': 'int64', 'testletid': 'int32', 'itemid': 'int32',
+          'variationid': 'int32', 'shift_dist': 'int32', 'prev_next': 'category', 'prev_next_dist': 'int32',
+          'alphabet': 'category', 'A': 'category', 'B': 'category', 'C': 'category', 'D': 'category',
+          'stimulus': 'string', 'solution': 'string', 'template_nr': 'int32', 'item_prompt': 'string',
+          'response': 'string', 'prompt': 'string', 'logprob': 'float64', 'finish_reason': 'category',
+          'cleaned_response': 'string', 'correct': 'int8', 'file': 'category'}
+
+# columns of the rows of log files: letter-string scripts, and data_collection_nextprevlet_llms.py
+LOG_COLUMNS = ['model', 'rowid', 'timestamp', 'testletid', 'itemid', 'prompt', 'response']
+NEXTPREVLET_LOG_COLUMNS = ['model', 'rowid', 'timestamp', 'itemid', 'prompt', 'response', 'template_nr']
+
+# arrow type of a SCHEMA type name
+def get_arrow_type(name):
+    import pyarrow as pa
+    if (name == 'category'):
+        return pa.dictionary(pa.int32(), pa.string())
+    return {'int8': pa.int8(), 'int32': pa.int32(), 'int64': pa.int64(), 'float64': pa.float64(), 'string': pa.string()}[name]
+
+# log files under a directory and its subdirectories, in the order of R's list.files
+def find_log_files(directory):
+    paths = glob.glob(os.path.join(directory, '**', 'log_*.csv'), recursive = True)
+    return sorted(paths, key = lambda path: get_r_sort_key(os.path.relpath(path, directory)))
+
+# arrow table of one csv file with the SCHEMA types, a model column if the file has none and the file column.
+# log_columns are the column names of a log file, whose header row is skipped
+def read_csv_file(path, columns=None, model=None, log_columns=None):
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    read_options = pv.ReadOptions(column_names = log_columns, skip_rows = 0 if log_columns is None else 1, block_size = 1 << 22)
+    parse_options = pv.ParseOptions(newlines_in_values = True)
+    column_types = {column: get_arrow_type(name) for column, name in SCHEMA.items() if column != 'file'}
+    convert_options = pv.ConvertOptions(column_types = column_types, null_values = ['NA', ''], strings_can_be_null = False,
+                                        include_columns = [] if columns is None else [column for column in columns if column != 'file'],
+                                        include_missing_columns = True)
+    table = pv.read_csv(path, read_options = read_options, parse_options = parse_options, convert_options = convert_options)
+    if (model is not None):
+        model_column = pa.array([model] * table.num_rows, type = pa.string()).dictionary_encode()
+        if ('model' in table.column_names):
+            table = table.set_column(table.column_names.index('model'), 'model', model_column)
+        else:
+            table = table.add_column(0, 'model', model_column)
+    if (columns is None or 'file' in columns):
+        table = table.append_column('file', pa.DictionaryArray.from_arrays(pa.array([0] * table.num_rows, type = pa.int32()), pa.array([path])))
+    return table
+
+# arrow table of all results (kind 'results': results_*.csv and gpt3_*.csv, as letstr_ingest) or log files
+# (kind 'log') of a directory, read by workers threads. Columns missing in a file are null
+def load_table(directory, kind='results', columns=None, workers=None, log_columns=LOG_COLUMNS):
+    import pyarrow as pa
+    if (kind == 'results'):
+        files = [(path, model, None) for path, pattern_nr, model in find_results_files(directory)]
+    else:
+        files = [(path, None, log_columns) for path in find_log_files(directory)]
+    if (not files):
+        raise FileNotFoundError(f'No {kind} files in {directory}')
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        tables = list(pool.map(lambda file: read_csv_file(file[0], columns, file[1], file[2]), files))
+    table = pa.concat_tables(tables, promote_options = 'permissive')
+    return table.unify_dictionaries()
+
+# pandas data frame of load_table, dictionary columns as categoricals and integers as nullable integers
+def load_dataframe(directory, kind='results', columns=None, workers=None, log_columns=LOG_COLUMNS):
+    import pandas as pd
+    import pyarrow as pa
+    table = load_table(directory, kind, columns, workers, log_columns)
+    types = {pa.int8(): pd.Int8Dtype(), pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype()}
+    return table.to_pandas(types_mapper = types.get)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--directory", default='data_llms/results_letstr', type=str, help="Directory with the results or log files")
+    parser.add_argument("--kind", default='results', type=str, help="results (results_*.csv and gpt3_*.csv) or log (log_*.csv in all subdirectories)")
+    parser.add_argument("--columns", default=None, type=str, help="Comma separated columns to load, default all")
+    parser.add_argument("--workers", default=None, type=int, help="Threads reading files, default from the number of CPUs")
+    args = parser.parse_args()
+
+    import pandas as pd
+    columns = None if args.columns is None else args.columns.split(',')
+    start = time.perf_counter()
+    df = load_dataframe(args.directory, args.kind, columns, args.workers)
+    seconds = time.perf_counter() - start
+    print(f"_____ {len(df)} rows of {df['file'].nunique() if 'file' in df else '?'} files loaded in {seconds:.2f} s, "
+          f"{df.memory_usage(deep = True).sum() / 1e6:.1f} MB _____")
+
+    # the same files with pandas' default type inference, as the analysis steps read them
+    if (args.kind == 'results'):
+        start = time.perf_counter()
+        frames = []
+        for path, pattern_nr, model in find_results_files(args.directory):
+            frame = pd.read_csv(path)
+            if ('model' not in frame.columns):
+                frame.insert(0, 'model', model)
+            frames.append(frame)
+        inferred = pd.concat(frames, ignore_index = True)
+        if (columns is not None):
+            inferred = inferred[[column for column in columns if column in inferred.columns]]
+        print(f'_____ pandas.read_csv per file: {time.perf_counter() - start:.2f} s, '
+              f'{inferred.memory_usage(deep = True).sum() / 1e6:.1f} MB _____')
+    print(df.dtypes.to_string())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+'''
+Dry-run planner for the data collection scripts (--dry_run).
+The chains of a run are built as usual, but the engine renders every
+prompt without calling an API: requests, input tokens and output tokens
+are counted per provider and model with an offline tokenizer, priced
+with PRICES and the wall-clock time of the run is predicted at the
+concurrency cap of each provider from stored latency samples. With
+previous exchanges every request also counts the history it carries, so
+the growth of prompt length along a chain is part of the totals.
+
+Responses are replaced by PLAN_RESPONSE, a typical answer, so chains with
+previous exchanges build their history as in a real run. Nothing is
+written and the response cache is not used, totals are for a run from
+scratch.
+
+Tokenizers, set with --tokenizer:
+    estimate             about 4 characters per token (letstr_scheduler.estimate_tokens)
+    tiktoken[:encoding]  tiktoken encoding, default o200k_base
+    module:function      any function taking a text and returning its number of tokens
+Latency samples (--latency_samples) are json files written by
+python letstr_clients.py --output, the mean latency of the samples of a
+model is used, else of its provider, else DEFAULT_LATENCY.
+'''
+import asyncio
+import heapq
+import importlib
+import json
+from collections import deque
+from letstr_engine import CollectionEngine
+from letstr_progress import ScoreCounters
+from letstr_scheduler import RATE_LIMITS, estimate_tokens
+from letstr_clients import MAX_TOKENS
+
+# answer standing in for model responses
+PLAN_RESPONSE = 'i j k l'
+
+# tokens a chat API adds around every message
+MESSAGE_TOKENS = 4
+
+# seconds per request when there are no latency samples of a provider
+DEFAULT_LATENCY = {'gpt': 1.0, 'together': 1.0, 'anthropic': 2.0}
+
+# USD per 1M input and output tokens, list prices at the time of writing. Update them before sizing a run,
+# models without a price are reported without cost
+PRICES = {
+    'gpt-3.5-turbo-0125': (0.50, 1.50),
+    'gpt-4-0613': (30.00, 60.00),
+    'gpt-4o-2024-08-06': (2.50, 10.00),
+    'meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo': (0.18, 0.18),
+    'meta-llama/Meta-Llama-3.1-70B-Instruct-Turbo': (0.88, 0.88),
+    'meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo': (3.50, 3.50),
+    'google/gemma-2-27b-it': (0.80, 0.80),
+    'google/gemma-2-9b-it': (0.30, 0.30),
+    'claude-3-5-sonnet-20241022': (3.00, 15.00),
+    'claude-3-sonnet-20240229': (3.00, 15.00),
+    'claude-3-haiku-20240307': (0.25, 1.25),
+}
+
+# function counting the tokens of a text for a --tokenizer name
+def get_tokenizer(name='estimate'):
+    if (name == 'estimate'):
+        return estimate_tokens
+    if (name.split(':')[0] == 'tiktoken'):
+        import tiktoken
+        encoding = tiktoken.get_encoding(name.split(':')[1] if ':' in name else 'o200k_base')
+        return lambda text: len(encoding.encode(text))
+    if (':' in name):
+        module, function = name.split(':')
+        return getattr(importlib.import_module(module), function)
+    raise ValueError(f'Unknown tokenizer: {name}, use estimate, tiktoken[:encoding] or module:function')
+
+# latency samples in seconds per (provider, model) from json reports of letstr_clients.py,
+# paths is a comma separated list of files or None
+def load_latencies(paths):
+    latencies = {}
+    for path in (paths.split(',') if paths else []):
+        with open(path) as f:
+            report = json.load(f)
+        for samples in report['samples'].values():
+            latencies.setdefault((report['provider'], report['model']), []).extend(samples)
+    return latencies
+
+# mean latency of a model, else of its provider, else the default, and where it came from
+def get_latency(latencies, provider, model):
+    samples = latencies.get((provider, model))
+    if (not samples):
+        samples = [sample for (p, m), values in latencies.items() if p == provider for sample in values]
+        source = 'provider samples'
+    else:
+        source = 'model samples'
+    if (not samples):
+        return DEFAULT_LATENCY.get(provider, 1.0), 'default'
+    return sum(samples) / len(samples), source
+
+# time to run chains of sequential requests with at most concurrency requests in flight,
+# durations holds the request durations of each chain in the order the chains are started
+def simulate_chains(durations, concurrency):
+    ready = deque((chain, 0) for chain in range(0, len(durations)) if len(durations[chain]) > 0)
+    running = []
+    now = 0.0
+    while (ready or running):
+        while (ready and len(running) < concurrency):
+            chain, i = ready.popleft()
+            heapq.heappush(running, (now + durations[chain][i], chain, i))
+        now, chain, i = heapq.heappop(running)
+        if (i + 1 < len(durations[chain])):
+            ready.append((chain, i + 1))
+    return now
+
+# lower bound on the run time of a provider and model from its requests and tokens per minute budget,
+# the budget starts full so only what exceeds one minute of budget has to wait
+def get_budget_time(rate_limits, provider, model, n_requests, n_tokens):
+    limits = rate_limits.get((provider, model), rate_limits.get(provider, {}))
+    seconds = 0.0
+    if ('rpm' in limits):
+        seconds = max(seconds, (n_requests - limits['rpm']) / limits['rpm'] * 60)
+    if ('tpm' in limits):
+        seconds = max(seconds, (n_tokens - limits['tpm']) / limits['tpm'] * 60)
+    return seconds
+
+def format_duration(seconds):
+    hours, rest = divmod(int(round(seconds)), 3600)
+    return f'{hours}:{rest // 60:02d}:{rest % 60:02d}'
+
+class PlanResults:
+    '''
+    Stands in for the ResultsWriter of a job in a dry run, nothing is written.
+    '''
+    results_path = None
+
+    def get_done(self, model):
+        return {}
+
+    def write(self, model, rowid, prompt, response, row, log_row=None):
+        pass
+
+    def close(self):
+        pass
+
+class PlanEngine(CollectionEngine):
+    '''
+    Engine of a dry run, records every request the chains would send.
+    tokenizer counts the tokens of a text, latencies are samples as
+    returned by load_latencies.
+    '''
+    def __init__(self, call_fns, max_concurrency=None, rate_limits=None, system_prompt=None, tokenizer=None, latencies=None):
+        # plan responses are not scored
+        super().__init__(call_fns, max_concurrency, rate_limits, None, system_prompt, ScoreCounters(interval = None))
+        self.count_tokens = tokenizer or estimate_tokens
+        self.latencies = latencies or {}
+        # requests of each chain as (provider, model, input tokens, output tokens), shared with for_task engines
+        self.chains = {}
+
+    def count_message(self, text):
+        return self.count_tokens(text) + MESSAGE_TOKENS
+
+    async def call(self, provider, prompt, model, prefix_parts=None, history=None, row_key=None):
+        n_input = self.count_message(self.system_prompt or '') + self.count_message(prompt)
+        n_input += sum(self.count_message(message["content"]) for message in history or [])
+        chain = self.chains.setdefault(id(asyncio.current_task()), [])
+        chain.append((provider, model, n_input, self.count_tokens(PLAN_RESPONSE)))
+        return PLAN_RESPONSE
+
+    async def run_chains(self, chains):
+        return await asyncio.gather(*chains, return_exceptions = True)
+
+    def run(self, chains, names=None):
+        results = asyncio.run(self.run_chains(chains))
+        for i, err in enumerate(results):
+            if (isinstance(err, BaseException)):
+                name = names[i] if names is not None else f'chain {i}'
+                print(f'!!!!! {name} failed: {type(err).__name__}: {err}')
+        self.report()
+        return results
+
+    def report(self):
+        rate_limits = RATE_LIMITS if self.rate_limits is None else self.rate_limits
+        totals = {}
+        durations = {}
+        for requests in self.chains.values():
+            for provider, model, n_input, n_output in requests:
+                counts = totals.setdefault((provider, model), {'requests': 0, 'input': 0, 'output': 0})
+                counts['requests'] += 1
+                counts['input'] += n_input
+                counts['output'] += n_output
+            provider = requests[0][0]
+            durations.setdefault(provider, []).append([get_latency(self.latencies, p, m)[0] for p, m, n_input, n_output in requests])
+
+        print('_____ Dry run, no requests sent _____')
+        total_cost = 0.0
+        for (provider, model), counts in sorted(totals.items()):
+            latency, source = get_latency(self.latencies, provider, model)
+            line = (f"_____ {provider} {model}: {counts['requests']} requests, {counts['input']} input, "
+                    f"{counts['output']} output tokens, {latency:.2f}s per request ({source})")
+            if (model in PRICES):
+                cost = (counts['input'] * PRICES[model][0] + counts['output'] * PRICES[model][1]) / 1e6
+                total_cost += cost
+                line += f', ${cost:.2f}'
+            print(line + ' _____')
+        print(f'_____ Cost of priced models: ${total_cost:.2f} _____')
+
+        # providers run in parallel, each at its concurrency cap and within the budgets of its models
+        total_time = 0.0
+        for provider, chain_durations in sorted(durations.items()):
+            concurrency = self.max_concurrency.get(provider, 1)
+            seconds = simulate_chains(chain_durations, concurrency)
+            for (p, model), counts in totals.items():
+                if (p == provider):
+                    seconds = max(seconds, get_budget_time(rate_limits, provider, model, counts['requests'],
+                                                           counts['input'] + counts['requests'] * MAX_TOKENS))
+            total_time = max(total_time, seconds)
+            print(f'_____ {provider}: {len(chain_durations)} chains at concurrency {concurrency}, about {format_duration(seconds)} _____')
+        print(f'_____ Predicted wall-clock time: {format_duration(total_time)} _____')
@@ -0,0 +1,79 @@
+'''
+Running scores of a data collection run.
+Every response is scored inline (letstr_scoring) and added to counters per
+(model, alphabet, template_nr, itemid) and per (model, alphabet,
+template_nr): responses, scored responses, correct responses, empty
+cleaned responses, summed string distance and summed response length,
+so an update is a few dict lookups and additions. Every interval seconds
+the accuracy per model, alphabet and template is printed and the
+counters per item are written to a csv file, so a model failing on Greek
+or Symbol items shows up while the run goes on.
+'''
+import csv
+import os
+import time
+from letstr_scoring import get_stringdist
+
+# seconds between progress reports of a run
+PROGRESS_INTERVAL = 60
+
+# counters of a key, in this order
+FIELDS = ['n_responses', 'n_scored', 'n_correct', 'n_empty', 'sum_stringdist', 'sum_length']
+
+class ScoreCounters:
+    '''
+    Running scores of the responses of a run, printed every interval seconds
+    (None: only with report) and written to the csv file path if given.
+    '''
+    def __init__(self, interval=PROGRESS_INTERVAL, path=None):
+        self.interval = interval
+        self.path = path
+        # (model, alphabet, template_nr, itemid) and (model, alphabet, template_nr) -> counters
+        self.counts = {}
+        self.totals = {}
+        self.last_report = time.monotonic()
+
+    # add the response of a model to an item with correct response D, cleaned and scored by letstr_scoring
+    def add(self, model, alphabet, template_nr, itemid, D, response, cleaned_response, correct):
+        key = (model, alphabet, template_nr, itemid)
+        stringdist = get_stringdist(D, cleaned_response)
+        length = len(response) if isinstance(response, str) else 0
+        for counts in (self.counts.setdefault(key, [0] * len(FIELDS)), self.totals.setdefault(key[:3], [0] * len(FIELDS))):
+            counts[0] += 1
+            if (correct is not None):
+                counts[1] += 1
+                counts[2] += correct
+                counts[3] += cleaned_response == ''
+                counts[4] += stringdist
+            counts[5] += length
+        if (self.interval is not None and time.monotonic() - self.last_report >= self.interval):
+            self.report()
+            self.export()
+
+    # accuracy, mean string distance and mean response length of counters, None without scored responses
+    def get_means(self, counts):
+        n_responses, n_scored, n_correct, n_empty, sum_stringdist, sum_length = counts
+        if (n_scored == 0):
+            return None, None, sum_length / n_responses
+        return n_correct / n_scored, sum_stringdist / n_scored, sum_length / n_responses
+
+    def report(self):
+        self.last_report = time.monotonic()
+        for (model, alphabet, template_nr), counts in sorted(self.totals.items(), key = lambda item: tuple(map(str, item[0]))):
+            accuracy, stringdist, length = self.get_means(counts)
+            scores = 'no scored responses' if accuracy is None else f'accuracy {accuracy:.1%}, mean stringdist {stringdist:.2f}'
+            print(f'_____ Scores {model} {alphabet} template {template_nr}: {counts[0]} responses, {scores}, '
+                  f'mean length {length:.1f}, {counts[3]} empty _____')
+
+    # counters per item to the csv file, replaced in one step so readers never see a partial file
+    def export(self):
+        if (self.path is None):
+            return
+        if (os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        with open(self.path + '.tmp', 'w', newline = '') as f:
+            writer = csv.writer(f)
+            writer.writerow(['model', 'alphabet', 'template_nr', 'itemid'] + FIELDS + ['accuracy', 'mean_stringdist', 'mean_length'])
+            for key, counts in self.counts.items():
+                writer.writerow(list(key) + counts + ['' if mean is None else round(mean, 4) for mean in self.get_means(counts)])
+        os.replace(self.path + '.tmp', self.path)
@@ -0,0 +1,113 @@
+'''
+Provider-side prompt-prefix caching.
+With previous exchanges every prompt of a chain repeats the system prompt,
+the task instruction and example and the whole history so far. Providers
+can serve such a repeated prefix from their cache at a fraction of the
+price and latency:
+    anthropic  with the history as messages (letstr_conversation), the
+               last previous message gets a cache_control breakpoint. In
+               the flat format the user prompt is sent as one text block
+               per previous exchange plus one for the new item, with the
+               breakpoint on the last previous exchange. The next request
+               of the chain finds the prefix written by this request at
+               the boundary of that message or block.
+    gpt        prefixes of 1024 tokens or more are cached automatically,
+               as long as requests start with the same text (system
+               prompt first, then history, then the new item).
+Prefixes shorter than the provider minimum are never cached, so no
+breakpoint is set for them. Chains are started grouped by provider and
+model and ordered by their first prompt, so requests sharing a prefix run
+close together within the cache lifetime.
+
+TokenUsage collects input tokens served from the cache (cached), written
+to the cache (cache writes, anthropic only) and processed normally
+(uncached) per provider and model for the report at the end of a run.
+'''
+from letstr_scheduler import estimate_tokens
+
+# minimum number of prefix tokens a provider caches, a (provider, model) key overrides the provider minimum
+MIN_CACHE_TOKENS = {
+    'gpt': 1024,
+    'anthropic': 1024,
+    ('anthropic', 'claude-3-haiku-20240307'): 2048,
+}
+
+def get_min_cache_tokens(provider, model):
+    return MIN_CACHE_TOKENS.get((provider, model), MIN_CACHE_TOKENS.get(provider))
+
+# prefix_parts are the previous exchanges of a chain, their concatenation starts the prompt
+def split_prompt(prompt, prefix_parts):
+    prefix = ''.join(prefix_parts)
+    if (not prompt.startswith(prefix)):
+        raise ValueError('prefix_parts are not a prefix of the prompt')
+    return [part for part in prefix_parts if part != ''], prompt[len(prefix):]
+
+# anthropic user content of a prompt, with a cache breakpoint after the previous exchanges
+# once system prompt and previous exchanges are long enough to be cached
+def get_anthropic_content(prompt, model, system_prompt, prefix_parts=None):
+    if (not prefix_parts):
+        return prompt
+    parts, new = split_prompt(prompt, prefix_parts)
+    content = [{"type": "text", "text": part} for part in parts + [new] if part != '']
+    if (len(parts) > 0 and estimate_tokens(system_prompt + ''.join(parts)) >= get_min_cache_tokens('anthropic', model)):
+        content[len(parts) - 1]["cache_control"] = {"type": "ephemeral"}
+    return content
+
+# anthropic messages of a prompt after the history messages of a chain, with a cache breakpoint
+# on the last history message once system prompt and history are long enough to be cached
+def get_anthropic_messages(prompt, model, system_prompt, prefix_parts=None, history=None):
+    user = {"role": "user", "content": get_anthropic_content(prompt, model, system_prompt, prefix_parts)}
+    if (not history):
+        return [user]
+    messages = list(history)
+    n_tokens = estimate_tokens(system_prompt) + sum(estimate_tokens(message["content"]) for message in history)
+    if (n_tokens >= get_min_cache_tokens('anthropic', model)):
+        last = messages[-1]
+        messages[-1] = {"role": last["role"],
+                        "content": [{"type": "text", "text": last["content"], "cache_control": {"type": "ephemeral"}}]}
+    return messages + [user]
+
+# sort chains so chains of the same provider and model that share a prefix are started next to each other,
+# keys holds (provider, model, first prompt) of each chain
+def order_chains(chains, names, keys):
+    order = sorted(range(0, len(chains)), key = lambda i: keys[i])
+    return [chains[i] for i in order], [names[i] for i in order]
+
+# input and output tokens of a response, input split in cached, cache write and uncached tokens
+def get_usage(provider, response):
+    usage = getattr(response, 'usage', None)
+    if (usage is None):
+        return None
+    if (provider == 'anthropic'):
+        cached = getattr(usage, 'cache_read_input_tokens', None) or 0
+        cache_write = getattr(usage, 'cache_creation_input_tokens', None) or 0
+        return {'cached': cached, 'cache_write': cache_write, 'uncached': usage.input_tokens,
+                'output': usage.output_tokens}
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached = (getattr(details, 'cached_tokens', None) if details is not None else None) or 0
+    return {'cached': cached, 'cache_write': 0, 'uncached': (usage.prompt_tokens or 0) - cached,
+            'output': usage.completion_tokens or 0}
+
+class TokenUsage:
+    '''
+    Token counts per (provider, model) of the API calls of a run.
+    '''
+    def __init__(self):
+        self.counts = {}
+
+    def add(self, provider, model, response):
+        usage = get_usage(provider, response)
+        if (usage is None):
+            return
+        counts = self.counts.setdefault((provider, model), {'requests': 0, 'cached': 0, 'cache_write': 0, 'uncached': 0, 'output': 0})
+        counts['requests'] += 1
+        for key, value in usage.items():
+            counts[key] += value
+
+    def report(self):
+        for (provider, model), counts in sorted(self.counts.items()):
+            n_input = counts['cached'] + counts['cache_write'] + counts['uncached']
+            share = counts['cached'] / n_input if n_input else 0.0
+            print(f"_____ Tokens {provider} {model}: {counts['requests']} requests, {n_input} input "
+                  f"({counts['cached']} cached {share:.1%}, {counts['cache_write']} cache writes, "
+                  f"{counts['uncached']} uncached), {counts['output']} output _____")
@@ -0,0 +1,175 @@
+'''
+Bootstrap confidence intervals and permutation tests of accuracy for the
+comparison of models and human groups in analysis/letterstring_analyze.R.
+The LLM results (letstr_llm_all_data.csv or the letstr_ingest store) and
+data_humans/04_letterstring_response_humans_scored.csv are combined as
+in R: excluded participants are dropped, models get their short names and
+every testlet of a model is a participant.
+Responses are summed per participant first, so resampling works on the
+participants of a cell: all bootstrap draws of a cell are one (resamples x
+participants) index matrix, and all permutations of a comparison are one
+matrix of shuffled participant orders, so a participant (a testlet for a
+model) keeps its responses together. Cells run across a process pool, each
+with its own seed spawned from --seed, and the results are tidy tables
+with one row per cell or comparison.
+
+    python letstr_resampling.py --by participant_group,alphabet --reference Adults
+'''
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+DEFAULT_LLM_PATH = 'data_llms/letstr_llm_all_data.csv'
+DEFAULT_HUMAN_PATH = 'data_humans/04_letterstring_response_humans_scored.csv'
+
+# short model names of letterstring_analyze.R, used as participant group
+MODEL_SHORT_NAMES = {
+    'claude-3-5-sonnet-20241022': 'Claude-3.5',
+    'claude-3-sonnet-20240229': 'Claude-3',
+    'gpt-3_text-davinci-003': 'GPT-3',
+    'gpt-3.5-turbo-0125': 'GPT-3.5',
+    'gpt-4-0613': 'GPT-4',
+    'gpt-4o-2024-08-06': 'GPT-4o',
+    'meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo': 'Llama-3.1 8B',
+    'meta-llama/Meta-Llama-3.1-70B-Instruct-Turbo': 'Llama-3.1 70B',
+    'meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo': 'Llama-3.1 405B',
+    'google/gemma-2-27b-it': 'Gemma-2 27B',
+    'google/gemma-2-9b-it': 'Gemma-2 9B',
+}
+HUMAN_GROUPS = {'adult': 'Adults', 'child': 'Children'}
+
+# LLM and human responses in one data frame with participant_id and participant_group,
+# llm_path is a csv file or the SQLite store of letstr_ingest
+def load_comparison_data(llm_path=DEFAULT_LLM_PATH, human_path=DEFAULT_HUMAN_PATH):
+    import pandas as pd
+    if (llm_path.endswith('.sqlite')):
+        from letstr_ingest import ResultsStore
+        store = ResultsStore(llm_path)
+        llms = store.read()
+        store.close()
+    else:
+        llms = pd.read_csv(llm_path, keep_default_na = False, na_values = ['NA'])
+    llms['participant_group'] = llms['model'].map(MODEL_SHORT_NAMES).fillna(llms['model'])
+    llms['participant_id'] = llms['participant_group'] + '_' + llms['testletid'].astype(str)
+    humans = pd.read_csv(human_path, keep_default_na = False, na_values = ['NA'])
+    humans = humans[humans['exclude'] != 'exclude'].copy()
+    humans['participant_group'] = humans['participant_group'].map(HUMAN_GROUPS)
+    humans['participant_id'] = humans['participant_id'].astype(str)
+    return pd.concat([llms, humans], ignore_index = True)
+
+# sums and counts of value per participant of each cell, as {cell: (sums, counts)}
+def get_participant_sums(df, by, value='correct'):
+    df = df[df[value].notna()]
+    sums = df.groupby(by + ['participant_id'])[value].agg(['sum', 'count']).reset_index()
+    return {cell if isinstance(cell, tuple) else (cell,): (group['sum'].to_numpy(dtype = float), group['count'].to_numpy(dtype = float))
+            for cell, group in sums.groupby(by)}
+
+# mean, percentile interval and standard error of n_resamples participant bootstrap draws of one cell
+def bootstrap_cell(sums, counts, n_resamples, level, seed):
+    rng = np.random.default_rng(seed)
+    draws = rng.integers(0, len(sums), size = (n_resamples, len(sums)))
+    means = sums[draws].sum(axis = 1) / counts[draws].sum(axis = 1)
+    alpha = (1 - level) / 2
+    lower, upper = np.quantile(means, [alpha, 1 - alpha])
+    return sums.sum() / counts.sum(), lower, upper, means.std(ddof = 1)
+
+# difference of means of two cells and its two-sided p value, participants are shuffled between the cells
+def permutation_test(sums_1, counts_1, sums_2, counts_2, n_permutations, seed):
+    rng = np.random.default_rng(seed)
+    sums = np.concatenate([sums_1, sums_2])
+    counts = np.concatenate([counts_1, counts_2])
+    n_1 = len(sums_1)
+    difference = sums_1.sum() / counts_1.sum() - sums_2.sum() / counts_2.sum()
+    orders = np.argsort(rng.random((n_permutations, len(sums))), axis = 1)
+    sums = sums[orders]
+    counts = counts[orders]
+    differences = sums[:, :n_1].sum(axis = 1) / counts[:, :n_1].sum(axis = 1) - sums[:, n_1:].sum(axis = 1) / counts[:, n_1:].sum(axis = 1)
+    p_value = (1 + np.sum(np.abs(differences) >= abs(difference) - 1e-12)) / (n_permutations + 1)
+    return difference, p_value
+
+# tasks of a run as (function, arguments), each task gets its own seed
+def run_tasks(tasks, workers, seed):
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    if (workers == 1):
+        return [function(*arguments, task_seed) for (function, arguments), task_seed in zip(tasks, seeds)]
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = [pool.submit(function, *arguments, task_seed) for (function, arguments), task_seed in zip(tasks, seeds)]
+        return [future.result() for future in futures]
+
+# bootstrap table with one row per cell of the by columns
+def bootstrap_table(cells, by, n_resamples=10000, level=0.95, workers=None, seed=0):
+    import pandas as pd
+    tasks = [(bootstrap_cell, (sums, counts, n_resamples, level)) for sums, counts in cells.values()]
+    results = run_tasks(tasks, workers, seed)
+    rows = []
+    for (cell, (sums, counts)), (estimate, lower, upper, se) in zip(cells.items(), results):
+        rows.append(dict(zip(by, cell), n_participants = len(sums), n_responses = int(counts.sum()),
+                         estimate = estimate, ci_lower = lower, ci_upper = upper, se = se, n_resamples = n_resamples))
+    return pd.DataFrame(rows)
+
+# permutation table comparing the groups of group_column within the other by columns, every group
+# against reference, or all pairs of groups if reference is None
+def permutation_table(cells, by, group_column='participant_group', reference=None, n_permutations=10000, workers=None, seed=0):
+    import pandas as pd
+    position = by.index(group_column)
+    strata = {}
+    for cell in cells:
+        strata.setdefault(cell[:position] + cell[position + 1:], []).append(cell)
+    pairs = []
+    for stratum_cells in strata.values():
+        for i, cell_1 in enumerate(stratum_cells):
+            for cell_2 in stratum_cells[i + 1:]:
+                if (reference is None or reference in (cell_1[position], cell_2[position])):
+                    # the reference group is the second group of a comparison
+                    pairs.append((cell_2, cell_1) if cell_1[position] == reference else (cell_1, cell_2))
+    tasks = [(permutation_test, cells[cell_1] + cells[cell_2] + (n_permutations,)) for cell_1, cell_2 in pairs]
+    results = run_tasks(tasks, workers, seed)
+    rows = []
+    for (cell_1, cell_2), (difference, p_value) in zip(pairs, results):
+        row = {column: cell_1[k] for k, column in enumerate(by) if k != position}
+        row.update({'group_1': cell_1[position], 'group_2': cell_2[position], 'difference': difference,
+                    'p_value': p_value, 'n_permutations': n_permutations})
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm_path", default=DEFAULT_LLM_PATH, type=str, help="LLM results, letstr_llm_all_data.csv or the SQLite store of letstr_ingest.py")
+    parser.add_argument("--human_path", default=DEFAULT_HUMAN_PATH, type=str, help="Scored human responses")
+    parser.add_argument("--by", default='participant_group,alphabet', type=str, help="Comma separated columns defining the cells, must include participant_group for --reference")
+    parser.add_argument("--value", default='correct', type=str, help="Column to average, e.g. correct or stringdist")
+    parser.add_argument("--groups", default=None, type=str, help="Comma separated participant groups to include, default all")
+    parser.add_argument("--reference", default='Adults', type=str, help="Group every other group is compared to, or 'all' for all pairs of groups")
+    parser.add_argument("--n_resamples", default=10000, type=int, help="Bootstrap resamples and permutations per cell")
+    parser.add_argument("--level", default=0.95, type=float, help="Confidence level of the bootstrap intervals")
+    parser.add_argument("--workers", default=None, type=int, help="Worker processes, default one per CPU, 1 runs without a pool")
+    parser.add_argument("--seed", default=0, type=int, help="Seed of all resamples")
+    parser.add_argument("--output", default=None, type=str, help="Prefix of the output csv files <output>_bootstrap.csv and <output>_permutation.csv")
+    args = parser.parse_args()
+
+    by = args.by.split(',')
+    df = load_comparison_data(args.llm_path, args.human_path)
+    if (args.groups is not None):
+        df = df[df['participant_group'].isin(args.groups.split(','))]
+    cells = get_participant_sums(df, by, args.value)
+
+    start = time.perf_counter()
+    bootstrap = bootstrap_table(cells, by, args.n_resamples, args.level, args.workers, args.seed)
+    print(f'_____ Bootstrap: {len(cells)} cells x {args.n_resamples} resamples in {time.perf_counter() - start:.2f} s _____')
+    print(bootstrap.to_string(index = False, float_format = lambda value: f'{value:.3f}'))
+    permutation = None
+    if ('participant_group' in by):
+        start = time.perf_counter()
+        reference = None if args.reference == 'all' else args.reference
+        permutation = permutation_table(cells, by, 'participant_group', reference, args.n_resamples, args.workers, args.seed)
+        print(f'_____ Permutation tests: {len(permutation)} comparisons x {args.n_resamples} permutations in {time.perf_counter() - start:.2f} s _____')
+        print(permutation.to_string(index = False, float_format = lambda value: f'{value:.4f}'))
+    if (args.output is not None):
+        bootstrap.to_csv(f'{args.output}_bootstrap.csv', index = False)
+        if (permutation is not None):
+            permutation.to_csv(f'{args.output}_permutation.csv', index = False)
+        print(f'_____ Tables written to {args.output}_*.csv _____')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+'''
+Crash and resume check of the chains of the letter-string scripts.
+Every chain of a testlet is run three times against a stand-in engine
+that answers each prompt with a response derived from it, without an API:
+uninterrupted, then crashed after crash_after requests and resumed from
+the journal of the crashed run (as --resume does). The prompts a model
+is sent for every item, history included, must be the same in the
+uninterrupted and the crashed plus resumed run, so a resumed run
+continues exactly where the crashed run stopped.
+
+    python letstr_resume_check.py --testlet_nr 1 --crash_after 7
+'''
+import argparse
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import tempfile
+from letstr_journal import Journal, get_journal_path, parse_rowid_start
+
+# script, prev_exchange and conversation format of every checked setting
+SETTINGS = [('data_collection_letstr_llms', 1, 'flat'),
+            ('data_collection_letstr_llms', 1, 'messages'),
+            ('data_collection_letstr_llms_noprevmsg', 1, None),
+            ('data_collection_letstr_llms_noprevmsg', 0, None)]
+
+class Crash(Exception):
+    pass
+
+class NoScores:
+    def add(self, *args, **kwargs):
+        pass
+
+class StandInEngine:
+    '''
+    Engine of the chains that records the full prompt of every request by
+    (model, rowid) and answers with a response derived from it, so a
+    different history gives different responses. Requests after the first
+    crash_after raise Crash.
+    '''
+    def __init__(self, crash_after=None):
+        self.crash_after = crash_after
+        self.n_calls = 0
+        self.prompts = {}
+        self.scores = NoScores()
+
+    async def call(self, provider, prompt, model, prefix_parts=None, history=None, row_key=None):
+        if (self.crash_after is not None and self.n_calls >= self.crash_after):
+            raise Crash()
+        self.n_calls += 1
+        full_prompt = json.dumps((history or []) + [{"role": "user", "content": prompt}])
+        self.prompts[(model, row_key[1])] = full_prompt
+        return hashlib.sha256(full_prompt.encode('utf-8')).hexdigest()[:2]
+
+# prompts by (model, rowid) of all chains of one job, run until done or crashed
+def run_job(module, engine, journal, job, timestamp, df):
+    results = module.open_results(journal, job, timestamp)
+    chains = module.build_chains(engine, results, df, job, parse_rowid_start('0'))[0]
+    async def run_all():
+        return await asyncio.gather(*chains, return_exceptions = True)
+    errors = [res for res in asyncio.run(run_all()) if isinstance(res, BaseException) and not isinstance(res, Crash)]
+    results.close()
+    if (errors):
+        raise errors[0]
+    return engine.prompts
+
+# items whose prompts differ between an uninterrupted and a crashed and resumed run of one setting
+def check_setting(script, prev_exchange, conversation_format, testlet_nr, crash_after, models):
+    module = importlib.import_module(script)
+    df = module.load_items(testlet_nr, None)
+    with tempfile.TemporaryDirectory() as output_dir:
+        os.makedirs(os.path.join(output_dir, 'log'))
+        job = {'models': models, 'template_nr': 1, 'testlet_nr': testlet_nr, 'prev_exchange': prev_exchange, 'output_dir': output_dir}
+        if (conversation_format is not None):
+            job['conversation_format'] = conversation_format
+        prompts = {}
+        for run_id, crash in (('uninterrupted', None), ('crashed', crash_after), ('crashed', None)):
+            journal = Journal(get_journal_path(output_dir, run_id))
+            prompts.setdefault(run_id, {}).update(run_job(module, StandInEngine(crash), journal, job, run_id, df))
+            journal.close()
+    expected, resumed = prompts['uninterrupted'], prompts['crashed']
+    return sorted(key for key in expected.keys() | resumed.keys() if expected.get(key) != resumed.get(key)), len(expected)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--testlet_nr", default=1, type=int, help="Testlet of the item store to run")
+    parser.add_argument("--crash_after", default=7, type=int, help="Requests of the crashed run before it crashes")
+    parser.add_argument("--models", default='gpt', type=str, help="Model group whose models are run, gpt, together or anthropic")
+    args = parser.parse_args()
+
+    n_failed = 0
+    for script, prev_exchange, conversation_format in SETTINGS:
+        differ, n_items = check_setting(script, prev_exchange, conversation_format, args.testlet_nr, args.crash_after, args.models)
+        name = f"{script} prev_exchange {prev_exchange}" + (f" {conversation_format}" if conversation_format else '')
+        print(f'_____ {name}: {len(differ)} of {n_items} prompts differ after resuming _____')
+        if (differ):
+            print(f'!!!!! first differing items (model, rowid): {differ[:5]}')
+            n_failed += 1
+    raise SystemExit(1 if n_failed > 0 else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+'''
+Rule interpreter for letter-string items.
+Rules are written as in the rule_AB column of items/rulecheck_item_variations.csv,
+name(scope,n):
+    successor(scope,n)    letters in scope move n places forward in the alphabet
+    predecessor(scope,n)  letters in scope move n places back in the alphabet
+    repetition(scope,n)   letters in scope are repeated n times
+scope is all, first, second, third or last, or a position counted from 1.
+A rule maps A to B and C to D, so items and their gold answer D are
+computed for any alphabet (a letstr_alphabets.Alphabet or an ordered list
+of letters) and string length
+instead of being typed in. Rules that would move a letter past the start
+or end of the alphabet give no item. The next/previous-letter probes of
+items/nextprevletter_items_llms.csv are successor and predecessor rules applied
+to a single letter, see get_nextprev_rule.
+
+Items are generated lazily, so item sets of any size can be streamed
+without storing them:
+    for A, B, C, D in generate_items('successor(all,1)', alphabet, length = 2):
+        ...
+Run as a script to check the rules against the item files:
+    python letstr_rules.py
+'''
+import csv
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from letstr_alphabets import Alphabet, get_alphabet
+
+Rule = namedtuple('Rule', ['name', 'scope', 'n'])
+
+RULE_PATTERN = re.compile(r'^\s*(\w+)\s*\(\s*(\w+)\s*,\s*(\d+)\s*\)\s*$')
+SCOPES = {'first': 0, 'second': 1, 'third': 2, 'last': -1}
+
+@lru_cache(maxsize = None)
+def parse_rule(rule):
+    match = RULE_PATTERN.match(rule)
+    if (match is None):
+        raise ValueError(f'Cannot parse rule: {rule}, expected name(scope,n)')
+    name, scope, n = match.groups()
+    if (name not in RULES):
+        raise ValueError(f'Unknown rule: {name}, choose from {list(RULES)}')
+    if (scope != 'all' and scope not in SCOPES and not (scope.isdigit() and int(scope) >= 1)):
+        raise ValueError(f'Unknown scope: {scope}, use all, {", ".join(SCOPES)} or a position counted from 1')
+    return Rule(name, scope, int(n))
+
+# positions of the letters of a string of length length a scope applies to, None if outside the string.
+# Numeric scopes count from 1, so 0 or a negative position is outside the string and not the last letter
+def get_positions(scope, length):
+    if (scope == 'all'):
+        return range(0, length)
+    if (scope in SCOPES):
+        position = SCOPES[scope]
+    elif (int(scope) < 1):
+        return None
+    else:
+        position = int(scope) - 1
+    if (position >= length or position < -length):
+        return None
+    return [position % length]
+
+# rules on lists of letter indices, size is the length of the alphabet, None if the result leaves the alphabet
+def shift(indices, positions, n, size):
+    new_indices = list(indices)
+    for position in positions:
+        new_indices[position] += n
+        if (not 0 <= new_indices[position] < size):
+            return None
+    return new_indices
+
+def successor(indices, positions, n, size):
+    return shift(indices, positions, n, size)
+
+def predecessor(indices, positions, n, size):
+    return shift(indices, positions, -n, size)
+
+def repetition(indices, positions, n, size):
+    positions = set(positions)
+    return [index for i, index in enumerate(indices) for copy in range(0, n if i in positions else 1)]
+
+RULES = {'successor': successor, 'predecessor': predecessor, 'repetition': repetition}
+
+# alphabet of a list of letters, alphabets of the registry are used as they are
+def to_alphabet(alphabet):
+    return alphabet if isinstance(alphabet, Alphabet) else Alphabet('', alphabet)
+
+# rule applied to letter indices, None if the rule does not apply or leaves the alphabet
+def apply_rule_indices(rule, indices, size):
+    rule = parse_rule(rule) if isinstance(rule, str) else rule
+    positions = get_positions(rule.scope, len(indices))
+    if (positions is None):
+        return None
+    return RULES[rule.name](indices, positions, rule.n, size)
+
+# rule applied to a string of letters separated by spaces, e.g. apply_rule('successor(all,1)', 'c d', alphabet) is 'd e'
+def apply_rule(rule, string, alphabet):
+    alphabet = to_alphabet(alphabet)
+    indices = apply_rule_indices(rule, alphabet.encode(string), alphabet.size)
+    return None if indices is None else alphabet.decode(indices)
+
+# (string, answer) pairs of a rule for every run of length consecutive letters of the alphabet
+def generate_pairs(rule, alphabet, length=1):
+    alphabet = to_alphabet(alphabet)
+    rule = parse_rule(rule) if isinstance(rule, str) else rule
+    size = alphabet.size
+    for start in range(0, size - length + 1):
+        indices = list(range(start, start + length))
+        answer = apply_rule_indices(rule, indices, size)
+        if (answer is not None):
+            yield alphabet.decode(indices), alphabet.decode(answer)
+
+# (A, B, C, D) items of a rule, A and C are runs of length consecutive letters at least
+# min_distance letters apart, B and D the rule applied to them. Items are yielded one at a time
+def generate_items(rule, alphabet, length=1, min_distance=1):
+    alphabet = to_alphabet(alphabet)
+    pairs = list(generate_pairs(rule, alphabet, length))
+    starts = [alphabet.index[A.split()[0]] for A, B in pairs]
+    for (A, B), a_start in zip(pairs, starts):
+        for (C, D), c_start in zip(pairs, starts):
+            if (abs(c_start - a_start) >= min_distance):
+                yield A, B, C, D
+
+# rule of a next/previous-letter probe, prev_next is 'next' or 'prev'
+def get_nextprev_rule(prev_next, prev_next_dist):
+    name = 'successor' if prev_next == 'next' else 'predecessor'
+    return f'{name}(all,{prev_next_dist})'
+
+# (prev_next, prev_next_dist, stimulus, solution) probes of an alphabet for the given distances
+def generate_nextprev_probes(alphabet, distances=(1, 2)):
+    alphabet = to_alphabet(alphabet)
+    for stimulus in alphabet.letters:
+        for prev_next in ['prev', 'next']:
+            for dist in distances:
+                answer = apply_rule(get_nextprev_rule(prev_next, dist), stimulus, alphabet)
+                if (answer is not None):
+                    yield prev_next, dist, stimulus, answer
+
+# number of rows of the item files whose B and D (rulecheck) or solution (next/prev) differ from the rule
+def check_item_files():
+    n_wrong = 0
+    with open('items/rulecheck_item_variations.csv', newline = '') as f:
+        for row in csv.DictReader(f):
+            alphabet = get_alphabet(row['alphabet'], 'rulecheck')
+            if (apply_rule(row['rule_AB'], row['A'], alphabet) != row['B'] or apply_rule(row['rule_AB'], row['C'], alphabet) != row['D']):
+                print(f"!!!!! rulecheck {row['itemid']} {row['alphabet']} variation {row['variationid']}: {row['rule_AB']}")
+                n_wrong += 1
+    with open('items/nextprevletter_items_llms.csv', newline = '') as f:
+        for row in csv.DictReader(f):
+            rule = get_nextprev_rule(row['prev_next'], row['prev_next_dist'])
+            if (apply_rule(rule, row['stimulus'], get_alphabet(row['alphabet'], 'nextprevlet')) != row['solution']):
+                print(f"!!!!! nextprevletter {row['itemnr']}: {rule}")
+                n_wrong += 1
+    return n_wrong
+
+if __name__ == "__main__":
+    n_wrong = check_item_files()
+    print(f'_____ {n_wrong} items differ from their rule _____')
@@ -0,0 +1,199 @@
+'''
+Scheduler in front of the provider call functions.
+Every request waits for its provider/model requests-per-minute and
+tokens-per-minute budget and for a free concurrency slot of its provider.
+Concurrency grows additively while responses come back fast and is halved
+when a provider answers with a rate limit (429), is overloaded, or latency
+inflates. Rate limit and transient errors are retried with jittered
+exponential backoff instead of ending the run.
+'''
+import asyncio
+import random
+import time
+
+# requests and tokens per minute budget per provider, a (provider, model) key overrides
+# the provider budget for one model. Set these to the limits of your account tier.
+RATE_LIMITS = {
+    'gpt': {'rpm': 500, 'tpm': 200000},
+    'together': {'rpm': 600, 'tpm': 180000},
+    'anthropic': {'rpm': 50, 'tpm': 40000},
+}
+
+# http status codes and error names that are worth retrying
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRY_ERROR_NAMES = {'RateLimitError', 'APIConnectionError', 'APITimeoutError', 'InternalServerError',
+                     'ServiceUnavailableError', 'Timeout', 'TimeoutError', 'OverloadedError'}
+# status codes and error names that signal the provider wants us to slow down
+THROTTLE_STATUS_CODES = {429, 503, 529}
+THROTTLE_ERROR_NAMES = {'RateLimitError', 'ServiceUnavailableError', 'OverloadedError'}
+
+# rough token estimate for budgeting, about 4 characters per token
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+def get_status_code(err):
+    status = getattr(err, 'status_code', None) or getattr(err, 'http_status', None)
+    if (status is None and getattr(err, 'response', None) is not None):
+        status = getattr(err.response, 'status_code', None)
+    return status
+
+def is_retryable(err):
+    return get_status_code(err) in RETRY_STATUS_CODES or type(err).__name__ in RETRY_ERROR_NAMES
+
+def is_throttled(err):
+    return get_status_code(err) in THROTTLE_STATUS_CODES or type(err).__name__ in THROTTLE_ERROR_NAMES
+
+# seconds to wait as requested by the provider in the retry-after header, None if not given
+def get_retry_after(err):
+    headers = getattr(getattr(err, 'response', None), 'headers', None)
+    if (headers is None):
+        return None
+    try:
+        if (headers.get('retry-after-ms') is not None):
+            return float(headers.get('retry-after-ms')) / 1000
+        if (headers.get('retry-after') is not None):
+            return float(headers.get('retry-after'))
+    except ValueError:
+        return None
+    return None
+
+class TokenBucket:
+    '''
+    Budget of amount per minute that refills continuously,
+    e.g. requests or tokens per minute.
+    '''
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self, amount=1):
+        # a single request larger than the whole budget only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        while True:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            if (self.level >= amount):
+                self.level -= amount
+                return
+            await asyncio.sleep((amount - self.level) / self.rate)
+
+class AdaptiveLimiter:
+    '''
+    Concurrency limit with additive increase and multiplicative decrease.
+    The limit grows by about one slot per round of successful requests and is
+    multiplied by decrease_factor on throttling or when a response takes more
+    than latency_factor times the smoothed baseline latency, at most once per
+    cooldown seconds.
+    '''
+    def __init__(self, max_limit, initial_limit=2, latency_factor=2.5, decrease_factor=0.5, cooldown=2.0):
+        self.max_limit = max(1, max_limit)
+        self.limit = float(min(initial_limit, self.max_limit))
+        self.latency_factor = latency_factor
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.baseline = None
+        self.last_decrease = 0.0
+        self.condition = None
+
+    def get_condition(self):
+        if (self.condition is None):
+            self.condition = asyncio.Condition()
+        return self.condition
+
+    async def acquire(self):
+        condition = self.get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    def decrease(self):
+        now = time.monotonic()
+        if (now - self.last_decrease >= self.cooldown):
+            self.limit = max(1.0, self.limit * self.decrease_factor)
+            self.last_decrease = now
+
+    def increase(self):
+        self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+    # release a slot, with the latency of a successful request or throttled=True
+    async def release(self, latency=None, throttled=False):
+        condition = self.get_condition()
+        async with condition:
+            self.in_flight -= 1
+            if (throttled):
+                self.decrease()
+            elif (latency is not None):
+                if (self.baseline is None):
+                    self.baseline = latency
+                if (latency > self.latency_factor * self.baseline):
+                    self.decrease()
+                else:
+                    self.increase()
+                    self.baseline = 0.9 * self.baseline + 0.1 * latency
+            condition.notify_all()
+
+class Scheduler:
+    '''
+    Sends requests through the rate budgets and adaptive concurrency limits.
+    max_concurrency maps provider to the upper bound of its concurrency,
+    rate_limits defaults to RATE_LIMITS.
+    '''
+    def __init__(self, max_concurrency, rate_limits=None, max_retries=8, backoff_base=1.0, backoff_max=60.0):
+        self.max_concurrency = max_concurrency
+        self.rate_limits = RATE_LIMITS if rate_limits is None else rate_limits
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiters = {}
+        self.budgets = {}
+
+    def get_limiter(self, provider):
+        if (provider not in self.limiters):
+            self.limiters[provider] = AdaptiveLimiter(self.max_concurrency.get(provider, 1))
+        return self.limiters[provider]
+
+    # requests and tokens per minute buckets of a provider and model
+    def get_budget(self, provider, model):
+        if ((provider, model) not in self.budgets):
+            limits = self.rate_limits.get((provider, model), self.rate_limits.get(provider, {}))
+            rpm = TokenBucket(limits['rpm']) if 'rpm' in limits else None
+            tpm = TokenBucket(limits['tpm']) if 'tpm' in limits else None
+            self.budgets[(provider, model)] = (rpm, tpm)
+        return self.budgets[(provider, model)]
+
+    # full jitter exponential backoff
+    def get_backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    # run request (a coroutine function without arguments) for provider and model,
+    # tokens is the estimated number of input plus output tokens of the request
+    async def call(self, provider, model, request, tokens=1):
+        limiter = self.get_limiter(provider)
+        rpm, tpm = self.get_budget(provider, model)
+        for attempt in range(0, self.max_retries + 1):
+            if (rpm is not None):
+                await rpm.acquire(1)
+            if (tpm is not None):
+                await tpm.acquire(tokens)
+            await limiter.acquire()
+            start = time.monotonic()
+            try:
+                result = await request()
+            except Exception as err:
+                await limiter.release(throttled = is_throttled(err))
+                if (not is_retryable(err) or attempt == self.max_retries):
+                    raise
+                retry_after = get_retry_after(err)
+                if (retry_after is not None):
+                    delay = retry_after + random.uniform(0, 1)
+                else:
+                    delay = self.get_backoff(attempt)
+                print(f'..... {provider} {model}: {type(err).__name__}, retry {attempt + 1}/{self.max_retries} in {delay:.1f}s')
+                await asyncio.sleep(delay)
+                continue
+            await limiter.release(latency = time.monotonic() - start)
+            return result
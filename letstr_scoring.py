@@ -0,0 +1,179 @@
+'''
+Response cleaning and scoring in Python, giving the same cleaned_response
+and correct values as clean_llm_responses and score_response_correct in
+data_llms/letstr_helper_dataprep.R, so the collection scripts score every
+item as its response comes in.
+The R passes are kept in their order (including what they do rather than
+what their comments say: the '.' pass removes dots only, the lowercase
+result is overwritten by the Greek character pass, and the Symbol pattern
+only removes '/' and characters followed by '}'), but all regexes are
+compiled once, the per-letter Greek <-> Latin loops are one alternation
+with a dict lookup each, and cleaned responses are memoized per
+(response, alphabet), as most responses are short and repeat.
+
+Check against the R scores in data_llms/letstr_llm_all_data.csv and
+benchmark against R (if Rscript is installed):
+    python letstr_scoring.py
+'''
+import argparse
+import os
+import re
+import subprocess
+import time
+from functools import lru_cache
+from letstr_alphabets import GREEK_CHARACTERS, GREEK_TO_LATIN, LATIN_TO_GREEK
+
+# passes of clean_llm_responses, in order
+GREEK_CHARACTER_PATTERN = re.compile('|'.join(GREEK_CHARACTERS))
+DOTS_PATTERN = re.compile(r'\.')
+# R's regex engine matches newlines with '.'
+SYS_PATTERN = re.compile(r'<</SYS>>.*', re.DOTALL)
+CHANGES_TO_PATTERN = re.compile(r'.*changes to', re.DOTALL)
+ARROW_PATTERN = re.compile(r'→.*', re.DOTALL)
+BRACKET_PATTERN = re.compile(r'].*', re.DOTALL)
+GREEK_WORD_PATTERN = re.compile(r'\b(' + '|'.join(GREEK_TO_LATIN) + r')\b', re.IGNORECASE)
+NONLETTER_PATTERN = re.compile(r'[^a-z ]')
+NONSYMBOL_PATTERN = re.compile(r'[^@%!^#~${=:)*(-+_;<>& ]}|/')
+WORD_PATTERN = re.compile(r'\b\w{2,}\b')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+LATIN_LETTER_PATTERN = re.compile(r'\b(' + '|'.join(LATIN_TO_GREEK) + r')\b')
+
+# recode_greek_to_latin of the R helpers, Greek letter names in any case -> Latin letters
+def recode_greek_to_latin(text):
+    return GREEK_WORD_PATTERN.sub(lambda match: GREEK_TO_LATIN[match.group(1).lower()], text)
+
+# recode_latin_to_greek of the R helpers, single Latin letters -> Greek letter names
+def recode_latin_to_greek(text):
+    return LATIN_LETTER_PATTERN.sub(lambda match: LATIN_TO_GREEK[match.group(1)], text)
+
+# cleaned response of clean_llm_responses for a response to an item of an alphabet, None if there is no response
+@lru_cache(maxsize = 100000)
+def clean_response(response, alphabet):
+    if (response is None):
+        return None
+    text = GREEK_CHARACTER_PATTERN.sub(lambda match: GREEK_CHARACTERS[match.group(0)], str(response))
+    text = DOTS_PATTERN.sub('', text)
+    text = SYS_PATTERN.sub('', text)
+    text = CHANGES_TO_PATTERN.sub('', text)
+    text = ARROW_PATTERN.sub('', text)
+    text = BRACKET_PATTERN.sub('', text)
+    text = recode_greek_to_latin(text)
+    if (alphabet != 'Symbol'):
+        text = NONLETTER_PATTERN.sub('', text)
+    else:
+        text = NONSYMBOL_PATTERN.sub('', text)
+    text = WORD_PATTERN.sub('', text)
+    text = WHITESPACE_PATTERN.sub(' ', text).strip()
+    if (alphabet == 'Greek'):
+        text = recode_latin_to_greek(text)
+    return text
+
+# score_response_correct of the R helpers as an integer, 1 if the cleaned response is the correct response,
+# None if there is no response
+def score_response(cleaned_response, correct_response):
+    if (cleaned_response is None or correct_response is None):
+        return None
+    return int(cleaned_response == str(correct_response))
+
+# OSA distance (stringdist method "osa") of two token lists, one pair at a time,
+# see letstr_stringdist for many pairs at once
+def osa_distance(a, b):
+    d = [[i + j if i == 0 or j == 0 else 0 for j in range(0, len(b) + 1)] for i in range(0, len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if (i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)
+    return d[len(a)][len(b)]
+
+# stringdist column of letstr_llm_dat_combine.R, OSA distance with Greek recoded to Latin and spaces removed,
+# None if there is no response
+def get_stringdist(correct_response, cleaned_response):
+    if (cleaned_response is None or correct_response is None):
+        return None
+    return osa_distance(recode_greek_to_latin(str(correct_response)).replace(' ', ''), recode_greek_to_latin(cleaned_response).replace(' ', ''))
+
+# cleaned response and score of a response to an item with correct response D
+def clean_and_score(response, alphabet, D):
+    cleaned_response = clean_response(response, alphabet)
+    return cleaned_response, score_response(cleaned_response, D)
+
+# clean_llm_responses and scoring of letstr_llm_dat_combine.R on a data frame with columns response, alphabet and D,
+# adds cleaned_response, correct_response and correct. Distinct (response, alphabet) pairs are cleaned once
+def score_responses(df):
+    import pandas as pd
+    responses = df['response'].astype(object).where(df['response'].notna(), None)
+    pairs = pd.MultiIndex.from_arrays([responses, df['alphabet']])
+    codes, uniques = pd.factorize(pairs)
+    cleaned = [clean_response(response, alphabet) for response, alphabet in uniques]
+    df = df.copy()
+    df['cleaned_response'] = [cleaned[code] for code in codes]
+    df['correct_response'] = df['D']
+    df['correct'] = [score_response(cleaned_response, D) for cleaned_response, D in zip(df['cleaned_response'], df['D'])]
+    df['correct'] = df['correct'].astype('Int64')
+    return df
+
+# R script timing clean_llm_responses and score_response_correct on a csv file n times
+R_BENCHMARK = '''
+suppressMessages({{library(dplyr); library(stringr)}})
+source("{helpers}")
+dat <- read.csv("{path}")
+start <- Sys.time()
+for (i in 1:{repeats}) {{
+  scored <- dat %>% clean_llm_responses() %>% mutate(correct = as.integer(score_response_correct(cleaned_response, D)))
+}}
+cat(as.numeric(difftime(Sys.time(), start, units = "secs")) / {repeats})
+'''
+
+# seconds per run of the R implementation, None if Rscript or its packages are not available
+def time_r(path, helpers, repeats):
+    script = R_BENCHMARK.format(helpers = helpers, path = path, repeats = repeats)
+    try:
+        output = subprocess.run(['Rscript', '-e', script], capture_output = True, text = True,
+                                cwd = os.path.dirname(os.path.abspath(helpers)))
+    except FileNotFoundError:
+        return None
+    if (output.returncode != 0):
+        print(f'!!!!! Rscript failed: {output.stderr.strip()}')
+        return None
+    return float(output.stdout.strip())
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default='data_llms/letstr_llm_all_data.csv', type=str, help="Csv file with responses scored in R")
+    parser.add_argument("--helpers", default='data_llms/letstr_helper_dataprep.R', type=str, help="R helpers with clean_llm_responses")
+    parser.add_argument("--repeats", default=5, type=int, help="Number of timed runs")
+    args = parser.parse_args()
+
+    import pandas as pd
+    dat = pd.read_csv(args.path, keep_default_na = False, na_values = ['NA'])
+
+    # same values as R
+    scored = score_responses(dat)
+    expected_cleaned = dat['cleaned_response'].astype(object).where(dat['cleaned_response'].notna(), None)
+    cleaned_differ = [i for i, (a, b) in enumerate(zip(scored['cleaned_response'], expected_cleaned)) if a != b]
+    correct_differ = (scored['correct'].astype('float') != dat['correct'].astype('float')).sum()
+    for i in cleaned_differ[:10]:
+        print(f"!!!!! rowid {dat['rowid'].iloc[i]} {dat['model'].iloc[i]}: {dat['response'].iloc[i]!r} -> "
+              f"{scored['cleaned_response'].iloc[i]!r}, R: {expected_cleaned.iloc[i]!r}")
+    print(f'_____ {len(dat)} responses, {len(cleaned_differ)} cleaned responses and {correct_differ} scores differ from R _____')
+
+    # timings, every run starts with an empty memo table
+    start = time.perf_counter()
+    for i in range(0, args.repeats):
+        clean_response.cache_clear()
+        score_responses(dat)
+    python_seconds = (time.perf_counter() - start) / args.repeats
+    start = time.perf_counter()
+    for i in range(0, args.repeats):
+        score_responses(dat)
+    memo_seconds = (time.perf_counter() - start) / args.repeats
+    print(f'_____ Python: {python_seconds * 1000:.1f} ms per run, {memo_seconds * 1000:.1f} ms with a filled memo table _____')
+    r_seconds = time_r(os.path.abspath(args.path), args.helpers, args.repeats)
+    if (r_seconds is None):
+        print('_____ R: not timed, Rscript with dplyr and stringr is not available _____')
+    else:
+        print(f'_____ R: {r_seconds * 1000:.1f} ms per run, Python is {r_seconds / python_seconds:.1f}x faster _____')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+'''
+Similarity of the response patterns of human participants and LLMs: which
+participants does the pattern of a model resemble, per alphabet.
+Every responder (a human participant, or model x template x testlet) is a
+vector over the items (itemid, alphabet) of its correctness or of its
+error category (letstr_errors), missing where it has no response. Pairs
+are compared on the items both answered, with agreement (share of equal
+values), Cohen's kappa (agreement corrected for the chance agreement of the
+two responders' value distributions on those items) and, for correctness,
+the Pearson (phi) correlation. All are sums over items, so for one-hot
+value matrices and answered masks every pairwise count is a matrix
+product: the whole responders x responders matrices are computed with a
+few matrix products per block of rows, in blocks of chunk_size rows so
+memory stays bounded for many responders.
+
+    python letstr_similarity.py --alphabets Latin,Greek,Symbol --top 3
+'''
+import argparse
+import time
+import numpy as np
+from letstr_resampling import load_comparison_data, DEFAULT_LLM_PATH, DEFAULT_HUMAN_PATH
+
+VALUES = ['correct', 'category']
+METRICS = ['n_items', 'agreement', 'kappa', 'correlation']
+
+# responder of each row: participant_id of humans, participant group (short model name), template and testlet of LLMs
+def get_responders(df):
+    llm = df['template_nr'].notna()
+    responders = df['participant_id'].astype(str).copy()
+    responders[llm] = (df.loc[llm, 'participant_group'] + '_t' + df.loc[llm, 'template_nr'].astype(int).astype(str)
+                       + '_' + df.loc[llm, 'testletid'].astype(int).astype(str))
+    return responders
+
+# code matrix (responders x items) of a value column, -1 where a responder has no value for an item,
+# with the responders (responder, participant_group), the items (itemid, alphabet) and the labels of the codes.
+# The first response of a responder to an item is kept
+def encode_responders(df, value='correct'):
+    import pandas as pd
+    df = df[df[value].notna()].drop_duplicates(['responder', 'itemid', 'alphabet'])
+    codes, labels = pd.factorize(df[value], sort = True)
+    responders = df[['responder', 'participant_group']].drop_duplicates('responder').reset_index(drop = True)
+    items = df[['itemid', 'alphabet']].drop_duplicates().sort_values(['alphabet', 'itemid']).reset_index(drop = True)
+    rows = pd.Index(responders['responder']).get_indexer(df['responder'])
+    columns = pd.MultiIndex.from_frame(items).get_indexer(pd.MultiIndex.from_frame(df[['itemid', 'alphabet']]))
+    matrix = np.full((len(responders), len(items)), -1, dtype = np.int16)
+    matrix[rows, columns] = codes
+    return matrix, responders, items, list(labels)
+
+# one-hot matrices (codes, responders, items) of a code matrix, all zero where the value is missing
+def get_one_hot(matrix, n_codes):
+    return np.stack([(matrix == code) for code in range(0, n_codes)]).astype(np.float64)
+
+# one-hot matrix as responders x (codes * items)
+def get_flat(one_hot):
+    return one_hot.transpose(1, 0, 2).reshape(one_hot.shape[1], -1)
+
+# n_items, agreement, kappa and correlation of every row of x with every row of y, nan for pairs with less than
+# min_items common items. correlation needs numeric codes (correctness) and is nan where a responder is constant
+def similarity_block(x, y_one_hot, y_mask, y_values, n_codes, min_items=2):
+    x_one_hot = get_one_hot(x, n_codes)
+    x_mask = (x >= 0).astype(np.float64)
+    n = x_mask @ y_mask.T
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        agreement = get_flat(x_one_hot) @ get_flat(y_one_hot).T / n
+        # chance agreement from each responder's shares of the codes on the common items
+        chance = sum((x_one_hot[code] @ y_mask.T) * (x_mask @ y_one_hot[code].T) for code in range(0, n_codes)) / n ** 2
+        kappa = np.where(chance < 1, (agreement - chance) / (1 - chance), np.nan)
+        x_values = np.where(x >= 0, x, 0).astype(np.float64)
+        sum_x = x_values @ y_mask.T
+        sum_y = x_mask @ y_values.T
+        covariance = n * (x_values @ y_values.T) - sum_x * sum_y
+        variance_x = n * (x_values ** 2 @ y_mask.T) - sum_x ** 2
+        variance_y = n * (x_mask @ (y_values ** 2).T) - sum_y ** 2
+        correlation = covariance / np.sqrt(variance_x * variance_y)
+    correlation[(variance_x <= 1e-9) | (variance_y <= 1e-9)] = np.nan
+    few = n < min_items
+    for matrix in (agreement, kappa, correlation):
+        matrix[few] = np.nan
+    return {'n_items': n.astype(np.int32), 'agreement': agreement, 'kappa': kappa, 'correlation': correlation}
+
+# similarity matrices {metric: (rows of x, rows of y)} of two code matrices over the same items, in blocks of chunk_size rows of x
+def similarity_matrices(x, y, n_codes, numeric=True, min_items=2, chunk_size=1024):
+    y_one_hot = get_one_hot(y, n_codes)
+    y_mask = (y >= 0).astype(np.float64)
+    y_values = np.where(y >= 0, y, 0).astype(np.float64)
+    blocks = [similarity_block(x[start:start + chunk_size], y_one_hot, y_mask, y_values, n_codes, min_items)
+              for start in range(0, len(x), chunk_size)]
+    matrices = {metric: np.concatenate([block[metric] for block in blocks]) for metric in METRICS}
+    if (not numeric):
+        matrices['correlation'][:] = np.nan
+    return matrices
+
+# similarity of the LLM responders with the human participants per alphabet ('all' for all items) and value,
+# in long format with one row per pair
+def compare_llms_humans(df, alphabets, values=VALUES, min_items=2, chunk_size=1024):
+    import pandas as pd
+    human = df['template_nr'].isna()
+    tables = []
+    for value in values:
+        matrix, responders, items, labels = encode_responders(df, value)
+        is_human = responders['responder'].isin(set(df.loc[human, 'responder'])).to_numpy()
+        for alphabet in alphabets:
+            columns = np.ones(len(items), dtype = bool) if alphabet == 'all' else (items['alphabet'] == alphabet).to_numpy()
+            x = matrix[np.ix_(~is_human, columns)]
+            y = matrix[np.ix_(is_human, columns)]
+            matrices = similarity_matrices(x, y, len(labels), value == 'correct', min_items, chunk_size)
+            table = pd.DataFrame({'alphabet': alphabet, 'value': value,
+                                  'llm_responder': np.repeat(responders['responder'].to_numpy()[~is_human], len(y)),
+                                  'model': np.repeat(responders['participant_group'].to_numpy()[~is_human], len(y)),
+                                  'human_participant': np.tile(responders['responder'].to_numpy()[is_human], len(x)),
+                                  'human_group': np.tile(responders['participant_group'].to_numpy()[is_human], len(x))})
+            for metric in METRICS:
+                table[metric] = matrices[metric].ravel()
+            tables.append(table)
+    return pd.concat(tables, ignore_index = True)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm_path", default=DEFAULT_LLM_PATH, type=str, help="LLM results, letstr_llm_all_data.csv or the SQLite store of letstr_ingest.py")
+    parser.add_argument("--human_path", default=DEFAULT_HUMAN_PATH, type=str, help="Scored human responses")
+    parser.add_argument("--alphabets", default='Latin,Greek,Symbol,all', type=str, help="Comma separated alphabets to compare on, 'all' for all items")
+    parser.add_argument("--values", default='correct,category', type=str, help="Comma separated response vectors: correct and/or category (letstr_errors)")
+    parser.add_argument("--metric", default='kappa', type=str, help="Metric of the summary: agreement, kappa or correlation")
+    parser.add_argument("--top", default=3, type=int, help="Most similar human participants per model in the summary")
+    parser.add_argument("--min_items", default=2, type=int, help="Minimum number of common items of a pair")
+    parser.add_argument("--chunk_size", default=1024, type=int, help="Rows per block of the similarity matrices")
+    parser.add_argument("--output", default=None, type=str, help="Csv file for all LLM x human pairs")
+    args = parser.parse_args()
+
+    df = load_comparison_data(args.llm_path, args.human_path)
+    df['responder'] = get_responders(df)
+    values = args.values.split(',')
+    if ('category' in values):
+        from letstr_errors import classify_responses
+        df['category'] = classify_responses(df)['error_category']
+
+    start = time.perf_counter()
+    pairs = compare_llms_humans(df, args.alphabets.split(','), values, args.min_items, args.chunk_size)
+    print(f"_____ {df['responder'].nunique()} responders, {len(pairs)} LLM x human pairs compared in {time.perf_counter() - start:.2f} s _____")
+
+    # mean similarity of each model to the human groups and its most similar participants, over the model's testlets
+    means = pairs.groupby(['value', 'alphabet', 'model', 'human_group', 'human_participant'], sort = False)[args.metric].mean().reset_index()
+    for (value, alphabet), group in means.groupby(['value', 'alphabet'], sort = False):
+        print(f'_____ {args.metric} of {value} vectors, {alphabet} _____')
+        for model, model_group in group.groupby('model'):
+            groups = ', '.join(f'{human_group} {mean:.2f}' for human_group, mean in model_group.groupby('human_group')[args.metric].mean().items())
+            top = model_group.nlargest(args.top, args.metric)
+            closest = ', '.join(f'{participant} ({human_group}) {mean:.2f}' for participant, human_group, mean
+                                in zip(top['human_participant'], top['human_group'], top[args.metric]))
+            print(f'{model}: {groups}; closest {closest}')
+
+    # all responders against all responders, the size of a full run
+    matrix, responders, items, labels = encode_responders(df, values[0])
+    start = time.perf_counter()
+    similarity_matrices(matrix, matrix, len(labels), values[0] == 'correct', args.min_items, args.chunk_size)
+    print(f'_____ {len(responders)} x {len(responders)} responders over {len(items)} items in {time.perf_counter() - start:.2f} s _____')
+
+    if (args.output is not None):
+        pairs.to_csv(args.output, index = False)
+        print(f'_____ {len(pairs)} pairs written to {args.output} _____')
+
+if __name__ == "__main__":
+    main()
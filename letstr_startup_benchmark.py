@@ -0,0 +1,71 @@
+'''
+Startup benchmark of the data collection scripts with python -X importtime.
+Every scenario is run n_runs times in a fresh interpreter; the total import
+time is the sum of the cumulative times of the top-level imports reported
+by -X importtime, wall is the time until the interpreter exits.
+The eager scenario imports what every script imported at module top before
+SDKs were loaded lazily and items were read without pandas.
+
+    python letstr_startup_benchmark.py --n_runs 10
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPTS = ['data_collection_letstr_llms', 'data_collection_letstr_llms_noprevmsg',
+           'data_collection_letstr_rulecheck_llms', 'data_collection_nextprevlet_llms']
+
+# scenario name and the python statement it runs
+SCENARIOS = [('eager (old module top)', 'import numpy, pandas, requests, openai, together, anthropic')] + \
+            [(script, f'import {script}') for script in SCRIPTS] + \
+            [('letstr + gpt client', "import data_collection_letstr_llms; import letstr_clients; letstr_clients.build_client('gpt')"),
+             ('letstr + read testlet', "import data_collection_letstr_llms as m; m.get_items('items/testlets/letterstring_testlet0.csv')")]
+
+# total import time in seconds from the -X importtime report on stderr
+def parse_importtime(report):
+    total = 0
+    for line in report.splitlines():
+        if (not line.startswith('import time:')):
+            continue
+        parts = line.split('|')
+        # top-level imports are not indented, nested imports are counted in their cumulative time
+        if (len(parts) == 3 and parts[1].strip().isdigit() and not parts[2].startswith('  ')):
+            total += int(parts[1])
+    return total / 1e6
+
+def time_statement(statement):
+    # building a client needs an api key but makes no request
+    env = dict(os.environ, OPENAI_API_KEY = os.getenv('OPENAI_API_KEY') or 'benchmark')
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                             capture_output = True, text = True, check = True, env = env)
+    wall = time.perf_counter() - start
+    return parse_importtime(process.stderr), wall
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_runs", default=10, type=int, help="Runs per scenario, the median is reported")
+    parser.add_argument("--output", default=None, type=str, help="Optional json file to write the timings to")
+    args = parser.parse_args()
+
+    report = {}
+    print(f"{'scenario':>40} {'imports':>10} {'wall':>10}")
+    for name, statement in SCENARIOS:
+        # one warm-up run so the first scenario does not pay for cold file caches
+        time_statement(statement)
+        samples = [time_statement(statement) for i in range(0, args.n_runs)]
+        imports = statistics.median(sample[0] for sample in samples)
+        wall = statistics.median(sample[1] for sample in samples)
+        report[name] = {'statement': statement, 'imports': imports, 'wall': wall, 'samples': samples}
+        print(f'{name:>40} {imports * 1000:>8.1f}ms {wall * 1000:>8.1f}ms')
+
+    if (args.output is not None):
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 2)
+
+if __name__ == "__main__":
+    main()
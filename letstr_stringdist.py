@@ -0,0 +1,161 @@
+'''
+Optimal string alignment (OSA, restricted Damerau-Levenshtein) distances
+for many pairs of responses at once, as the stringdist column of
+data_llms/letstr_llm_dat_combine.R (stringdist(..., method = "osa") after
+Greek -> Latin recoding and removing spaces).
+Strings are split into tokens, characters as in R or whitespace separated
+words (letters and Greek letter names), and coded as integers padded to the
+longest string. The dynamic programming table is filled one row (token of
+the first string) at a time for all pairs together: deletions,
+substitutions and transpositions are whole-array operations on the
+previous two rows, and the insertions along a row are a running minimum
+(d[j] = min over k <= j of t[k] + j - k). Distinct strings are coded once.
+
+    osa_distances(D, cleaned_response)              # one distance per pair of strings
+    osa_matrix(responses, candidates)               # every response x every candidate
+    candidate_distances(df, ['A', 'B', 'C', 'D'])   # response of each row to the candidates of its row
+
+Check against the stringdist column of letstr_llm_all_data.csv and time a
+response x candidate matrix:
+    python letstr_stringdist.py
+'''
+import argparse
+import time
+import numpy as np
+from letstr_scoring import recode_greek_to_latin, osa_distance
+
+TOKEN_UNITS = ['character', 'word']
+
+# tokens of a string, None if missing. character: Greek letter names recoded to Latin letters and
+# spaces removed, as the stringdist column in R. word: whitespace separated tokens
+def tokenize(string, unit='character'):
+    if (string is None or (isinstance(string, float) and np.isnan(string))):
+        return None
+    if (unit == 'word'):
+        return str(string).split()
+    return list(recode_greek_to_latin(str(string)).replace(' ', ''))
+
+# integer codes of distinct strings, shape (n strings, longest string) padded with -1, and their lengths.
+# vocabulary maps tokens to codes and is extended with new tokens, share it between the strings compared.
+# Missing strings have length -1
+def encode(strings, vocabulary, unit='character'):
+    token_lists = [tokenize(string, unit) for string in strings]
+    n_tokens = max([len(tokens) for tokens in token_lists if tokens is not None] + [0])
+    codes = np.full((len(token_lists), n_tokens), -1, dtype = np.int32)
+    lengths = np.full(len(token_lists), -1, dtype = np.int32)
+    for i, tokens in enumerate(token_lists):
+        if (tokens is not None):
+            codes[i, :len(tokens)] = [vocabulary.setdefault(token, len(vocabulary)) for token in tokens]
+            lengths[i] = len(tokens)
+    return codes, lengths
+
+# OSA distances of coded strings a (..., La) and b (..., Lb) with lengths a_lengths (...) and b_lengths (...),
+# leading dimensions broadcast against each other, so a[:, None] and b[None, :] give a matrix of distances
+def osa_kernel(a, a_lengths, b, b_lengths):
+    shape = np.broadcast_shapes(a.shape[:-1], b.shape[:-1])
+    n_b = b.shape[-1]
+    j = np.arange(0, n_b + 1, dtype = np.int32)
+    b_lengths = np.broadcast_to(b_lengths, shape)
+    # row 0: j insertions
+    row = np.broadcast_to(j, shape + (n_b + 1,))
+    previous = None
+    distances = np.where(a_lengths == 0, b_lengths, 0).astype(np.int32)
+    for i in range(1, a.shape[-1] + 1):
+        token = a[..., i - 1:i]
+        cost = (token != b).astype(np.int32)
+        new_row = np.empty(shape + (n_b + 1,), dtype = np.int32)
+        new_row[..., 0] = i
+        # deletion and substitution
+        new_row[..., 1:] = np.minimum(row[..., 1:] + 1, row[..., :-1] + cost)
+        # transposition of the last two tokens
+        if (previous is not None and n_b > 1):
+            swapped = (token == b[..., :-1]) & (a[..., i - 2:i - 1] == b[..., 1:])
+            new_row[..., 2:] = np.where(swapped, np.minimum(new_row[..., 2:], previous[..., :-2] + 1), new_row[..., 2:])
+        # insertion, a running minimum along the row
+        new_row = np.minimum.accumulate(new_row - j, axis = -1) + j
+        previous, row = row, new_row
+        distances = np.where(a_lengths == i, np.take_along_axis(row, b_lengths[..., None].astype(np.intp), axis = -1)[..., 0], distances)
+    return distances
+
+# distinct strings of a list with the index of each string in them
+def get_distinct(strings):
+    index = {}
+    positions = [index.setdefault(string, len(index)) for string in strings]
+    return list(index), np.array(positions, dtype = np.intp)
+
+# OSA distance of each pair x[k], y[k] as a float array, nan where a string is missing
+def osa_distances(x, y, unit='character'):
+    x_distinct, x_positions = get_distinct([None if value != value else value for value in x])
+    y_distinct, y_positions = get_distinct([None if value != value else value for value in y])
+    vocabulary = {}
+    a, a_lengths = encode(x_distinct, vocabulary, unit)
+    b, b_lengths = encode(y_distinct, vocabulary, unit)
+    a, a_lengths, b, b_lengths = a[x_positions], a_lengths[x_positions], b[y_positions], b_lengths[y_positions]
+    distances = osa_kernel(a, a_lengths, b, b_lengths).astype(float)
+    return np.where((a_lengths < 0) | (b_lengths < 0), np.nan, distances)
+
+# OSA distances of every response to every candidate, shape (n responses, n candidates), nan where a string
+# is missing. Distances are computed for distinct responses, chunk_size responses at a time
+def osa_matrix(responses, candidates, unit='character', chunk_size=256):
+    response_distinct, response_positions = get_distinct([None if value != value else value for value in responses])
+    vocabulary = {}
+    a, a_lengths = encode(response_distinct, vocabulary, unit)
+    b, b_lengths = encode([None if value != value else value for value in candidates], vocabulary, unit)
+    distances = np.empty((len(response_distinct), len(b)), dtype = float)
+    # responses of similar length go in one chunk, which is only filled up to its longest response
+    order = np.argsort(a_lengths, kind = 'stable')
+    for start in range(0, len(order), chunk_size):
+        chunk = order[start:start + chunk_size]
+        n_tokens = max(int(a_lengths[chunk].max()), 0)
+        distances[chunk] = osa_kernel(a[chunk, None, :n_tokens], a_lengths[chunk, None], b[None, :, :], b_lengths[None, :])
+    missing = (a_lengths[:, None] < 0) | (b_lengths[None, :] < 0)
+    return np.where(missing, np.nan, distances)[response_positions]
+
+# OSA distance of the response of each row to the candidates of its row, as a data frame with
+# one column stringdist_<candidate column> per candidate column
+def candidate_distances(df, candidate_columns, response_column='cleaned_response', unit='character'):
+    import pandas as pd
+    responses = list(df[response_column]) * len(candidate_columns)
+    candidates = [value for column in candidate_columns for value in df[column]]
+    distances = osa_distances(responses, candidates, unit).reshape(len(candidate_columns), len(df))
+    return pd.DataFrame({f'stringdist_{column}': distances[k] for k, column in enumerate(candidate_columns)}, index = df.index)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default='data_llms/letstr_llm_all_data.csv', type=str, help="Csv file with the stringdist column computed in R")
+    parser.add_argument("--candidates_path", default='analysis/letstr_data_errorcoded.csv', type=str, help="Csv file with the candidate transformations of the error analysis")
+    parser.add_argument("--repeats", default=3, type=int, help="Number of timed runs")
+    args = parser.parse_args()
+
+    import pandas as pd
+    dat = pd.read_csv(args.path, keep_default_na = False, na_values = ['NA'])
+
+    # same values as R, the random token lists check transpositions beyond the responses in the data
+    distances = osa_distances(dat['D'], dat['cleaned_response'])
+    expected = dat['stringdist'].to_numpy(dtype = float)
+    n_differ = int((~((distances == expected) | (np.isnan(distances) & np.isnan(expected)))).sum())
+    print(f'_____ {len(dat)} responses, {n_differ} distances differ from R _____')
+    rng = np.random.default_rng(0)
+    x = [''.join(rng.choice(list('abcd'), size = rng.integers(0, 9))) for i in range(0, 2000)]
+    y = [''.join(rng.choice(list('abcd'), size = rng.integers(0, 9))) for i in range(0, 2000)]
+    n_differ = sum(int(distance) != osa_distance(list(a), list(b)) for distance, a, b in zip(osa_distances(x, y), x, y))
+    print(f'_____ {len(x)} random pairs, {n_differ} distances differ from the one pair at a time reference _____')
+
+    # every response x every candidate transformation of the error analysis
+    errors = pd.read_csv(args.candidates_path, keep_default_na = False, na_values = ['NA'])
+    candidate_columns = ['A', 'B', 'C', 'D'] + [column for column in errors.columns if column.endswith('_response') and column != 'cleaned_response']
+    candidates = pd.unique(errors[candidate_columns].to_numpy().reshape(-1))
+    candidates = [candidate for candidate in candidates if candidate == candidate and candidate != '']
+    start = time.perf_counter()
+    for i in range(0, args.repeats):
+        matrix = osa_matrix(dat['cleaned_response'], candidates)
+    seconds = (time.perf_counter() - start) / args.repeats
+    print(f'_____ {matrix.shape[0]} responses x {matrix.shape[1]} candidates = {matrix.size} pairs in {seconds:.2f} s _____')
+    start = time.perf_counter()
+    for i in range(0, args.repeats):
+        row_distances = candidate_distances(errors, candidate_columns)
+    seconds = (time.perf_counter() - start) / args.repeats
+    print(f'_____ {len(errors)} error-coded responses x their {len(candidate_columns)} candidates in {seconds:.2f} s _____')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+'''
+Telemetry of the API requests of a collection run, written next to the
+results: one row per request in <output_dir>/metrics/metrics_<run id>.csv,
+keyed to its results row by (results_file, model, rowid).
+A row holds the monotonic times since the start of the session at which
+the request was queued, its last attempt was sent, the response headers
+arrived (first byte, from an httpx response hook of the API clients) and
+the response was read, the input, cached, cache write and output tokens
+and finish reason of the response, and the number of retries. Responses
+from the letstr_cache response cache are rows with source 'cache'. A
+session is one process of the run, named by its wall-clock start time in
+the session column, so the rows of a resumed run are told apart from the
+rows of the run it resumes.
+At the end of a run p50/p95/p99 of latency (last attempt), time to first
+byte and total time (queue, rate budget waits and retries included) are
+reported per provider and model; metrics files of earlier runs are
+summarized with histograms by
+    python letstr_telemetry.py --path data_llms/results_letstr/metrics/metrics_20241115120000.csv
+'''
+import argparse
+import contextvars
+import csv
+import math
+import os
+import time
+from datetime import datetime
+from letstr_prompt_cache import get_usage
+
+# columns of a metrics file, times in seconds
+FIELDS = ['results_file', 'model', 'rowid', 'provider', 'source', 'status', 'queued', 'start', 'first_byte', 'end',
+          'ttfb', 'latency', 'total', 'retries', 'input_tokens', 'cached_tokens', 'cache_write_tokens', 'output_tokens',
+          'finish_reason', 'error', 'session']
+
+# upper bounds in seconds of the histogram bins of the summary
+HISTOGRAM_BINS = [0.25, 0.5, 1, 2, 4, 8, 16, math.inf]
+
+# request in flight in the current task or thread, set by the engine for the http hooks
+current_request = contextvars.ContextVar('letstr_current_request', default = None)
+
+def get_metrics_path(output_dir, run_id):
+    return os.path.join(output_dir, 'metrics', f'metrics_{run_id}.csv')
+
+# httpx response hook, called when the headers of a response have arrived and before its body is read
+def mark_first_byte(response):
+    request = current_request.get()
+    if (request is not None):
+        request.first_byte = time.monotonic()
+
+async def mark_first_byte_async(response):
+    mark_first_byte(response)
+
+# finish reason of a response, stop_reason for anthropic
+def get_finish_reason(provider, response):
+    if (provider == 'anthropic'):
+        return getattr(response, 'stop_reason', None)
+    choices = getattr(response, 'choices', None)
+    return getattr(choices[0], 'finish_reason', None) if choices else None
+
+class RequestMetrics:
+    '''
+    Telemetry of one request. Passed to the call functions as their usage
+    argument: add records tokens and finish reason of the response and
+    forwards it to the TokenUsage of the run.
+    '''
+    def __init__(self, provider, model, key=None, usage=None):
+        self.provider = provider
+        self.model = model
+        self.results_file, self.rowid = key if key is not None else (None, None)
+        self.usage = usage
+        self.source = 'api'
+        self.status = 'ok'
+        self.error = None
+        self.queued = time.monotonic()
+        self.start = None
+        self.first_byte = None
+        self.end = None
+        self.attempts = 0
+        self.tokens = None
+        self.finish_reason = None
+
+    # a new attempt of the request is sent
+    def begin_attempt(self):
+        self.attempts += 1
+        self.start = time.monotonic()
+        self.first_byte = None
+
+    def add(self, provider, model, response):
+        self.end = time.monotonic()
+        self.tokens = get_usage(provider, response)
+        self.finish_reason = get_finish_reason(provider, response)
+        if (self.usage is not None):
+            self.usage.add(provider, model, response)
+
+    def fail(self, err):
+        self.status = 'error'
+        self.error = type(err).__name__
+
+    # row of the metrics file, times relative to origin
+    def get_row(self, origin):
+        end = self.end if self.end is not None else time.monotonic()
+        def since(t):
+            return None if t is None else round(t - origin, 4)
+        def between(t_1, t_2):
+            return None if t_1 is None or t_2 is None else round(t_2 - t_1, 4)
+        tokens = self.tokens or {}
+        n_input = sum(tokens.get(key, 0) for key in ('cached', 'cache_write', 'uncached')) if tokens else None
+        return [self.results_file, self.model, self.rowid, self.provider, self.source, self.status,
+                since(self.queued), since(self.start), since(self.first_byte), since(end),
+                between(self.start, self.first_byte), between(self.start, end), between(self.queued, end),
+                max(0, self.attempts - 1), n_input, tokens.get('cached'), tokens.get('cache_write'), tokens.get('output'),
+                self.finish_reason, self.error]
+
+class Telemetry:
+    '''
+    Request telemetry of a run, rows are appended and flushed to the metrics
+    file path as requests finish (None: only the report at the end), so a
+    resumed run adds to the file of the run it resumes. Times are relative
+    to origin, the start of this session.
+    '''
+    def __init__(self, path=None):
+        self.path = path
+        self.origin = time.monotonic()
+        self.session = datetime.now().strftime("%Y%m%d%H%M%S")
+        self.f = None
+        # (provider, model) -> {'latency': [], 'ttfb': [], 'total': [], 'retries': 0, 'errors': 0}
+        self.samples = {}
+
+    def open(self):
+        if (os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.f = open(self.path, 'a', newline = '')
+        self.writer = csv.writer(self.f)
+        if (new):
+            self.writer.writerow(FIELDS)
+
+    # record of a new request, key is (results_file, rowid) of its results row
+    def start(self, provider, model, key=None, usage=None):
+        return RequestMetrics(provider, model, key, usage)
+
+    def finish(self, request):
+        row = request.get_row(self.origin) + [self.session]
+        if (request.source == 'api'):
+            samples = self.samples.setdefault((request.provider, request.model),
+                                              {'latency': [], 'ttfb': [], 'total': [], 'retries': 0, 'errors': 0})
+            for name, value in zip(('ttfb', 'latency', 'total'), row[10:13]):
+                if (value is not None and request.status == 'ok'):
+                    samples[name].append(value)
+            samples['retries'] += max(0, request.attempts - 1)
+            samples['errors'] += request.status == 'error'
+        if (self.path is not None):
+            if (self.f is None):
+                self.open()
+            self.writer.writerow(row)
+            self.f.flush()
+
+    def report(self):
+        from letstr_clients import latency_summary
+        for (provider, model), samples in sorted(self.samples.items()):
+            parts = []
+            for name in ('latency', 'ttfb', 'total'):
+                if (samples[name]):
+                    summary = latency_summary(samples[name])
+                    parts.append(f"{name} p50 {summary['p50']:.3f}s p95 {summary['p95']:.3f}s p99 {summary['p99']:.3f}s")
+            print(f"_____ Latency {provider} {model}: {len(samples['total'])} requests, {samples['retries']} retries, "
+                  f"{samples['errors']} failed, {', '.join(parts)} _____")
+
+    def close(self):
+        if (self.f is not None):
+            self.f.close()
+            self.f = None
+
+# counts of samples per bin of HISTOGRAM_BINS
+def get_histogram(samples):
+    counts = [0] * len(HISTOGRAM_BINS)
+    for value in samples:
+        counts[next(i for i, bound in enumerate(HISTOGRAM_BINS) if value < bound)] += 1
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", type=str, required=True, help="Comma separated metrics files of collection runs")
+    parser.add_argument("--metric", default='latency', type=str, help="latency, ttfb or total")
+    args = parser.parse_args()
+
+    from letstr_clients import latency_summary
+    samples = {}
+    for path in args.path.split(','):
+        with open(path, newline = '') as f:
+            for row in csv.DictReader(f):
+                if (row['source'] == 'api' and row['status'] == 'ok' and row[args.metric] != ''):
+                    samples.setdefault((row['provider'], row['model']), []).append(float(row[args.metric]))
+    labels = [f'<{bound:g}s' if bound != math.inf else f'>={HISTOGRAM_BINS[-2]:g}s' for bound in HISTOGRAM_BINS]
+    print(f"_____ {args.metric} per provider and model _____")
+    print(f"{'provider':<10} {'model':<45} {'n':>6} {'p50':>7} {'p95':>7} {'p99':>7}  " + ' '.join(f'{label:>6}' for label in labels))
+    for (provider, model), values in sorted(samples.items()):
+        summary = latency_summary(values)
+        print(f"{provider:<10} {model:<45} {summary['n']:>6} {summary['p50']:>7.3f} {summary['p95']:>7.3f} {summary['p99']:>7.3f}  "
+              + ' '.join(f'{count:>6}' for count in get_histogram(values)))
+
+if __name__ == "__main__":
+    main()